@@ -0,0 +1,122 @@
+"""
+Server-Sent Events of product changes, for clients that keep a local copy
+of the catalog. One event per change:
+
+    id: 42
+    event: update
+    data: {"version": 42, "product_id": 7, "op": "update", "product": {...}}
+
+product is the product as it is now (null once deleted), so applying an
+event twice, or out of date, does no harm. Clients start from the
+X-Changes-Version of the product list they loaded, remember the last id
+and reconnect with ?since=<id> (EventSource sends Last-Event-ID by itself)
+to get only what they missed.
+"""
+import asyncio
+import json
+
+from fastapi import HTTPException
+from sqlalchemy import func, text
+
+from app import changes, singleflight
+from app.config import CHANGE_STREAM_HEARTBEAT_SECONDS
+from app.database import SessionLocal
+from app.models import Product, ProductChange
+
+# Changes read, and sent, per query
+BATCH_SIZE = 500
+
+# Streams woken by the same change read the batch after their version once
+batches = singleflight.Group("change_batches")
+
+
+def latest_version(db) -> int:
+    """Version of the newest change ever made, pruned or not."""
+    seq = db.execute(text("SELECT seq FROM sqlite_sequence WHERE name = 'product_changes'")).scalar()
+    return seq or 0
+
+
+def start_version(since: int = None, session_factory=SessionLocal) -> int:
+    """
+    Version to stream from: since, or the newest one without it. 410 if
+    changes after since were pruned, or since is from another database;
+    the client has to reload the catalog then.
+    """
+    db = session_factory()
+    try:
+        latest = latest_version(db)
+        if since is None:
+            return latest
+        oldest = db.query(func.min(ProductChange.id)).scalar()
+        first_kept = oldest if oldest is not None else latest + 1
+    finally:
+        db.close()
+    if since > latest or since < first_kept - 1:
+        raise HTTPException(status_code=410, detail="Changes since this version are gone, reload the products")
+    return since
+
+
+def message(event: str, version: int, data: dict) -> str:
+    return f"id: {version}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def read_batch(version: int, describe, session_factory=SessionLocal) -> list:
+    """Up to BATCH_SIZE (version, message) pairs of the changes after version."""
+    db = session_factory()
+    try:
+        rows = (
+            db.query(ProductChange)
+            .filter(ProductChange.id > version)
+            .order_by(ProductChange.id)
+            .limit(BATCH_SIZE)
+            .all()
+        )
+        ids = {row.product_id for row in rows}
+        products = {p.id: p for p in db.query(Product).filter(Product.id.in_(ids))} if ids else {}
+        return [
+            (row.id, message(row.op, row.id, {
+                "version": row.id,
+                "product_id": row.product_id,
+                "op": row.op,
+                "product": describe(products[row.product_id]) if row.product_id in products else None,
+            }))
+            for row in rows
+        ]
+    finally:
+        db.close()
+
+
+async def stream(version: int, describe, session_factory=SessionLocal,
+                 heartbeat: float = CHANGE_STREAM_HEARTBEAT_SECONDS):
+    """
+    Events after version, then new ones as they are committed, here or in
+    another worker. A comment line every heartbeat seconds keeps proxies
+    from closing an idle stream. describe(product) gives the JSON of a
+    product; pass the same function to every stream, so their reads are shared.
+    """
+    loop = asyncio.get_running_loop()
+    wake = asyncio.Event()
+
+    def changed(events):
+        loop.call_soon_threadsafe(wake.set)
+
+    bus = changes.get_bus()
+    bus.subscribe(changed)
+    try:
+        yield message("ready", version, {"version": version})
+        while True:
+            # Cleared before reading, so a change committed during the read still wakes us
+            wake.clear()
+            batch = await batches.do_async(
+                (version, describe, session_factory), read_batch, version, describe, session_factory
+            )
+            for version, chunk in batch:
+                yield chunk
+            if len(batch) == BATCH_SIZE:
+                continue
+            try:
+                await asyncio.wait_for(wake.wait(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+    finally:
+        bus.unsubscribe(changed)
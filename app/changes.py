@@ -0,0 +1,193 @@
+"""
+Product change notifications, across worker processes.
+
+A transaction that creates, updates or deletes products also inserts one
+product_changes row per product; the row id is the change's version, and
+versions grow in commit order (SQLite has one writer at a time). Once the
+transaction commits, the bus hands the changes to its subscribers in this
+process. SQLiteBus also watches PRAGMA data_version, which moves whenever
+another connection commits, and delivers the rows other workers added
+within CHANGE_POLL_MS.
+"""
+import logging
+import os
+import secrets
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, event, func, insert, select
+from sqlalchemy.orm import Session
+
+from app.config import CHANGE_BUS, CHANGE_LOG_RETENTION_SECONDS, CHANGE_POLL_MS
+from app.database import after_commit, after_rollback, engine
+from app.models import Product, ProductChange
+
+logger = logging.getLogger(__name__)
+
+ChangeEvent = namedtuple("ChangeEvent", "version product_id op")
+
+_origin = (None, None)
+
+
+def origin() -> str:
+    """Id of this process; a forked worker gets its own."""
+    global _origin
+    pid, token = _origin
+    if pid != os.getpid():
+        pid, token = os.getpid(), f"{os.getpid()}-{secrets.token_hex(4)}"
+        _origin = (pid, token)
+    return token
+
+
+class ChangeBus:
+    """
+    Interface of a change bus. Subscribers are called with a list of
+    ChangeEvent, from whichever thread delivers them, so they must be quick
+    and thread-safe. Each change reaches each subscriber once; changes from
+    different processes may arrive out of version order.
+    """
+
+    def __init__(self):
+        self.subscribers = []
+
+    def subscribe(self, func):
+        self.subscribers.append(func)
+        return func
+
+    def unsubscribe(self, func):
+        self.subscribers.remove(func)
+
+    def publish(self, events: list):
+        """Deliver changes committed by this process."""
+        self._deliver(events)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def _deliver(self, events: list):
+        for func in list(self.subscribers):
+            try:
+                func(events)
+            except Exception:
+                logger.exception("Change subscriber %r failed", func)
+
+
+class LocalBus(ChangeBus):
+    """Only this process's own changes; enough for a single worker."""
+
+
+class SQLiteBus(ChangeBus):
+    """Also delivers the changes other processes commit to the same database."""
+
+    def __init__(self, bind=engine, interval: float = CHANGE_POLL_MS / 1000):
+        super().__init__()
+        self.bind = bind
+        self.interval = interval
+        self.version = None  # last version read from the table
+        self._data_version = None
+        self._conn = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="change-bus", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Polling product changes failed")
+
+    def poll(self):
+        """Deliver changes other processes committed since the last poll."""
+        with self._lock:
+            if self._conn is None:
+                # Held for the life of the bus: data_version is per connection
+                self._conn = self.bind.connect()
+                self.version = self._conn.execute(select(func.coalesce(func.max(ProductChange.id), 0))).scalar()
+            data_version = self._conn.exec_driver_sql("PRAGMA data_version").scalar()
+            if data_version == self._data_version:
+                self._conn.rollback()
+                return
+            self._data_version = data_version
+            rows = self._conn.execute(
+                select(ProductChange.id, ProductChange.product_id, ProductChange.op, ProductChange.origin)
+                .where(ProductChange.id > self.version)
+                .order_by(ProductChange.id)
+            ).all()
+            self._conn.rollback()
+            if not rows:
+                return
+            self.version = rows[-1].id
+            own = origin()
+            events = [ChangeEvent(row.id, row.product_id, row.op) for row in rows if row.origin != own]
+        if events:
+            self._deliver(events)
+
+
+_bus = None
+
+
+def get_bus() -> ChangeBus:
+    global _bus
+    if _bus is None:
+        _bus = SQLiteBus() if CHANGE_BUS == "sqlite" else LocalBus()
+    return _bus
+
+
+def subscribe(func):
+    """Call func(events) with every product change; usable as a decorator."""
+    return get_bus().subscribe(func)
+
+
+def _publish(session: Session):
+    events = session.info.pop("product_changes", [])
+    if events:
+        get_bus().publish(events)
+
+
+@event.listens_for(Session, "after_flush")
+def _record_changes(session, flush_context):
+    rows = [
+        {"product_id": obj.id, "op": op, "origin": origin()}
+        for op, objs in (("create", session.new), ("update", session.dirty), ("delete", session.deleted))
+        for obj in objs
+        if isinstance(obj, Product) and (op != "update" or session.is_modified(obj))
+    ]
+    if not rows:
+        return
+    result = session.connection().execute(
+        insert(ProductChange).returning(ProductChange.id, ProductChange.product_id, ProductChange.op), rows
+    )
+    events = [ChangeEvent(*row) for row in result]
+    if "product_changes" not in session.info:
+        session.info["product_changes"] = []
+        after_commit(session, _publish, session)
+        after_rollback(session, session.info.pop, "product_changes", None)
+    session.info["product_changes"].extend(events)
+
+
+def prune(db: Session, retention_seconds: int = CHANGE_LOG_RETENTION_SECONDS) -> int:
+    """Delete changes older than the retention; return how many went."""
+    cutoff = datetime.utcnow() - timedelta(seconds=retention_seconds)
+    result = db.execute(delete(ProductChange).where(ProductChange.changed_at < cutoff))
+    db.commit()
+    return result.rowcount
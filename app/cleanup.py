@@ -0,0 +1,300 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+
+from sqlalchemy import and_, func, literal, or_, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from app import image_cache, images
+from app.config import CLEANUP_BATCH_SIZE, CLEANUP_GRACE_SECONDS, CLEANUP_TOMBSTONE_SECONDS
+from app.models import PendingOrphan, Product, StoredImage
+
+# Extensions stored uploads can have, used to map a derivative back to its image
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+
+# Totals since the process started
+metrics = {
+    "runs": 0,
+    "files_deleted": 0,
+    "bytes_freed": 0,
+    "errors": 0,
+    "last_run_at": None,
+    "last_duration_seconds": 0.0,
+}
+_metrics_lock = threading.Lock()
+
+
+def _record_run(deleted: int, freed: int, errors: int, started: float):
+    with _metrics_lock:
+        metrics["runs"] += 1
+        metrics["files_deleted"] += deleted
+        metrics["bytes_freed"] += freed
+        metrics["errors"] += errors
+        metrics["last_run_at"] = datetime.utcnow().isoformat()
+        metrics["last_duration_seconds"] = round(time.perf_counter() - started, 3)
+
+
+def _delete_files(backend, image_name: str, deleted_files: list) -> int:
+    """Delete an image and its derivatives from storage, return the error count."""
+    errors = 0
+    for name in [image_name] + images.derivative_names(image_name):
+        try:
+            if backend.delete(name):
+                deleted_files.append(name)
+        except OSError:
+            errors += 1
+    return errors
+
+
+def _claimed(cutoff: datetime):
+    """Names queued for the cleanup after cutoff, still in their grace period."""
+    return select(PendingOrphan.name).where(PendingOrphan.queued_at > cutoff)
+
+
+def _expired(cutoff: datetime):
+    """Names queued for the cleanup since before cutoff."""
+    return select(PendingOrphan.name).where(PendingOrphan.queued_at <= cutoff)
+
+
+def _mark_deleting(db: Session, name: str, *conditions):
+    """
+    Mark an unreferenced image as being deleted, if conditions still hold
+    and no other cleanup is at it, and commit. Returns (mark, size), or
+    None. crud.claim_image waits for marked images, so their files can be
+    deleted without holding the write lock.
+    """
+    now = datetime.utcnow()
+    abandoned = now - timedelta(seconds=CLEANUP_TOMBSTONE_SECONDS)
+    row = db.execute(
+        update(StoredImage)
+        .where(
+            StoredImage.name == name,
+            StoredImage.refcount <= 0,
+            or_(StoredImage.deleting_at.is_(None), StoredImage.deleting_at < abandoned),
+            *conditions,
+        )
+        .values(deleting_at=now)
+        .returning(StoredImage.size)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        db.rollback()
+        return None
+    db.commit()
+    return now, row.size
+
+
+def _finish_deleting(db: Session, name: str, mark: datetime, deleted: bool):
+    """Drop the rows of a deleted image, or clear the mark so a later run tries again."""
+    still_marked = (StoredImage.name == name, StoredImage.deleting_at == mark)
+    if deleted:
+        db.query(StoredImage).filter(*still_marked, StoredImage.refcount <= 0).delete(synchronize_session=False)
+        db.query(PendingOrphan).filter(
+            PendingOrphan.name == name, PendingOrphan.name.notin_(select(StoredImage.name))
+        ).delete(synchronize_session=False)
+    else:
+        db.query(StoredImage).filter(*still_marked).update({StoredImage.deleting_at: None}, synchronize_session=False)
+    db.commit()
+
+
+def run_cleanup(db: Session, backend, batch_size: int = CLEANUP_BATCH_SIZE,
+                grace_seconds: int = CLEANUP_GRACE_SECONDS, dry_run: bool = False,
+                max_batches: int = None) -> dict:
+    """
+    Delete queued orphan images (refcount 0, queued longer than the grace
+    period), batch_size at a time. Each image is marked as being deleted
+    in a short transaction of its own, then its files are deleted with no
+    transaction open, so slow storage never holds the database write lock.
+    An upload claiming the image (crud.claim_image) either comes first and
+    keeps it, or waits until the files are gone and stores them again.
+    Cached variants of the deleted images are dropped as well.
+    With dry_run nothing is changed and the files that would go are reported.
+    """
+    started = time.perf_counter()
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    deleted_files, reclaimed, batches, freed, errors = [], 0, 0, 0, 0
+    last_key = None
+
+    while max_batches is None or batches < max_batches:
+        query = db.query(PendingOrphan.name, PendingOrphan.queued_at).filter(PendingOrphan.queued_at <= cutoff)
+        if last_key is not None:
+            # Images another cleanup is deleting stay queued, so page through the queue
+            name, queued_at = last_key
+            query = query.filter(or_(
+                PendingOrphan.queued_at > queued_at,
+                and_(PendingOrphan.queued_at == queued_at, PendingOrphan.name > name),
+            ))
+        batch = query.order_by(PendingOrphan.queued_at, PendingOrphan.name).limit(batch_size).all()
+        if not batch:
+            break
+        batches += 1
+        last_key = tuple(batch[-1])
+        names = [name for name, _ in batch]
+
+        if dry_run:
+            unreferenced = db.query(StoredImage.name, StoredImage.size).filter(
+                StoredImage.name.in_(names), StoredImage.refcount <= 0
+            ).all()
+            for name, size in unreferenced:
+                reclaimed += 1
+                freed += size or 0
+                deleted_files.extend([name] + images.derivative_names(name))
+            continue
+
+        # Queue entries of images that are used again, or have no row at all
+        db.query(PendingOrphan).filter(
+            PendingOrphan.name.in_(names),
+            PendingOrphan.queued_at <= cutoff,
+            PendingOrphan.name.notin_(select(StoredImage.name).where(StoredImage.refcount <= 0)),
+        ).delete(synchronize_session=False)
+        db.commit()
+
+        gone = []
+        for name in names:
+            # Re-check count and grace period, an upload may have claimed it since
+            marked = _mark_deleting(db, name, StoredImage.name.in_(_expired(cutoff)))
+            if marked is None:
+                continue
+            mark, size = marked
+            failed = _delete_files(backend, name, deleted_files)
+            errors += failed
+            if not failed:
+                reclaimed += 1
+                freed += size or 0
+                gone.append(name)
+            _finish_deleting(db, name, mark, deleted=not failed)
+        image_cache.discard_variants(gone)
+
+    if not dry_run:
+        _record_run(len(deleted_files), freed, errors, started)
+    return {
+        "dry_run": dry_run,
+        "batches": batches,
+        "images": reclaimed,
+        "bytes_freed": freed,
+        "errors": errors,
+        "deleted_files": deleted_files,
+    }
+
+
+def rebuild_image_refs(db: Session):
+    """
+    Recompute every refcount from the product table and queue images that
+    nobody uses. Needed once for images uploaded before refcounting
+    existed, or after manual edits.
+    """
+    counts = (
+        db.query(Product.image_path, func.count(Product.id))
+        .filter(Product.image_path.isnot(None))
+        .group_by(Product.image_path)
+    )
+    by_name = {}
+    for image_path, count in counts.yield_per(CLEANUP_BATCH_SIZE):
+        name = os.path.basename(image_path)
+        by_name[name] = by_name.get(name, 0) + count
+
+    db.query(StoredImage).update({StoredImage.refcount: 0}, synchronize_session=False)
+    for name, count in by_name.items():
+        stmt = insert(StoredImage).values(name=name, refcount=count)
+        stmt = stmt.on_conflict_do_update(index_elements=[StoredImage.name], set_={"refcount": count})
+        db.execute(stmt)
+
+    unreferenced = select(StoredImage.name, literal(datetime.utcnow())).where(StoredImage.refcount <= 0)
+    db.execute(insert(PendingOrphan).from_select(["name", "queued_at"], unreferenced).on_conflict_do_nothing())
+    db.query(PendingOrphan).filter(
+        PendingOrphan.name.in_(select(StoredImage.name).where(StoredImage.refcount > 0))
+    ).delete(synchronize_session=False)
+    db.commit()
+
+
+def _source_names(name: str) -> list:
+    """Stored image names a file may belong to: itself, or the image a derivative was made from."""
+    stem = os.path.splitext(name)[0]
+    if "_" not in stem:
+        return [name]
+    source_stem = stem.split("_", 1)[0]
+    return [source_stem + ext for ext in IMAGE_EXTS]
+
+
+def reconcile(db: Session, backend, batch_size: int = CLEANUP_BATCH_SIZE,
+              grace_seconds: int = CLEANUP_GRACE_SECONDS, dry_run: bool = False) -> dict:
+    """
+    Full-scan fallback: rebuild refcounts, then walk all stored files in
+    batches and delete those no product uses (files that never got an
+    images row, or derivatives of deleted images). Files younger than the
+    grace period are kept, they may belong to an upload not committed yet,
+    and so are images an upload has claimed within it.
+    """
+    started = time.perf_counter()
+    if dry_run:
+        # Refcounts are left alone in a dry run, read references from products
+        paths = db.query(Product.image_path).filter(Product.image_path.isnot(None)).distinct()
+        referenced = {os.path.basename(path) for (path,) in paths.yield_per(batch_size)}
+    else:
+        rebuild_image_refs(db)
+
+    cutoff = time.time() - grace_seconds
+    queue_cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    unclaimed = StoredImage.name.notin_(_claimed(queue_cutoff))
+    files = backend.iter_files()
+    deleted_files, scanned, freed, errors = [], 0, 0, 0
+    while batch := list(islice(files, batch_size)):
+        scanned += len(batch)
+        candidates = {name: _source_names(name) for name, _, mtime in batch if mtime <= cutoff}
+        wanted = {source for sources in candidates.values() for source in sources}
+        if dry_run:
+            live = referenced & wanted
+        elif wanted:
+            live = {
+                name for (name,) in db.query(StoredImage.name).filter(
+                    StoredImage.name.in_(wanted), or_(StoredImage.refcount > 0, ~unclaimed)
+                )
+            }
+            db.commit()
+        else:
+            live = set()
+
+        sizes = {name: size for name, size, _ in batch}
+        gone = []
+        for name, sources in candidates.items():
+            if live.intersection(sources):
+                continue
+            if dry_run:
+                freed += sizes[name]
+                deleted_files.append(name)
+                continue
+            # Images are marked like in run_cleanup, so a claiming upload waits for the delete;
+            # derivatives are rebuilt by the image job when an upload brings their image back
+            mark = None
+            if sources == [name]:
+                db.execute(insert(StoredImage).values(name=name, refcount=0).on_conflict_do_nothing())
+                marked = _mark_deleting(db, name, unclaimed)
+                if marked is None:
+                    continue
+                mark = marked[0]
+            try:
+                deleted = backend.delete(name)
+            except OSError:
+                errors += 1
+                deleted = None
+            if deleted:
+                freed += sizes[name]
+                deleted_files.append(name)
+            if mark is not None:
+                _finish_deleting(db, name, mark, deleted=deleted is not None)
+                if deleted is not None:
+                    gone.append(name)
+        image_cache.discard_variants(gone)
+
+    if not dry_run:
+        _record_run(len(deleted_files), freed, errors, started)
+    return {
+        "dry_run": dry_run,
+        "scanned": scanned,
+        "bytes_freed": freed,
+        "errors": errors,
+        "deleted_files": deleted_files,
+    }
@@ -0,0 +1,98 @@
+import os
+from dataclasses import dataclass
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Uploads
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(10 * 1024 * 1024)))  # 10 MB
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))  # 1 MB
+
+# Image derivatives, as "label:max_edge" pairs and output formats
+IMAGE_DERIVATIVE_SIZES = os.getenv("IMAGE_DERIVATIVE_SIZES", "thumb:100,small:320,medium:640")
+IMAGE_DERIVATIVE_FORMATS = os.getenv("IMAGE_DERIVATIVE_FORMATS", "webp")
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+
+# On-demand resized variants served from /uploads/{name}?w=..&fmt=..
+VARIANT_CACHE_DIR = os.getenv("VARIANT_CACHE_DIR", os.path.join("cache", "variants"))
+VARIANT_CACHE_MAX_BYTES = int(os.getenv("VARIANT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))  # 512 MB
+VARIANT_MAX_EDGE = int(os.getenv("VARIANT_MAX_EDGE", "2048"))
+
+# Image storage backend: "local" (UPLOAD_DIR) or "s3" (any S3-compatible service, needs boto3)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+S3_BUCKET = os.getenv("S3_BUCKET")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")  # e.g. http://localhost:9000 for MinIO
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+S3_PREFIX = os.getenv("S3_PREFIX", "")
+PRESIGN_EXPIRE_SECONDS = int(os.getenv("PRESIGN_EXPIRE_SECONDS", "900"))  # 15 minutes
+
+# Orphaned upload cleanup
+CLEANUP_BATCH_SIZE = int(os.getenv("CLEANUP_BATCH_SIZE", "500"))
+# Released images are kept this long, so an upload racing with the cleanup is safe
+CLEANUP_GRACE_SECONDS = int(os.getenv("CLEANUP_GRACE_SECONDS", "3600"))
+# An image marked as being deleted for longer than this was left by a crashed cleanup
+CLEANUP_TOMBSTONE_SECONDS = int(os.getenv("CLEANUP_TOMBSTONE_SECONDS", "60"))
+
+# Scheduled jobs run only in the worker holding this lock file
+SCHEDULER_LOCK_FILE = os.getenv("SCHEDULER_LOCK_FILE", "scheduler.lock")
+SCHEDULER_RETRY_SECONDS = int(os.getenv("SCHEDULER_RETRY_SECONDS", "30"))
+
+# Background job queue
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))  # threads per app process
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BACKOFF_SECONDS = int(os.getenv("JOB_RETRY_BACKOFF_SECONDS", "10"))  # doubled on each retry
+# Running jobs touch heartbeat_at this often; ones silent for JOB_STALE_SECONDS
+# are taken to be from a crashed worker and re-queued
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "30"))
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "300"))
+
+# Resumable uploads: partial files live here until finalized (same filesystem as UPLOAD_DIR)
+UPLOAD_SESSION_DIR = os.getenv("UPLOAD_SESSION_DIR", os.path.join(UPLOAD_DIR, ".sessions"))
+RESUMABLE_MAX_SIZE = int(os.getenv("RESUMABLE_MAX_SIZE", str(50 * 1024 * 1024)))  # 50 MB
+# Sessions untouched for this long are deleted, with their partial data
+UPLOAD_SESSION_TTL_SECONDS = int(os.getenv("UPLOAD_SESSION_TTL_SECONDS", str(24 * 3600)))
+
+
+# Statements slower than this are logged with their query plan
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", "0.1"))
+
+
+# Admin-only request profiling (X-Profile: true); profiles are saved here
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "1"))  # per request with X-Profile-Interval
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))  # sampling stops after this
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "100"))  # older profiles are deleted as new ones are saved
+
+
+# Encoded GET /products/ pages, dropped on any product write; TTL 0 turns the cache off
+LIST_CACHE_TTL_SECONDS = int(os.getenv("LIST_CACHE_TTL_SECONDS", "10"))
+LIST_CACHE_MAX_BYTES = int(os.getenv("LIST_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))  # 32 MB
+
+
+# Product change notifications: "sqlite" also delivers other workers' changes, "local" only this process's
+CHANGE_BUS = os.getenv("CHANGE_BUS", "sqlite")
+CHANGE_POLL_MS = float(os.getenv("CHANGE_POLL_MS", "20"))  # how often other workers' commits are checked for
+CHANGE_LOG_RETENTION_SECONDS = int(os.getenv("CHANGE_LOG_RETENTION_SECONDS", str(7 * 24 * 3600)))
+# Idle GET /products/changes/stream connections get a comment line this often
+CHANGE_STREAM_HEARTBEAT_SECONDS = float(os.getenv("CHANGE_STREAM_HEARTBEAT_SECONDS", "15"))
+
+
+@dataclass
+class Settings:
+    """What main.create_app starts up; everything else is read from the constants above."""
+    title: str = "FastAPI Product API"
+    # Create missing tables and columns on startup
+    init_db: bool = True
+    # Job worker threads in this process, 0 to only enqueue
+    job_workers: int = JOB_WORKERS
+    run_scheduler: bool = os.getenv("RUN_SCHEDULER", "true").lower() == "true"
+    # Open a DB connection and start the image worker processes before serving
+    warmup: bool = os.getenv("STARTUP_WARMUP", "true").lower() == "true"
+    # Record request metrics and serve them at /metrics
+    metrics: bool = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    # Add X-DB-Queries and X-DB-Time headers to every response
+    debug: bool = os.getenv("DEBUG", "false").lower() == "true"
+    # Let admins profile a request with X-Profile: true
+    profiling: bool = os.getenv("PROFILING_ENABLED", "true").lower() == "true"
@@ -1,9 +1,98 @@
+import os
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import literal, select, update
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.orm import Session
-from app.models import Product
+from app import changes  # noqa: F401  logs and publishes every product write
+from app.config import CLEANUP_TOMBSTONE_SECONDS
+from app.models import PendingOrphan, Product, StoredImage
+from app.models.product_model import IMAGE_FIELDS
+
+def acquire_image(db: Session, image_path: str):
+    """Count one more product using the stored file (same transaction as the product)."""
+    name = os.path.basename(image_path)
+    size = os.path.getsize(image_path) if os.path.exists(image_path) else None
+    stmt = insert(StoredImage).values(name=name, size=size, refcount=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[StoredImage.name],
+        set_={"refcount": StoredImage.refcount + 1},
+    )
+    db.execute(stmt)
+    # Claimed again before the cleanup got to it
+    db.query(PendingOrphan).filter(PendingOrphan.name == name).delete(synchronize_session=False)
+
+def release_image(db: Session, image_path: str):
+    """
+    Count one less product using the stored file. At 0 the file is queued
+    for the cleanup, which deletes it once the grace period has passed.
+    """
+    name = os.path.basename(image_path)
+    db.query(StoredImage).filter(StoredImage.name == name).update(
+        {StoredImage.refcount: StoredImage.refcount - 1}, synchronize_session=False
+    )
+    queue_if_unreferenced(db, name)
+
+def queue_if_unreferenced(db: Session, name: str):
+    """Queue the stored file for the cleanup if no product uses it, restarting its grace period."""
+    unreferenced = select(StoredImage.name, literal(datetime.utcnow())).where(
+        StoredImage.name == name, StoredImage.refcount <= 0
+    )
+    stmt = insert(PendingOrphan).from_select(["name", "queued_at"], unreferenced)
+    stmt = stmt.on_conflict_do_update(index_elements=[PendingOrphan.name], set_={"queued_at": stmt.excluded.queued_at})
+    db.execute(stmt)
+
+def discard_upload(bind, image_path: str):
+    """
+    For a fresh upload whose transaction did not commit: track the file as
+    unused, so the cleanup deletes it after the grace period unless another
+    product claims the same content first. Runs in its own session.
+    """
+    size = os.path.getsize(image_path) if os.path.exists(image_path) else None
+    db = Session(bind=bind)
+    try:
+        track_unclaimed_image(db, os.path.basename(image_path), size)
+        db.commit()
+    finally:
+        db.close()
+
+def claim_image(bind, name: str, size: int = None, poll: float = 0.05):
+    """
+    Restart the grace period of a stored name before an upload writes or
+    reuses the file, in a transaction of its own. The cleanup marks an
+    image (deleting_at) in a transaction of its own before deleting its
+    files, so either this commits first and the cleanup leaves the image
+    alone, or it waits until the files are gone and the upload stores them
+    again. Marks older than CLEANUP_TOMBSTONE_SECONDS are from a cleanup
+    that died, and are cleared.
+    """
+    db = Session(bind=bind)
+    try:
+        while True:
+            # Written first, so the check below runs under the write lock
+            track_unclaimed_image(db, name, size)
+            abandoned = datetime.utcnow() - timedelta(seconds=CLEANUP_TOMBSTONE_SECONDS)
+            deleting_at = db.execute(select(StoredImage.deleting_at).where(StoredImage.name == name)).scalar()
+            if deleting_at is None or deleting_at < abandoned:
+                break
+            db.rollback()
+            time.sleep(poll)
+        if deleting_at is not None:
+            db.execute(update(StoredImage).where(StoredImage.name == name).values(deleting_at=None))
+        db.commit()
+    finally:
+        db.close()
+
+def track_unclaimed_image(db: Session, name: str, size: int = None):
+    """Record a stored file no product uses yet, queued for the cleanup until one claims it."""
+    db.execute(insert(StoredImage).values(name=name, size=size, refcount=0).on_conflict_do_nothing())
+    queue_if_unreferenced(db, name)
 
 def create_product(db: Session, name: str, category: str, price: float, image_path: str = None):
     product = Product(name=name, category=category, price=price, image_path=image_path)
     db.add(product)
+    if image_path:
+        acquire_image(db, image_path)
     db.commit()
     db.refresh(product)
     return product
@@ -24,8 +113,14 @@ def update_product(db: Session, product_id: int, name: str, category: str, price
     product.name = name
     product.category = category
     product.price = price
-    if image_path:
+    if image_path and image_path != product.image_path:
+        acquire_image(db, image_path)
+        if product.image_path:
+            release_image(db, product.image_path)
         product.image_path = image_path
+        # Derivatives and metadata belong to the previous image
+        for field in IMAGE_FIELDS:
+            setattr(product, field, None)
     db.commit()
     db.refresh(product)
     return product
@@ -33,5 +128,7 @@ def update_product(db: Session, product_id: int, name: str, category: str, price
 def delete_product(db: Session, product_id: int):
     product = get_product(db, product_id)
     if product:
+        if product.image_path:
+            release_image(db, product.image_path)
         db.delete(product)
         db.commit()
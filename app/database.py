@@ -1,6 +1,15 @@
-from sqlalchemy import create_engine
+import logging
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import create_engine, event, inspect
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.config import SLOW_QUERY_SECONDS
+
+logger = logging.getLogger(__name__)
 
 # Using SQLite (local file)
 SQLALCHEMY_DATABASE_URL = "sqlite:///./product.db"
@@ -13,6 +22,141 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+
+def init_db(bind=engine):
+    """
+    Create missing tables, and add columns that were introduced after the
+    table was first created (create_all never alters existing tables).
+    New columns must be nullable or have a server default.
+    """
+    import app.models  # noqa: F401  register all models on Base
+
+    Base.metadata.create_all(bind=bind)
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=bind.dialect)
+                    conn.exec_driver_sql(
+                        f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'
+                    )
+
+def after_commit(session: Session, func, *args):
+    """Run func(*args) once the session's current transaction commits; dropped on rollback."""
+    session.info.setdefault("after_commit", []).append((func, args))
+
+
+def after_rollback(session: Session, func, *args):
+    """
+    Run func(*args) if the session's current transaction ends without a
+    commit: rolled back, failed, or closed. Dropped once it commits.
+    """
+    if not session.in_transaction():
+        session.begin()
+    session.info.setdefault("after_rollback", []).append((func, args))
+
+
+def _run_callbacks(callbacks):
+    for func, args in callbacks:
+        try:
+            func(*args)
+        except Exception:
+            logger.exception("Transaction callback %s failed", getattr(func, "__name__", func))
+
+
+@event.listens_for(Session, "after_commit")
+def _on_commit(session):
+    session.info.pop("after_rollback", None)
+    _run_callbacks(session.info.pop("after_commit", []))
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _on_transaction_end(session, transaction):
+    # Only the outermost transaction; a commit has already emptied both lists
+    if transaction.parent is None:
+        session.info.pop("after_commit", None)
+        _run_callbacks(session.info.pop("after_rollback", []))
+
+
+class QueryStats:
+    """Statements run, and time spent running them, while tracking is on."""
+
+    __slots__ = ("count", "seconds", "slow")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.slow = 0
+
+
+# Set per request; a mutable object, so threadpool code (which runs in a copy
+# of the request's context) adds to the same stats
+_query_stats: ContextVar = ContextVar("query_stats", default=None)
+
+
+@contextmanager
+def track_queries():
+    """Count the statements run by this context and the threads it starts."""
+    stats = QueryStats()
+    token = _query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _query_stats.reset(token)
+
+
+_WHITESPACE = re.compile(r"\s+")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PARAM_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+def normalize_sql(statement: str) -> str:
+    """One line per query shape: literals become ? and IN (?, ?, ...) becomes IN (?...)."""
+    statement = _LITERALS.sub("?", _WHITESPACE.sub(" ", statement).strip())
+    return _PARAM_LIST.sub("(?...)", statement)
+
+
+def _query_plan(conn, statement, parameters) -> str:
+    # On the raw connection, so the EXPLAIN doesn't go through these hooks
+    rows = conn.connection.driver_connection.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+    return "; ".join(row[-1] for row in rows)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution context, which is dropped with the statement even when it fails
+    context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # For SQLite this is the time to the first row; fetching the rest is not included
+    elapsed = time.perf_counter() - context._query_started
+    stats = _query_stats.get()
+    slow = elapsed >= SLOW_QUERY_SECONDS
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += elapsed
+        stats.slow += slow
+    if slow:
+        plan = None
+        if not executemany and conn.dialect.name == "sqlite":
+            try:
+                plan = _query_plan(conn, statement, parameters)
+            except Exception as exc:
+                plan = f"unavailable: {exc}"
+        logger.warning("Slow query (%.1f ms): %s | plan: %s", elapsed * 1000, normalize_sql(statement), plan)
+
+
+def instrument(bind):
+    """Count and time the statements run on an engine, and log slow ones."""
+    event.listen(bind, "before_cursor_execute", _before_cursor_execute)
+    event.listen(bind, "after_cursor_execute", _after_cursor_execute)
+
+
+instrument(engine)
+
+
 # Dependency for every request
 def get_db():
     db = SessionLocal()
@@ -0,0 +1,51 @@
+import os
+
+from fastapi import Request, Response
+from fastapi.responses import FileResponse, RedirectResponse
+
+from app.config import PRESIGN_EXPIRE_SECONDS
+from app.storage import IMMUTABLE_CACHE_CONTROL
+
+
+def etag_for(name: str) -> str:
+    """
+    Strong ETag from the stored name. Names are content hashes (or UUIDs
+    for old uploads) and never change, so no stat or hashing is needed.
+    """
+    return f'"{os.path.splitext(name)[0]}"'
+
+
+def etag_matches(if_none_match, etag: str) -> bool:
+    """
+    Whether If-None-Match lists etag. "*" is not honoured: it means "any
+    version exists", which we can't answer without looking in storage.
+    """
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def cache_headers(name: str) -> dict:
+    return {"ETag": etag_for(name), "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+
+
+def not_modified(request: Request, name: str):
+    """304 response when the client already holds this version, else None."""
+    if etag_matches(request.headers.get("if-none-match"), etag_for(name)):
+        return Response(status_code=304, headers=cache_headers(name))
+    return None
+
+
+def immutable_file_response(path: str, name: str, media_type: str = None) -> FileResponse:
+    """FileResponse with long-lived caching; Range and If-Range are handled by Starlette."""
+    return FileResponse(path, media_type=media_type, headers=cache_headers(name))
+
+
+def presigned_redirect(url: str, name: str) -> RedirectResponse:
+    # The target URL expires, so the redirect itself may only be cached briefly
+    max_age = min(300, PRESIGN_EXPIRE_SECONDS // 2)
+    return RedirectResponse(url, status_code=307, headers={
+        "ETag": etag_for(name),
+        "Cache-Control": f"private, max-age={max_age}",
+    })
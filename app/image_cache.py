@@ -0,0 +1,173 @@
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+
+from starlette.concurrency import run_in_threadpool
+
+from app import images
+from app.config import VARIANT_CACHE_DIR, VARIANT_CACHE_MAX_BYTES
+
+
+class DiskLRUCache:
+    """
+    Files in one directory, total size capped at max_bytes.
+    Least recently used files are deleted first. Usage order survives
+    restarts through the files' access/modification times.
+
+    The directory is shared by every worker process on the host, so the
+    limit is enforced on what the directory holds, not on what this
+    process wrote.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # name -> size, oldest first
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Index the directory again, ordering files by last use, and evict."""
+        rank = {name: i for i, name in enumerate(self._entries)}
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".part"):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except FileNotFoundError:  # evicted by another worker meanwhile
+                continue
+            # Ties on coarse timestamps keep this process's usage order
+            used = max(stat.st_atime, stat.st_mtime)
+            files.append((used, rank.get(entry.name, -1), entry.name, stat.st_size))
+        self._entries = OrderedDict((name, size) for _, _, name, size in sorted(files))
+        self.total_bytes = sum(self._entries.values())
+        self._evict()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def get(self, name: str):
+        """
+        Return the file path if cached, marking it recently used. Files
+        written by other workers are found on disk and indexed.
+        """
+        file_path = self.path(name)
+        try:
+            os.utime(file_path)
+            size = os.path.getsize(file_path)
+        except FileNotFoundError:
+            with self._lock:
+                self.total_bytes -= self._entries.pop(name, 0)
+            return None
+        with self._lock:
+            self.total_bytes += size - self._entries.pop(name, 0)
+            self._entries[name] = size
+        return file_path
+
+    def add(self, name: str, size: int):
+        """
+        Register a file that was just written to path(name). The directory
+        is measured again, as other workers write to it too.
+        """
+        with self._lock:
+            self._entries.pop(name, None)
+            self._entries[name] = size
+            self._load()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+
+
+class VariantCache:
+    """
+    Resized image variants rendered on demand in the image process pool.
+    Concurrent requests for the same variant share a single render.
+    """
+
+    def __init__(self, directory: str = VARIANT_CACHE_DIR, max_bytes: int = VARIANT_CACHE_MAX_BYTES):
+        self.disk = DiskLRUCache(directory, max_bytes)
+        self._inflight = {}  # variant name -> asyncio.Future
+        self.renders = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def variant_name(image_name: str, width, height, fmt: str) -> str:
+        stem = os.path.splitext(image_name)[0]
+        return f"{stem}_w{width or 0}_h{height or 0}.{fmt}"
+
+    async def get(self, image_name: str, width, height, fmt: str, backend) -> str:
+        """
+        Return the path of the variant, rendering it from the stored image
+        when not cached. Raises FileNotFoundError if the image is missing.
+        """
+        name = self.variant_name(image_name, width, height, fmt)
+        cached = self.disk.get(name)
+        if cached:
+            return cached
+
+        future = self._inflight.get(name)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.ensure_future(run_in_threadpool(
+            self._render, name, image_name, width, height, fmt, backend
+        ))
+        self._inflight[name] = future
+        try:
+            return await asyncio.shield(future)
+        finally:
+            self._inflight.pop(name, None)
+
+    def _render(self, name, image_name, width, height, fmt, backend) -> str:
+        dst_path = self.disk.path(name)
+        with backend.local_copy(image_name) as src_path:
+            size = images.get_pool().submit(
+                images.resize_image, src_path, dst_path, width, height, fmt
+            ).result()
+        self.renders += 1
+        self.disk.add(name, size)
+        return dst_path
+
+
+def discard_variants(image_names, directory: str = None) -> int:
+    """
+    Delete the cached variants of images, e.g. once the cleanup deleted the
+    images themselves. Returns the number of files removed.
+    """
+    directory = directory or VARIANT_CACHE_DIR
+    stems = {os.path.splitext(name)[0] for name in image_names}
+    if not stems or not os.path.isdir(directory):
+        return 0
+    removed = 0
+    for entry in os.scandir(directory):
+        # Variant names are "<stem>_w<width>_h<height>.<fmt>"
+        if not entry.name.endswith(".part") and entry.name.rsplit("_w", 1)[0] in stems:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+_variant_cache = None
+
+
+def get_variant_cache() -> VariantCache:
+    global _variant_cache
+    if _variant_cache is None:
+        _variant_cache = VariantCache()
+    return _variant_cache
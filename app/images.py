@@ -0,0 +1,237 @@
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from app import storage
+from app.config import IMAGE_DERIVATIVE_FORMATS, IMAGE_DERIVATIVE_SIZES, IMAGE_WORKERS
+
+# Pillow format name and save options per output format
+OUTPUT_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "avif": ("AVIF", {"quality": 60}),
+    "jpeg": ("JPEG", {"quality": 85, "optimize": True}),
+    "png": ("PNG", {"optimize": True}),
+}
+
+_pool = None
+
+
+def parse_sizes(value: str) -> dict:
+    """Parse "thumb:100,medium:640" into {"thumb": 100, "medium": 640}."""
+    sizes = {}
+    for item in value.split(","):
+        if item.strip():
+            label, edge = item.split(":")
+            sizes[label.strip()] = int(edge)
+    return sizes
+
+
+def parse_formats(value: str) -> list:
+    return [fmt.strip().lower() for fmt in value.split(",") if fmt.strip().lower() in OUTPUT_FORMATS]
+
+
+def _pool_context():
+    """
+    Start method of the pool's workers. The app has threads running by the
+    time the pool starts, and forking a process with threads can copy locks
+    they hold; forkserver (spawn where missing) starts workers clean.
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["app.images", "PIL.Image"])
+    return context
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """Process pool shared by all image work, created on first use."""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=_pool_context())
+    return _pool
+
+
+def _import_pillow():
+    import PIL.Image  # noqa: F401
+
+
+def warm_pool():
+    """Start every worker process and import Pillow in it, ahead of the first image."""
+    pool = get_pool()
+    for future in [pool.submit(_import_pillow) for _ in range(IMAGE_WORKERS)]:
+        future.result()
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def derivative_name(image_name: str, label: str, fmt: str) -> str:
+    # Same prefix as the image, so derivatives land in the image's shard directory
+    stem = os.path.splitext(image_name)[0]
+    return f"{stem}_{label}.{fmt}"
+
+
+def generate_derivatives(src_path: str, out_dir: str, sizes: dict, formats: list,
+                         image_name: str = None, skip=()) -> dict:
+    """
+    Write resized copies of src_path into out_dir, except names in skip.
+    Runs inside the process pool. Returns {label: {format: filename}}.
+    """
+    from PIL import Image, features
+
+    image_name = image_name or os.path.basename(src_path)
+    result = {}
+    with Image.open(src_path) as img:
+        # Let the JPEG decoder downscale while decoding, much cheaper than a full decode
+        img.draft("RGB", (max(sizes.values()),) * 2)
+        img.load()
+        for label, edge in sorted(sizes.items(), key=lambda item: -item[1]):
+            resized = img.copy()
+            resized.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+            for fmt in formats:
+                pil_format, options = OUTPUT_FORMATS[fmt]
+                if fmt in ("webp", "avif") and not features.check(fmt):
+                    continue
+                out = resized
+                if pil_format == "JPEG" and out.mode not in ("RGB", "L"):
+                    out = out.convert("RGB")
+                name = derivative_name(image_name, label, fmt)
+                result.setdefault(label, {})[fmt] = name
+                if name in skip:
+                    # Content-addressed source, an existing derivative is identical
+                    continue
+                tmp_path = os.path.join(out_dir, f".{name}.part")
+                out.save(tmp_path, pil_format, **options)
+                os.replace(tmp_path, os.path.join(out_dir, name))
+    return result
+
+
+def image_metadata(src_path: str) -> dict:
+    """
+    Dimensions, file size, dominant color and blurhash of an image, named
+    like the Product columns. Runs inside the process pool.
+    """
+    from PIL import Image
+
+    from app import blurhash
+
+    with Image.open(src_path) as img:
+        width, height = img.size
+        img.draft("RGB", (64, 64))
+        small = img.convert("RGB")
+    small.thumbnail((64, 64))
+
+    # Most common color of a 5 color palette, closer to what the eye picks than the mean
+    palette = small.quantize(colors=5, method=Image.Quantize.MEDIANCUT)
+    _, index = max(palette.getcolors())
+    r, g, b = palette.getpalette()[index * 3:index * 3 + 3]
+
+    tiny = small.resize((32, 32), Image.Resampling.BILINEAR)
+    return {
+        "image_width": width,
+        "image_height": height,
+        "image_bytes": os.path.getsize(src_path),
+        "dominant_color": f"#{r:02x}{g:02x}{b:02x}",
+        "blurhash": blurhash.encode(list(tiny.getdata()), 32, 32),
+    }
+
+
+def resize_image(src_path: str, dst_path: str, width, height, fmt: str):
+    """
+    Render one resized variant of src_path to dst_path (runs in the process
+    pool). The image is scaled down to fit width x height, never up.
+    Returns the size in bytes of the written file.
+    """
+    from PIL import Image
+
+    pil_format, options = OUTPUT_FORMATS[fmt]
+    with Image.open(src_path) as img:
+        box = (width or img.width, height or img.height)
+        img.draft("RGB", box)
+        img.load()
+        img.thumbnail(box, Image.Resampling.LANCZOS)
+        if pil_format == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        tmp_path = f"{dst_path}.part"
+        img.save(tmp_path, pil_format, **options)
+    os.replace(tmp_path, dst_path)
+    return os.path.getsize(dst_path)
+
+
+def derivative_urls(derivatives: dict) -> dict:
+    return {
+        label: {fmt: storage.url(name) for fmt, name in by_format.items()}
+        for label, by_format in derivatives.items()
+    }
+
+
+def derivative_files(derivatives) -> list:
+    """Basenames of all files referenced by a product's derivatives column."""
+    if not derivatives:
+        return []
+    return [os.path.basename(url) for by_format in derivatives.values() for url in by_format.values()]
+
+
+def derivative_names(image_name: str) -> list:
+    """Every derivative file name the current settings can produce for an image."""
+    return [
+        derivative_name(image_name, label, fmt)
+        for label in parse_sizes(IMAGE_DERIVATIVE_SIZES)
+        for fmt in parse_formats(IMAGE_DERIVATIVE_FORMATS)
+    ]
+
+
+def process_product_image(product_id: int, image_path: str, backend=None):
+    """
+    Background job: build derivatives and read the metadata of a freshly
+    uploaded image in the process pool, and store both on the product.
+    Errors are raised so the job is retried; derivatives already stored are
+    not rebuilt.
+    """
+    from app.database import SessionLocal
+    from app.models import Product
+
+    if not image_path:
+        return
+    sizes = parse_sizes(IMAGE_DERIVATIVE_SIZES)
+    formats = parse_formats(IMAGE_DERIVATIVE_FORMATS)
+    backend = backend or storage.get_backend()
+    image_name = os.path.basename(image_path)
+    skip = {name for name in derivative_names(image_name) if backend.exists(name)}
+
+    try:
+        with backend.local_copy(image_name) as src_path, \
+                tempfile.TemporaryDirectory(dir=backend.staging_dir, prefix=".derivatives-") as out_dir:
+            pool = get_pool()
+            metadata = pool.submit(image_metadata, src_path)
+            result = {}
+            if sizes and formats:
+                result = pool.submit(
+                    generate_derivatives, src_path, out_dir, sizes, formats, image_name, skip
+                ).result()
+            for by_format in result.values():
+                for name in by_format.values():
+                    if name not in skip:
+                        backend.store(os.path.join(out_dir, name), name)
+            fields = metadata.result()
+        fields["derivatives"] = derivative_urls(result) if result else None
+    except FileNotFoundError:
+        return
+
+    db = SessionLocal()
+    try:
+        product = db.get(Product, product_id)
+        # The image may have been replaced while we were working; the files
+        # stay until the cleanup removes the unreferenced image
+        if product is None or product.image_path != image_path:
+            return
+        for field, value in fields.items():
+            setattr(product, field, value)
+        db.commit()
+    finally:
+        db.close()
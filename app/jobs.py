@@ -0,0 +1,238 @@
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+from sqlalchemy.sql.functions import coalesce
+from sqlalchemy.orm import Session
+
+from app.config import (
+    JOB_HEARTBEAT_SECONDS,
+    JOB_MAX_ATTEMPTS,
+    JOB_POLL_SECONDS,
+    JOB_RETRY_BACKOFF_SECONDS,
+    JOB_STALE_SECONDS,
+    JOB_WORKERS,
+)
+from app.database import SessionLocal
+from app.models import Job
+
+logger = logging.getLogger(__name__)
+
+# kind -> function(db, **payload), registered with @handler
+handlers = {}
+
+# Set by enqueue so idle workers in this process start at once instead of at the next poll
+_wakeup = threading.Event()
+
+
+def handler(kind: str):
+    """Register a function as the handler of a job kind. Its return value is kept as the job result."""
+    def register(func):
+        handlers[kind] = func
+        return func
+    return register
+
+
+def enqueue(db: Session, kind: str, payload: dict = None, max_attempts: int = JOB_MAX_ATTEMPTS,
+            delay: float = 0) -> Job:
+    """Queue a job and commit. The payload must be JSON serializable."""
+    if kind not in handlers:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job = Job(
+        kind=kind,
+        payload=payload or {},
+        max_attempts=max_attempts,
+        run_after=datetime.utcnow() + timedelta(seconds=delay),
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    _wakeup.set()
+    return job
+
+
+def get_job(db: Session, job_id: int):
+    return db.get(Job, job_id)
+
+
+def claim_next(db: Session, worker_id: str):
+    """
+    Mark the oldest due job as running and return it, or None. The select and
+    the update are one statement, so two workers never get the same job.
+    """
+    now = datetime.utcnow()
+    next_id = (
+        select(Job.id)
+        .where(Job.status == "queued", Job.run_after <= now)
+        .order_by(Job.run_after, Job.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    job = db.execute(
+        update(Job)
+        .where(Job.id == next_id, Job.status == "queued")
+        .values(status="running", attempts=Job.attempts + 1, started_at=now, heartbeat_at=now,
+                locked_by=worker_id)
+        .returning(Job.id, Job.kind, Job.payload, Job.attempts, Job.max_attempts, Job.locked_by)
+        .execution_options(synchronize_session=False)
+    ).first()
+    db.commit()
+    return job
+
+
+def retry_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=JOB_RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1))
+
+
+def _owned(job):
+    """Conditions of a job still running under the claim that handed it out."""
+    return (Job.id == job.id, Job.status == "running", Job.locked_by == job.locked_by)
+
+
+def _heartbeat(job, stop: threading.Event, session_factory, interval: float):
+    """Touch heartbeat_at of a running job every interval seconds until stop is set."""
+    while not stop.wait(interval):
+        db = session_factory()
+        try:
+            db.execute(
+                update(Job)
+                .where(*_owned(job))
+                .values(heartbeat_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+        except Exception:
+            logger.exception("Heartbeat of job %s failed", job.id)
+        finally:
+            db.close()
+
+
+def run_job(job, session_factory=SessionLocal, heartbeat_seconds: float = JOB_HEARTBEAT_SECONDS):
+    """
+    Run a claimed job and record the outcome; failures are re-queued until
+    max_attempts. A heartbeat thread keeps the job from looking stale
+    however long it runs. The outcome is only recorded while the job is
+    still this claim's: one re-queued as stale belongs to its next run.
+    """
+    func = handlers.get(job.kind)
+    stop = threading.Event()
+    beat = threading.Thread(
+        target=_heartbeat, args=(job, stop, session_factory, heartbeat_seconds),
+        name=f"job-heartbeat-{job.id}", daemon=True,
+    )
+    beat.start()
+    db = session_factory()
+    try:
+        try:
+            if func is None:
+                raise LookupError(f"No handler for job kind {job.kind}")
+            result = func(db, **(job.payload or {}))
+        except Exception as exc:
+            db.rollback()
+            logger.exception("Job %s (%s) failed, attempt %s", job.id, job.kind, job.attempts)
+            now = datetime.utcnow()
+            values = {"error": f"{type(exc).__name__}: {exc}"}
+            if func is not None and job.attempts < job.max_attempts:
+                values.update(status="queued", run_after=now + retry_delay(job.attempts))
+            else:
+                values.update(status="failed", finished_at=now)
+        else:
+            values = {"status": "succeeded", "result": result, "error": None, "finished_at": datetime.utcnow()}
+
+        stop.set()
+        beat.join()
+        recorded = db.execute(
+            update(Job).where(*_owned(job)).values(**values).execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+        if not recorded:
+            logger.warning("Job %s (%s) was taken back as stale, its outcome is dropped", job.id, job.kind)
+    finally:
+        stop.set()
+        db.close()
+
+
+def requeue_stale(db: Session, stale_seconds: int = JOB_STALE_SECONDS) -> int:
+    """
+    Put running jobs whose worker is gone, no heartbeat for stale_seconds,
+    back in the queue, or fail them if that was their last attempt. Long
+    jobs of live workers keep beating and stay put. Returns how many jobs
+    were taken back.
+    """
+    now = datetime.utcnow()
+    cutoff = now - timedelta(seconds=stale_seconds)
+    stale = (Job.status == "running", coalesce(Job.heartbeat_at, Job.started_at) < cutoff)
+    failed = db.execute(
+        update(Job)
+        .where(*stale, Job.attempts >= Job.max_attempts)
+        .values(status="failed", finished_at=now, error="Worker stopped responding")
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    requeued = db.execute(
+        update(Job)
+        .where(*stale)
+        .values(status="queued", run_after=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return failed + requeued
+
+
+class WorkerPool:
+    """
+    Threads that claim and run queued jobs. Each app process starts one;
+    claims are atomic, so any number of processes can share the table.
+    """
+
+    def __init__(self, size: int = JOB_WORKERS, poll_seconds: float = JOB_POLL_SECONDS,
+                 session_factory=SessionLocal):
+        self.size = size
+        self.poll_seconds = poll_seconds
+        self.session_factory = session_factory
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        db = self.session_factory()
+        try:
+            requeue_stale(db)
+        finally:
+            db.close()
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        for i in range(self.size):
+            thread = threading.Thread(target=self._work, args=(f"{prefix}:{i}",), name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def run_once(self, worker_id: str = "inline") -> bool:
+        """Run the next due job, if any; return whether one was run."""
+        db = self.session_factory()
+        try:
+            job = claim_next(db, worker_id)
+        finally:
+            db.close()
+        if job is None:
+            return False
+        run_job(job, self.session_factory)
+        return True
+
+    def _work(self, worker_id: str):
+        while not self._stop.is_set():
+            try:
+                if self.run_once(worker_id):
+                    continue
+            except Exception:
+                logger.exception("Job worker %s error", worker_id)
+            _wakeup.wait(self.poll_seconds)
+            _wakeup.clear()
+
+    def shutdown(self, timeout: float = 10):
+        """Stop taking jobs and wait for running ones to finish."""
+        self._stop.set()
+        _wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
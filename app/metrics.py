@@ -0,0 +1,248 @@
+"""
+Request metrics: per-route latency and response size histograms, status
+counts, SQL statements per request and an in-flight gauge, exported in
+the Prometheus text format.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from fastapi import APIRouter, Response
+
+from app import singleflight
+from app.database import track_queries
+
+# Upper bounds in seconds, the last bucket (+Inf) is implicit
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Requests that match no route share one label, so scanners can't add series
+UNMATCHED = "<unmatched>"
+
+
+class Histogram:
+    """Fixed buckets; counts[i] are observations <= bounds[i], the last one is +Inf."""
+
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimate by linear interpolation inside the bucket, like histogram_quantile()."""
+        if not self.count:
+            return float("nan")
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[i - 1] if i else 0.0
+                return lower + (self.bounds[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.bounds[-1]
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.latency = {}    # (method, route) -> Histogram
+        self.sizes = {}      # (method, route) -> Histogram
+        self.responses = {}  # (method, route, status) -> count
+        self.db_queries = {}  # (method, route) -> Histogram of statements per request
+        self.db_time = {}    # (method, route) -> Histogram of DB seconds per request
+        self.slow_queries = {}  # (method, route) -> count
+
+    def started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def finished(self, method: str, route: str, status: int, seconds: float, size: int, queries=None):
+        key = (method, route)
+        with self._lock:
+            self.in_flight -= 1
+            latency = self.latency.get(key)
+            if latency is None:
+                latency = self.latency[key] = Histogram(LATENCY_BUCKETS)
+                self.sizes[key] = Histogram(SIZE_BUCKETS)
+                self.db_queries[key] = Histogram(QUERY_COUNT_BUCKETS)
+                self.db_time[key] = Histogram(LATENCY_BUCKETS)
+                self.slow_queries[key] = 0
+            latency.observe(seconds)
+            self.sizes[key].observe(size)
+            if queries is not None:
+                self.db_queries[key].observe(queries.count)
+                self.db_time[key].observe(queries.seconds)
+                self.slow_queries[key] += queries.slow
+            status_key = (method, route, status)
+            self.responses[status_key] = self.responses.get(status_key, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self.in_flight = 0
+            self.latency.clear()
+            self.sizes.clear()
+            self.responses.clear()
+            self.db_queries.clear()
+            self.db_time.clear()
+            self.slow_queries.clear()
+
+    def render(self) -> str:
+        with self._lock:
+            in_flight = self.in_flight
+            latency = {key: _copy(h) for key, h in self.latency.items()}
+            sizes = {key: _copy(h) for key, h in self.sizes.items()}
+            responses = dict(self.responses)
+            db_queries = {key: _copy(h) for key, h in self.db_queries.items()}
+            db_time = {key: _copy(h) for key, h in self.db_time.items()}
+            slow_queries = dict(self.slow_queries)
+
+        lines = [
+            "# HELP http_requests_in_flight Requests being served.",
+            "# TYPE http_requests_in_flight gauge",
+            f"http_requests_in_flight {in_flight}",
+            "# HELP http_responses_total Responses by route and status.",
+            "# TYPE http_responses_total counter",
+        ]
+        for (method, route, status), n in sorted(responses.items()):
+            lines.append(f'http_responses_total{{{_labels(method, route)},status="{status}"}} {n}')
+        _histogram_lines(lines, "http_request_duration_seconds", "Request latency by route.", latency)
+        lines += [
+            "# HELP http_request_duration_quantile_seconds Latency quantiles estimated from the buckets.",
+            "# TYPE http_request_duration_quantile_seconds gauge",
+        ]
+        for (method, route), h in sorted(latency.items()):
+            for q in QUANTILES:
+                lines.append(
+                    f'http_request_duration_quantile_seconds{{{_labels(method, route)},quantile="{q}"}} '
+                    f"{_number(h.quantile(q))}"
+                )
+        _histogram_lines(lines, "http_response_size_bytes", "Response body size by route.", sizes)
+        _histogram_lines(lines, "http_request_db_queries", "SQL statements per request by route.", db_queries)
+        _histogram_lines(lines, "http_request_db_seconds", "Time in SQL statements per request by route.", db_time)
+        lines += [
+            "# HELP http_request_db_slow_queries_total Statements over SLOW_QUERY_SECONDS by route.",
+            "# TYPE http_request_db_slow_queries_total counter",
+        ]
+        for (method, route), n in sorted(slow_queries.items()):
+            lines.append(f"http_request_db_slow_queries_total{{{_labels(method, route)}}} {n}")
+        lines += [
+            "# HELP singleflight_calls_total Calls that did the work.",
+            "# TYPE singleflight_calls_total counter",
+        ]
+        lines += [f'singleflight_calls_total{{group="{name}"}} {g.calls}' for name, g in sorted(singleflight.groups.items())]
+        lines += [
+            "# HELP singleflight_coalesced_total Calls that shared the result of one already in flight.",
+            "# TYPE singleflight_coalesced_total counter",
+        ]
+        lines += [
+            f'singleflight_coalesced_total{{group="{name}"}} {g.coalesced}' for name, g in sorted(singleflight.groups.items())
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def _copy(h: Histogram) -> Histogram:
+    copy = Histogram(h.bounds)
+    copy.counts = list(h.counts)
+    copy.count = h.count
+    copy.sum = h.sum
+    return copy
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(method: str, route: str) -> str:
+    return f'method="{method}",route="{_escape(route)}"'
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value == value else "NaN"
+
+
+def _histogram_lines(lines: list, name: str, help_text: str, histograms: dict):
+    lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for (method, route), h in sorted(histograms.items()):
+        labels = _labels(method, route)
+        cumulative = 0
+        for bound, n in zip(h.bounds, h.counts):
+            cumulative += n
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {h.count}')
+        lines.append(f"{name}_sum{{{labels}}} {_number(h.sum)}")
+        lines.append(f"{name}_count{{{labels}}} {h.count}")
+
+
+registry = Registry()
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware, so the response body is passed through untouched.
+    Requests are labelled by route template (/products/{product_id}), which
+    the router leaves in the scope after matching. With debug_headers, the
+    statements run so far are reported in X-DB-Queries and X-DB-Time (ms).
+    """
+
+    def __init__(self, app, registry: Registry = registry, debug_headers: bool = False):
+        self.app = app
+        self.registry = registry
+        self.debug_headers = debug_headers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        size = 0
+
+        with track_queries() as queries:
+            async def send_wrapper(message):
+                nonlocal status, size
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    if self.debug_headers:
+                        message["headers"] = list(message.get("headers", [])) + [
+                            (b"x-db-queries", str(queries.count).encode()),
+                            (b"x-db-time", f"{queries.seconds * 1000:.2f}".encode()),
+                        ]
+                elif message["type"] == "http.response.body":
+                    size += len(message.get("body", b""))
+                await send(message)
+
+            self.registry.started()
+            started = time.perf_counter()
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = scope.get("route")
+                self.registry.finished(
+                    scope["method"],
+                    getattr(route, "path_format", None) or getattr(route, "path", None) or UNMATCHED,
+                    status,
+                    time.perf_counter() - started,
+                    size,
+                    queries,
+                )
+
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+def metrics():
+    return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,4 +1,9 @@
+from .change_model import ProductChange
+from .image_model import StoredImage
+from .job_model import Job
+from .orphan_model import PendingOrphan
 from .product_model import Product
+from .upload_session_model import UploadSession
 from .user_model import User
 
-__all__ = ["Product", "User"]
+__all__ = ["Job", "PendingOrphan", "Product", "ProductChange", "StoredImage", "UploadSession", "User"]
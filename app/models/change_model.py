@@ -0,0 +1,17 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, DateTime
+from app.database import Base
+
+class ProductChange(Base):
+    """A committed create, update or delete of a product; the id is its version."""
+    __tablename__ = "product_changes"
+    # AUTOINCREMENT: versions are never reused, even after old rows are pruned
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, nullable=False)
+    # create, update or delete
+    op = Column(String(10), nullable=False)
+    # Process that made the change, which has already delivered it to its own subscribers
+    origin = Column(String(32), nullable=False)
+    changed_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
@@ -0,0 +1,15 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, DateTime
+from app.database import Base
+
+class StoredImage(Base):
+    """One stored upload file, named by the SHA-256 of its content."""
+    __tablename__ = "images"
+
+    name = Column(String(255), primary_key=True)
+    size = Column(Integer, nullable=True)
+    # Number of products pointing at this file, 0 means it can be deleted
+    refcount = Column(Integer, nullable=False, default=0)
+    # Set while the cleanup deletes the file; uploads of the same content wait for it
+    deleting_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
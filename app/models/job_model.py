@@ -0,0 +1,27 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, DateTime, JSON, Text, Index
+from app.database import Base
+
+class Job(Base):
+    """A unit of background work, run by the worker pool in app.jobs."""
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(50), nullable=False)
+    payload = Column(JSON)
+    # queued, running, succeeded or failed
+    status = Column(String(20), nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    result = Column(JSON)
+    error = Column(Text)
+    # Not picked up before this time, used for retry backoff
+    run_after = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = Column(String(100))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    # Refreshed by the worker while the job runs, see jobs.requeue_stale
+    heartbeat_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    __table_args__ = (Index("ix_jobs_status_run_after", "status", "run_after"),)
@@ -0,0 +1,10 @@
+from datetime import datetime
+from sqlalchemy import Column, String, DateTime
+from app.database import Base
+
+class PendingOrphan(Base):
+    """Stored image whose last reference went away; deleted after a grace period."""
+    __tablename__ = "pending_orphans"
+
+    name = Column(String(255), primary_key=True)
+    queued_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
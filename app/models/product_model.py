@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float
+from sqlalchemy import Column, Integer, String, Float, JSON
 from app.database import Base
 
 class Product(Base):
@@ -9,3 +9,14 @@ class Product(Base):
     category = Column(String, nullable=False)
     price = Column(Float, nullable=False)
     image_path = Column(String(255), nullable=True)
+    # {label: {format: url}} of resized copies, filled in the background
+    derivatives = Column(JSON, nullable=True)
+    # Image metadata for layout and placeholders, filled in the background
+    image_width = Column(Integer, nullable=True)
+    image_height = Column(Integer, nullable=True)
+    image_bytes = Column(Integer, nullable=True)
+    dominant_color = Column(String(7), nullable=True)  # "#rrggbb"
+    blurhash = Column(String(64), nullable=True)
+
+# Columns describing the current image, cleared when it is replaced
+IMAGE_FIELDS = ("derivatives", "image_width", "image_height", "image_bytes", "dominant_color", "blurhash")
@@ -0,0 +1,20 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, DateTime
+from app.database import Base
+
+class UploadSession(Base):
+    """A resumable upload; data is appended to a partial file until it is finalized."""
+    __tablename__ = "upload_sessions"
+
+    id = Column(String(32), primary_key=True)
+    # Total size declared by the client, and bytes received so far
+    length = Column(Integer, nullable=False)
+    offset = Column(Integer, nullable=False, default=0)
+    # Name of the stored image, set when finalized
+    image_name = Column(String(255), nullable=True)
+    # Held by the request currently writing to the session, renewed as it writes;
+    # lock_token tells that request's claim from a later one
+    locked_until = Column(DateTime, nullable=True)
+    lock_token = Column(String(32), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
@@ -0,0 +1,178 @@
+"""
+On-demand profiling of single requests. An admin sends X-Profile: true and
+the request runs under a sampling profiler; the profile is saved in the
+collapsed-stack format read by flamegraph.pl and speedscope, and its id is
+returned in X-Profile-Id. Requests without the header only pay for the
+header lookup.
+"""
+import os
+import re
+import secrets
+import sys
+import threading
+from collections import Counter
+
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+from app.config import PROFILE_DIR, PROFILE_INTERVAL_MS, PROFILE_KEEP, PROFILE_MAX_SECONDS
+
+# Sampling faster than this mostly measures the sampler
+MIN_INTERVAL_MS = 0.5
+MAX_INTERVAL_MS = 100.0
+
+# Innermost frames of threads that are waiting for work, not doing any
+IDLE_FRAMES = {
+    ("threading", "wait"),
+    ("selectors", "select"),
+    ("queue", "get"),
+    ("concurrent.futures.thread", "_worker"),
+}
+
+_PROFILE_ID = re.compile(r"[0-9a-f]{16}")
+
+
+def _label(frame) -> str:
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}"
+
+
+class Sampler:
+    """
+    Samples the stacks of every busy thread in the process: the event loop
+    and the threadpool, where a request's code runs. Requests served at the
+    same time by this worker show up too, under their own thread names.
+    """
+
+    def __init__(self, interval: float, max_seconds: float = PROFILE_MAX_SECONDS):
+        self.interval = interval
+        self.max_samples = int(max_seconds / interval)
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval) and self.samples < self.max_samples:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                code = frame.f_code
+                if (frame.f_globals.get("__name__"), code.co_name) in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def profile_path(profile_id: str, profile_dir: str = None) -> str:
+    if not _PROFILE_ID.fullmatch(profile_id):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return os.path.join(profile_dir or PROFILE_DIR, f"{profile_id}.folded")
+
+
+def save(sampler: Sampler, profile_id: str, profile_dir: str = None, keep: int = PROFILE_KEEP):
+    path = profile_path(profile_id, profile_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(sampler.collapsed())
+    prune(os.path.dirname(path), keep)
+
+
+def prune(profile_dir: str, keep: int = PROFILE_KEEP) -> int:
+    """Delete all but the keep newest profiles; return how many went."""
+    profiles = []
+    with os.scandir(profile_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(".folded") and _PROFILE_ID.fullmatch(entry.name[:-len(".folded")]):
+                profiles.append((entry.stat().st_mtime, entry.path))
+    profiles.sort(reverse=True)
+    removed = 0
+    for _, path in profiles[keep:]:
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass  # pruned by another worker at the same time
+    return removed
+
+
+def interval_seconds(value: str) -> float:
+    try:
+        interval_ms = float(value) if value else PROFILE_INTERVAL_MS
+    except ValueError:
+        raise HTTPException(status_code=400, detail="X-Profile-Interval must be a number of milliseconds")
+    return min(max(interval_ms, MIN_INTERVAL_MS), MAX_INTERVAL_MS) / 1000
+
+
+def _bearer_token(headers: dict) -> str:
+    scheme, _, token = headers.get(b"authorization", b"").decode("latin-1").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return token
+
+
+class ProfileMiddleware:
+    """
+    Pure ASGI middleware. authorize(token) runs in the threadpool and raises
+    HTTPException unless the token belongs to an admin; it runs before
+    routing, so route dependencies can't do the check.
+    """
+
+    def __init__(self, app, authorize, profile_dir: str = None):
+        self.app = app
+        self.authorize = authorize
+        self.profile_dir = profile_dir
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        if headers.get(b"x-profile", b"").lower() not in (b"1", b"true"):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            interval = interval_seconds(headers.get(b"x-profile-interval", b"").decode("latin-1"))
+            await run_in_threadpool(self.authorize, _bearer_token(headers))
+        except HTTPException as exc:
+            response = JSONResponse({"detail": exc.detail}, status_code=exc.status_code, headers=exc.headers)
+            await response(scope, receive, send)
+            return
+
+        profile_id = secrets.token_hex(8)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        sampler = Sampler(interval)
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Joining the sampler waits for the sample in progress, not on the event loop
+            await run_in_threadpool(sampler.stop)
+            await run_in_threadpool(save, sampler, profile_id, self.profile_dir)
@@ -0,0 +1,106 @@
+"""
+Cache of encoded JSON responses, keyed by canonical request parameters.
+
+Entries carry the cache generation they were computed in. Any product
+change, in this worker or (through the change bus) another, bumps the
+generation, which turns every older entry into a miss at once. Entries
+also expire after ttl seconds, and the least recently used are evicted
+past max_bytes.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import Request, Response
+
+from app import changes
+from app.config import LIST_CACHE_MAX_BYTES, LIST_CACHE_TTL_SECONDS
+
+
+class Entry:
+    __slots__ = ("body", "etag", "headers", "generation", "expires_at")
+
+    def __init__(self, body: bytes, generation: int, expires_at: float, headers: dict = None):
+        self.body = body
+        self.etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        self.headers = headers or {}
+        self.generation = generation
+        self.expires_at = expires_at
+
+
+class ResponseCache:
+    def __init__(self, ttl: float = LIST_CACHE_TTL_SECONDS, max_bytes: int = LIST_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.generation = 0
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> Entry, least recently used first
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_bytes > 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.generation != self.generation or entry.expires_at <= time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, body: bytes, generation: int, headers: dict = None) -> Entry:
+        """
+        Store body, and extra headers to send with it, computed in generation.
+        It is returned but not stored if a write has bumped the generation
+        since, as it may predate the write.
+        """
+        entry = Entry(body, generation, time.monotonic() + self.ttl, headers)
+        with self._lock:
+            if not self.enabled or generation != self.generation or len(body) > self.max_bytes:
+                return entry
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self.total_bytes += len(body)
+            while self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+        return entry
+
+    def _remove(self, key):
+        self.total_bytes -= len(self._entries.pop(key).body)
+
+    def invalidate(self):
+        """Make every cached response a miss; the memory is reclaimed as they're replaced."""
+        with self._lock:
+            self.generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+            self.generation += 1
+
+    def response(self, entry: Entry, request: Request) -> Response:
+        headers = {**entry.headers, "Cache-Control": f"public, max-age={int(self.ttl)}", "ETag": entry.etag}
+        if request.headers.get("if-none-match") == entry.etag:
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
+product_lists = ResponseCache()
+# Filtered, sorted pages with totals of app.routers.product
+product_searches = ResponseCache()
+
+
+@changes.subscribe
+def _products_changed(events):
+    product_lists.invalidate()
+    product_searches.invalidate()
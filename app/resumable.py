@@ -0,0 +1,227 @@
+import hashlib
+import os
+import secrets
+from datetime import datetime, timedelta
+from typing import AsyncIterable
+
+from fastapi import HTTPException
+from sqlalchemy import or_, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app import crud
+from app.config import (
+    RESUMABLE_MAX_SIZE,
+    UPLOAD_CHUNK_SIZE,
+    UPLOAD_SESSION_DIR,
+    UPLOAD_SESSION_TTL_SECONDS,
+)
+from app.models import UploadSession
+from app.uploads import SIGNATURE_LENGTH, detect_image_ext
+
+# A writer that died without releasing its session blocks it this long at most;
+# live writers renew the lock with every flush
+LOCK_SECONDS = 300
+
+
+def session_path(session_id: str, session_dir: str = None) -> str:
+    return os.path.join(session_dir or UPLOAD_SESSION_DIR, f"{session_id}.part")
+
+
+def _expires_at() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=UPLOAD_SESSION_TTL_SECONDS)
+
+
+def create_session(db: Session, length: int, session_dir: str = None,
+                   max_size: int = RESUMABLE_MAX_SIZE) -> UploadSession:
+    """Start a resumable upload of length bytes, with an empty partial file."""
+    if length <= 0:
+        raise HTTPException(status_code=400, detail="Upload-Length must be positive")
+    if length > max_size:
+        raise HTTPException(status_code=413, detail="File is too large")
+    session = UploadSession(id=secrets.token_hex(16), length=length, offset=0, expires_at=_expires_at())
+    path = session_path(session.id, session_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "wb").close()
+    db.add(session)
+    db.commit()
+    db.refresh(session)
+    return session
+
+
+def get_session(db: Session, session_id: str) -> UploadSession:
+    session = db.get(UploadSession, session_id)
+    if session is None or session.expires_at < datetime.utcnow():
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return session
+
+
+def _claim(db: Session, session_id: str, offset: int):
+    """
+    Take the session for one writer, only if it is still at offset and not
+    finalized. Returns the lock token of this claim, or None.
+    """
+    now = datetime.utcnow()
+    token = secrets.token_hex(16)
+    claimed = db.execute(
+        update(UploadSession)
+        .where(
+            UploadSession.id == session_id,
+            UploadSession.offset == offset,
+            UploadSession.image_name.is_(None),
+            or_(UploadSession.locked_until.is_(None), UploadSession.locked_until < now),
+        )
+        .values(locked_until=now + timedelta(seconds=LOCK_SECONDS), lock_token=token)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return token if claimed == 1 else None
+
+
+def _locked(db: Session, session_id: str, token: str, **values):
+    """Update the session if token still holds its lock, else 409: the lock expired and was taken."""
+    updated = db.execute(
+        update(UploadSession)
+        .where(UploadSession.id == session_id, UploadSession.lock_token == token)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    if updated != 1:
+        raise HTTPException(status_code=409, detail="Upload was taken over by another request")
+
+
+def _renew(db: Session, session_id: str, token: str):
+    _locked(db, session_id, token, locked_until=datetime.utcnow() + timedelta(seconds=LOCK_SECONDS))
+
+
+def _release(db: Session, session_id: str, token: str, **values):
+    _locked(db, session_id, token, locked_until=None, lock_token=None, **values)
+
+
+async def append(db: Session, session_id: str, offset: int, chunks: AsyncIterable[bytes],
+                 session_dir: str = None, chunk_size: int = UPLOAD_CHUNK_SIZE) -> int:
+    """
+    Append a stream of chunks at offset and return the new offset. offset
+    must match what the server has (HEAD the session after a failure).
+    Bytes received before a disconnect are kept, so the client resumes from
+    there. Chunks are handed to the file as they are, without joining them.
+    The lock is renewed before every write; a writer that lost it (stalled
+    past LOCK_SECONDS while another request took over) fails with 409
+    without touching the file or the offset.
+    """
+    session = await run_in_threadpool(get_session, db, session_id)
+    if session.image_name:
+        raise HTTPException(status_code=409, detail="Upload is already finalized")
+    if offset != session.offset:
+        raise HTTPException(status_code=409, detail=f"Offset mismatch, server has {session.offset}")
+    length = session.length
+    token = await run_in_threadpool(_claim, db, session_id, offset)
+    if token is None:
+        raise HTTPException(status_code=409, detail="Upload is being written by another request")
+
+    f = None
+    written = offset
+    pending, pending_size = [], 0
+
+    def start():
+        f = open(session_path(session_id, session_dir), "r+b")
+        # Drop anything past the recorded offset, left by a writer that died mid-write
+        f.truncate(offset)
+        f.seek(offset)
+        return f
+
+    def flush():
+        nonlocal written, pending, pending_size
+        _renew(db, session_id, token)
+        f.writelines(pending)
+        written += pending_size
+        pending, pending_size = [], 0
+
+    try:
+        f = await run_in_threadpool(start)
+        async for chunk in chunks:
+            if written + pending_size + len(chunk) > length:
+                raise HTTPException(status_code=413, detail="Upload is longer than declared")
+            pending.append(chunk)
+            pending_size += len(chunk)
+            if pending_size >= chunk_size:
+                await run_in_threadpool(flush)
+    finally:
+        try:
+            if f is not None:
+                try:
+                    if pending:
+                        await run_in_threadpool(flush)
+                finally:
+                    await run_in_threadpool(f.close)
+        finally:
+            await run_in_threadpool(_release, db, session_id, token, offset=written, expires_at=_expires_at())
+    return written
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(UPLOAD_CHUNK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def finalize(db: Session, session_id: str, backend, session_dir: str = None) -> UploadSession:
+    """
+    Check the completed upload is an image and move it into storage under
+    its content hash. The image is claimed as unused first, so the cleanup
+    removes it if no product takes it within the grace period.
+    Finalizing again returns the same result.
+    """
+    session = get_session(db, session_id)
+    if session.image_name:
+        return session
+    if session.offset != session.length:
+        raise HTTPException(status_code=409, detail=f"Upload is incomplete, {session.offset} of {session.length} bytes")
+    token = _claim(db, session_id, session.length)
+    if token is None:
+        raise HTTPException(status_code=409, detail="Upload is being written by another request")
+
+    path = session_path(session_id, session_dir)
+    try:
+        with open(path, "rb") as f:
+            ext = detect_image_ext(f.read(SIGNATURE_LENGTH))
+        if ext is None:
+            db.delete(session)
+            db.commit()
+            os.remove(path)
+            raise HTTPException(status_code=400, detail="File must be JPG or PNG")
+        name = _sha256(path) + ext
+        crud.claim_image(db.get_bind(), name, session.length)
+        backend.store(path, name)
+    except BaseException:
+        if db.get(UploadSession, session_id) is not None:
+            _release(db, session_id, token)
+        raise
+
+    _release(db, session_id, token, image_name=name, expires_at=_expires_at())
+    db.refresh(session)
+    return session
+
+
+def finalized_image(db: Session, session_id: str) -> str:
+    """Stored image name of a finalized upload, for attaching it to a product."""
+    session = get_session(db, session_id)
+    if not session.image_name:
+        raise HTTPException(status_code=409, detail="Upload is not finalized")
+    return session.image_name
+
+
+def expire_sessions(db: Session, session_dir: str = None) -> int:
+    """Delete expired sessions and their partial files; return how many went."""
+    expired = db.query(UploadSession).filter(UploadSession.expires_at < datetime.utcnow()).all()
+    for session in expired:
+        try:
+            os.remove(session_path(session.id, session_dir))
+        except FileNotFoundError:
+            pass
+        db.delete(session)
+    db.commit()
+    return len(expired)
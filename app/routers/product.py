@@ -1,7 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import or_
-from app import database
+from app import database, response_cache, singleflight
 from app.models.product_model import Product
 from app.schemas.product_schema import ProductCreate, ProductResponse, ProductUpdate
 
@@ -20,6 +22,7 @@ def create_product(request: ProductCreate, db: Session = Depends(database.get_db
 # READ (dengan filter, pencarian, sorting, dan pagination)
 @router.get("/")
 def get_all_product(
+    request: Request,
     db: Session = Depends(database.get_db),
     keyword: str | None = Query(None, description="Search by name or category"),
     category: str | None = Query(None, description="Filter by category"),
@@ -30,6 +33,24 @@ def get_all_product(
     page: int = Query(1, ge=1, description="Page number (start from 1)"),
     limit: int = Query(10, ge=1, le=100, description="Total item per page"),
 ):
+    # Popular combinations are served from the cache, without the COUNT and the page queries
+    cache = response_cache.product_searches
+    key = singleflight.key(
+        "/products/", keyword=keyword or None, category=category or None, min_price=min_price,
+        max_price=max_price, sort_by=sort_by if sort_by in ["name", "price", "category"] else None,
+        sort_order="desc" if sort_order == "desc" else "asc", page=page, limit=limit,
+    )
+    entry = cache.get(key)
+    if entry is None:
+        generation = cache.generation
+        body = JSONResponse(jsonable_encoder(search_products(
+            db, keyword, category, min_price, max_price, sort_by, sort_order, page, limit
+        ))).body
+        entry = cache.set(key, body, generation)
+    return cache.response(entry, request)
+
+
+def search_products(db, keyword, category, min_price, max_price, sort_by, sort_order, page, limit) -> dict:
     query = db.query(Product)
 
     # Filter pencarian bebas
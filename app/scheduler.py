@@ -0,0 +1,160 @@
+import logging
+import os
+import threading
+
+from app import jobs, tasks  # noqa: F401  tasks registers the job handlers
+from app.config import SCHEDULER_LOCK_FILE, SCHEDULER_RETRY_SECONDS
+from app.database import SessionLocal, engine
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+
+def cleanup_job():
+    """Queue the nightly cleanup; a job worker runs it, with retries."""
+    db = SessionLocal()
+    try:
+        jobs.enqueue(db, "cleanup")
+    finally:
+        db.close()
+
+
+def reconcile_job():
+    """Queue the weekly full storage scan."""
+    db = SessionLocal()
+    try:
+        jobs.enqueue(db, "cleanup", {"full": True})
+    finally:
+        db.close()
+
+
+def expire_uploads_job():
+    """Queue removal of abandoned resumable uploads."""
+    db = SessionLocal()
+    try:
+        jobs.enqueue(db, "expire_upload_sessions")
+    finally:
+        db.close()
+
+
+def prune_changes_job():
+    """Queue removal of old product changes."""
+    db = SessionLocal()
+    try:
+        jobs.enqueue(db, "prune_product_changes")
+    finally:
+        db.close()
+
+
+def add_jobs(scheduler):
+    """
+    Register the periodic jobs. Jobs are stored by reference ("module:function")
+    and replace their stored copy, so a changed schedule takes effect on restart.
+    """
+    # Start cleanup every 00:00
+    scheduler.add_job(
+        "app.scheduler:cleanup_job", "cron", hour=0, minute=0,
+        id="cleanup", replace_existing=True,
+    )
+    # Full storage scan once a week, Sunday 03:00
+    scheduler.add_job(
+        "app.scheduler:reconcile_job", "cron", day_of_week="sun", hour=3, minute=0,
+        id="reconcile", replace_existing=True,
+    )
+    # Abandoned resumable uploads, every hour
+    scheduler.add_job(
+        "app.scheduler:expire_uploads_job", "interval", hours=1,
+        id="expire_uploads", replace_existing=True,
+    )
+    # Old product changes, every day at 04:00
+    scheduler.add_job(
+        "app.scheduler:prune_changes_job", "cron", hour=4, minute=0,
+        id="prune_changes", replace_existing=True,
+    )
+
+
+def lock_file(path: str):
+    """Take an exclusive lock on path without waiting; return the open file, or None if taken."""
+    f = open(path, "a+")
+    try:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        return None
+    f.seek(0)
+    f.truncate()
+    f.write(str(os.getpid()))
+    f.flush()
+    return f
+
+
+class LeaderScheduler:
+    """
+    Runs the scheduler in one process only. Every worker calls start(); the
+    one that gets the lock file runs the jobs, the others retry every
+    retry_seconds and take over when the leader exits (the OS drops the lock
+    with the process). Jobs live in the database, so runs missed while no
+    leader was up are caught up once (coalesced).
+    """
+
+    def __init__(self, lock_path: str = SCHEDULER_LOCK_FILE, retry_seconds: int = SCHEDULER_RETRY_SECONDS,
+                 jobstore=None):
+        self.lock_path = lock_path
+        self.retry_seconds = retry_seconds
+        self.jobstore = jobstore
+        self.scheduler = None
+        self._lock = None
+        self._stop = threading.Event()
+        self._watcher = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self.scheduler is not None
+
+    def start(self):
+        if self._try_lead():
+            return
+        self._watcher = threading.Thread(target=self._watch, name="scheduler-leader", daemon=True)
+        self._watcher.start()
+
+    def _watch(self):
+        while not self._stop.wait(self.retry_seconds):
+            if self._try_lead():
+                return
+
+    def _try_lead(self) -> bool:
+        self._lock = lock_file(self.lock_path)
+        if self._lock is None:
+            return False
+        # Imported here, only the leader process needs APScheduler
+        from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+        from apscheduler.schedulers.background import BackgroundScheduler
+
+        jobstore = self.jobstore if self.jobstore is not None else SQLAlchemyJobStore(engine=engine)
+        scheduler = BackgroundScheduler(
+            jobstores={"default": jobstore},
+            job_defaults={"coalesce": True, "max_instances": 1, "misfire_grace_time": 3600},
+        )
+        add_jobs(scheduler)
+        scheduler.start()
+        self.scheduler = scheduler
+        logger.info("Scheduler started in process %s", os.getpid())
+        return True
+
+    def shutdown(self):
+        self._stop.set()
+        if self.scheduler is not None:
+            self.scheduler.shutdown()
+            self.scheduler = None
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
@@ -1,6 +1,8 @@
 # app/schemas/__init__.py
 from .product_schema import ProductBase, ProductCreate, ProductUpdate, ProductResponse, Product
 from .user_schema import UserCreate, UserLogin, Token
+from .upload_schema import PresignRequest, PresignedUpload, UploadSessionResponse
+from .job_schema import JobResponse
 
 __all__ = [
     "ProductBase",
@@ -10,5 +12,9 @@ __all__ = [
     "Product",
     'UserCreate',
     'UserLogin',
-    'Token'
+    'Token',
+    'PresignRequest',
+    'PresignedUpload',
+    'UploadSessionResponse',
+    'JobResponse'
 ]
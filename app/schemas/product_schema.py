@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Dict, Optional
 
 class ProductBase(BaseModel):
     name: str = Field(..., example="Tamarind Herbal Medicine")
@@ -15,6 +15,12 @@ class ProductUpdate(ProductBase):
 class ProductResponse(ProductBase):
     id: int
     image_path: Optional[str] = None
+    derivatives: Optional[Dict[str, Dict[str, str]]] = None
+    image_width: Optional[int] = None
+    image_height: Optional[int] = None
+    image_bytes: Optional[int] = None
+    dominant_color: Optional[str] = None
+    blurhash: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -0,0 +1,29 @@
+from pydantic import BaseModel, Field
+from datetime import datetime
+from typing import Dict, Literal, Optional
+
+class PresignRequest(BaseModel):
+    sha256: str = Field(..., pattern="^[0-9a-f]{64}$", description="Hex SHA-256 of the file")
+    content_type: Literal["image/jpeg", "image/png"]
+    size: int = Field(..., gt=0, description="File size in bytes, at most MAX_UPLOAD_SIZE")
+
+class PresignedUpload(BaseModel):
+    # Pass as image_name when creating or updating the product
+    name: str
+    # Identical content is already stored, nothing to upload
+    exists: bool
+    method: Optional[str] = None
+    url: Optional[str] = None
+    headers: Optional[Dict[str, str]] = None
+    expires_in: Optional[int] = None
+
+class UploadSessionResponse(BaseModel):
+    id: str
+    length: int
+    offset: int
+    # Set once finalized; pass as upload_id or image_name to attach it to a product
+    image_name: Optional[str] = None
+    expires_at: datetime
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,90 @@
+"""
+Request coalescing: while one caller computes the result for a key,
+callers with the same key wait for it and share it instead of repeating
+the work. The result (or exception) of the first call is handed to every
+caller that arrived while it ran; nothing is kept after that.
+"""
+import asyncio
+import inspect
+import threading
+
+from starlette.concurrency import run_in_threadpool
+
+# Every group by name, for the metrics endpoint
+groups = {}
+
+
+def key(route: str, **params) -> tuple:
+    """Key for a route and its parsed parameters, whatever order they came in."""
+    return (route, tuple(sorted(params.items())))
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Group:
+    """
+    Coalesces calls by key. do() is for code running in threads (sync
+    handlers); do_async() for the event loop, where waiters hold no thread.
+    A caller arriving after a write may join a call that started before it,
+    so only share reads that can be that stale.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._threads = {}  # key -> _Call
+        self._futures = {}  # key -> asyncio.Future
+        groups[name] = self
+
+    def do(self, call_key, func, *args, **kwargs):
+        with self._lock:
+            call = self._threads.get(call_key)
+            leader = call is None
+            if leader:
+                call = self._threads[call_key] = _Call()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._threads[call_key]
+            call.done.set()
+
+    async def do_async(self, call_key, func, *args, **kwargs):
+        """func may be a coroutine function; a plain one runs in the threadpool."""
+        future = self._futures.get(call_key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        if inspect.iscoroutinefunction(func):
+            future = asyncio.ensure_future(func(*args, **kwargs))
+        else:
+            future = asyncio.ensure_future(run_in_threadpool(func, *args, **kwargs))
+        self._futures[call_key] = future
+        self.calls += 1
+        try:
+            return await asyncio.shield(future)
+        finally:
+            self._futures.pop(call_key, None)
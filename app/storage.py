@@ -0,0 +1,353 @@
+import contextlib
+import mimetypes
+import os
+import re
+import tempfile
+import time
+
+from app.config import (
+    PRESIGN_EXPIRE_SECONDS,
+    S3_BUCKET,
+    S3_ENDPOINT_URL,
+    S3_PREFIX,
+    S3_REGION,
+    STORAGE_BACKEND,
+    UPLOAD_DIR,
+)
+
+# Files live in two levels of prefix directories: "abcdef.jpg" -> "ab/cd/abcdef.jpg".
+# Upload names are hashes (or UUIDs for old uploads), so prefixes spread evenly.
+SHARD_WIDTH = 2
+SHARD_DEPTH = 2
+
+# Objects this app writes to a bucket: content-hash names and their derivatives
+S3_OBJECT_NAME_RE = re.compile(r"^[0-9a-f]{64}(_\w+)?\.\w+$")
+
+
+def shard_parts(name: str) -> list:
+    stem = os.path.splitext(name)[0].lower().ljust(SHARD_WIDTH * SHARD_DEPTH, "_")
+    return [stem[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_DEPTH)]
+
+
+def relative_path(name: str) -> str:
+    return os.path.join(*shard_parts(name), name)
+
+
+def file_path(name: str, upload_dir: str = UPLOAD_DIR) -> str:
+    """Sharded location of a file, whether it exists or not."""
+    return os.path.join(upload_dir, relative_path(name))
+
+
+def prepare_path(name: str, upload_dir: str = UPLOAD_DIR) -> str:
+    """Sharded location of a file about to be written, creating its directory."""
+    path = file_path(name, upload_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def resolve(name: str, upload_dir: str = UPLOAD_DIR):
+    """
+    Path of an existing file, or None. Files not migrated yet are still
+    found in the flat layout, so the migration can run while serving.
+    """
+    sharded = file_path(name, upload_dir)
+    if os.path.isfile(sharded):
+        return sharded
+    flat = os.path.join(upload_dir, name)
+    if os.path.isfile(flat):
+        return flat
+    # The migration may have moved it between the two checks
+    if os.path.isfile(sharded):
+        return sharded
+    return None
+
+
+def url(name: str) -> str:
+    """Public URL, independent of where the file sits on disk."""
+    return f"/uploads/{name}"
+
+
+def remove(name: str, upload_dir: str = UPLOAD_DIR) -> bool:
+    path = resolve(name, upload_dir)
+    if path is None:
+        return False
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def iter_files(upload_dir: str = UPLOAD_DIR):
+    """
+    Yield (name, size, mtime) for every stored file, flat or sharded,
+    walking one directory at a time instead of building a full listing.
+    Hidden entries (temp files of uploads in progress) are skipped.
+    """
+    stack = [upload_dir]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat()
+                    yield entry.name, stat.st_size, stat.st_mtime
+
+
+def migrate_flat_files(upload_dir: str = UPLOAD_DIR, limit: int = None, pause: float = 0.0,
+                       batch_size: int = 1000) -> int:
+    """
+    Move files from the flat upload directory into the sharded layout.
+    Every move is an atomic rename, so it is safe to stop at any point and
+    run again later; it continues with the files still left at the top level.
+    Returns the number of files moved.
+    """
+    moved = 0
+    with os.scandir(upload_dir) as entries:
+        for entry in entries:
+            if limit is not None and moved >= limit:
+                break
+            if entry.name.startswith(".") or not entry.is_file(follow_symlinks=False):
+                continue
+            target = prepare_path(entry.name, upload_dir)
+            if os.path.exists(target):
+                # Already copied by an earlier interrupted run, content is identical
+                os.remove(entry.path)
+            else:
+                os.replace(entry.path, target)
+            moved += 1
+            if pause and moved % batch_size == 0:
+                # Leave disk bandwidth to the running app
+                time.sleep(pause)
+    return moved
+
+
+# Stored names never change content, so clients and CDNs may cache them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def content_type(name: str) -> str:
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+class LocalStorage:
+    """Image files on the local disk, in the sharded layout under upload_dir."""
+
+    def __init__(self, upload_dir: str = UPLOAD_DIR):
+        self.upload_dir = upload_dir
+        # Temp files are written next to the final location so store() is a rename
+        self.staging_dir = upload_dir
+
+    def location(self, name: str) -> str:
+        """Value kept in Product.image_path for a stored name."""
+        return file_path(name, self.upload_dir)
+
+    def exists(self, name: str) -> bool:
+        return resolve(name, self.upload_dir) is not None
+
+    def store(self, src_path: str, name: str) -> str:
+        """Move a finished local file into storage under name, return its location."""
+        existing = resolve(name, self.upload_dir)
+        if existing:
+            # Same content already stored, keep the existing file; touched, so
+            # the full scan counts its age from this upload
+            os.remove(src_path)
+            os.utime(existing)
+            return existing
+        path = prepare_path(name, self.upload_dir)
+        os.replace(src_path, path)
+        return path
+
+    def delete(self, name: str) -> bool:
+        return remove(name, self.upload_dir)
+
+    def iter_files(self):
+        """Yield (name, size, mtime) of every stored file."""
+        return iter_files(self.upload_dir)
+
+    def size(self, name: str) -> int:
+        path = resolve(name, self.upload_dir)
+        if path is None:
+            raise FileNotFoundError(name)
+        return os.path.getsize(path)
+
+    def read_head(self, name: str, size: int) -> bytes:
+        path = resolve(name, self.upload_dir)
+        if path is None:
+            raise FileNotFoundError(name)
+        with open(path, "rb") as f:
+            return f.read(size)
+
+    @contextlib.contextmanager
+    def local_copy(self, name: str):
+        """Yield a local path with the file's content."""
+        path = resolve(name, self.upload_dir)
+        if path is None:
+            raise FileNotFoundError(name)
+        yield path
+
+    def local_path(self, name: str):
+        """Path the app can serve directly, or None."""
+        return resolve(name, self.upload_dir)
+
+    def read_url(self, name: str):
+        """URL to redirect readers to; None means the app serves the file."""
+        return None
+
+    def presigned_upload(self, name: str, content_type: str, sha256_b64: str = None, size: int = None):
+        """Direct-to-storage upload target; None when the backend has none."""
+        return None
+
+
+class S3Storage:
+    """
+    Image files in an S3-compatible bucket (AWS S3, MinIO, Ceph, ...).
+    Reads are redirected to presigned URLs and clients can upload
+    straight to the bucket, so image bytes do not go through the API.
+    """
+
+    def __init__(self, bucket: str = S3_BUCKET, endpoint_url: str = S3_ENDPOINT_URL,
+                 region: str = S3_REGION, prefix: str = S3_PREFIX, client=None):
+        if not bucket:
+            raise RuntimeError("S3_BUCKET must be set to use the s3 storage backend")
+        if client is None:
+            try:
+                import boto3
+            except ImportError as exc:
+                raise RuntimeError("The s3 storage backend needs boto3 (pip install boto3)") from exc
+            client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        # Uploads are hashed in a local temp dir before they are sent
+        self.staging_dir = tempfile.gettempdir()
+
+    def key(self, name: str) -> str:
+        parts = shard_parts(name) + [name]
+        if self.prefix:
+            parts.insert(0, self.prefix)
+        return "/".join(parts)
+
+    def location(self, name: str) -> str:
+        return f"s3://{self.bucket}/{self.key(name)}"
+
+    def exists(self, name: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+        except ClientError as exc:
+            if exc.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def store(self, src_path: str, name: str) -> str:
+        try:
+            if not self.exists(name):
+                self.client.upload_file(
+                    src_path, self.bucket, self.key(name),
+                    ExtraArgs={"ContentType": content_type(name), "CacheControl": IMMUTABLE_CACHE_CONTROL},
+                )
+        finally:
+            os.remove(src_path)
+        return self.location(name)
+
+    def delete(self, name: str) -> bool:
+        if not self.exists(name):
+            return False
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+        return True
+
+    def iter_files(self):
+        """
+        Yield (name, size, mtime) of every image object, one listing page at
+        a time. Keys that are not a stored name at its sharded key are left
+        out, so the reconcile never touches other files sharing the bucket.
+        """
+        paginator = self.client.get_paginator("list_objects_v2")
+        prefix = f"{self.prefix}/" if self.prefix else ""
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                name = obj["Key"].rsplit("/", 1)[-1]
+                if S3_OBJECT_NAME_RE.match(name) and obj["Key"] == self.key(name):
+                    yield name, obj["Size"], obj["LastModified"].timestamp()
+
+    def size(self, name: str) -> int:
+        from botocore.exceptions import ClientError
+
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key(name))["ContentLength"]
+        except ClientError as exc:
+            raise FileNotFoundError(name) from exc
+
+    def read_head(self, name: str, size: int) -> bytes:
+        from botocore.exceptions import ClientError
+
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.key(name), Range=f"bytes=0-{size - 1}")
+        except ClientError as exc:
+            raise FileNotFoundError(name) from exc
+        return response["Body"].read()
+
+    @contextlib.contextmanager
+    def local_copy(self, name: str):
+        from botocore.exceptions import ClientError
+
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(name)[1])
+        os.close(fd)
+        try:
+            try:
+                self.client.download_file(self.bucket, self.key(name), path)
+            except ClientError as exc:
+                raise FileNotFoundError(name) from exc
+            yield path
+        finally:
+            os.remove(path)
+
+    def local_path(self, name: str):
+        return None
+
+    def read_url(self, name: str, expires: int = PRESIGN_EXPIRE_SECONDS) -> str:
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": self.key(name)}, ExpiresIn=expires
+        )
+
+    def presigned_upload(self, name: str, content_type: str, sha256_b64: str = None, size: int = None,
+                         expires: int = PRESIGN_EXPIRE_SECONDS) -> dict:
+        """
+        Presigned PUT for uploading name straight to the bucket. With
+        sha256_b64 the bucket rejects a body that does not match the hash
+        the name was derived from, with size one of any other length (the
+        client's HTTP library sends Content-Length itself).
+        """
+        params = {
+            "Bucket": self.bucket,
+            "Key": self.key(name),
+            "ContentType": content_type,
+            "CacheControl": IMMUTABLE_CACHE_CONTROL,
+        }
+        headers = {"Content-Type": content_type, "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+        if sha256_b64:
+            params["ChecksumSHA256"] = sha256_b64
+            headers["x-amz-checksum-sha256"] = sha256_b64
+        if size is not None:
+            params["ContentLength"] = size
+        upload_url = self.client.generate_presigned_url("put_object", Params=params, ExpiresIn=expires)
+        return {"method": "PUT", "url": upload_url, "headers": headers, "expires_in": expires}
+
+
+_s3_storage = None
+
+
+def get_backend(upload_dir: str = UPLOAD_DIR):
+    """Storage backend selected by STORAGE_BACKEND."""
+    global _s3_storage
+    if STORAGE_BACKEND == "s3":
+        if _s3_storage is None:
+            _s3_storage = S3Storage()
+        return _s3_storage
+    return LocalStorage(upload_dir)
@@ -0,0 +1,40 @@
+import logging
+
+from app import changes, cleanup, images, jobs, resumable, storage
+from app.config import UPLOAD_DIR
+
+logger = logging.getLogger(__name__)
+
+
+@jobs.handler("process_image")
+def process_image(db, product_id: int, image_path: str):
+    """Build the derivatives of a product image."""
+    images.process_product_image(product_id, image_path, storage.get_backend(UPLOAD_DIR))
+
+
+@jobs.handler("cleanup")
+def cleanup_uploads(db, dry_run: bool = False, full: bool = False, rebuild: bool = False) -> dict:
+    """Delete unused uploads, from the orphan queue or with a full storage scan."""
+    backend = storage.get_backend(UPLOAD_DIR)
+    if full:
+        result = cleanup.reconcile(db, backend, dry_run=dry_run)
+    else:
+        if rebuild and not dry_run:
+            cleanup.rebuild_image_refs(db)
+        result = cleanup.run_cleanup(db, backend, dry_run=dry_run)
+
+    if result["deleted_files"] and not dry_run:
+        logger.info("[Cleanup] Deleted %s files, freed %s bytes", len(result["deleted_files"]), result["bytes_freed"])
+    return result
+
+
+@jobs.handler("expire_upload_sessions")
+def expire_upload_sessions(db) -> dict:
+    """Delete resumable uploads that were abandoned."""
+    return {"expired": resumable.expire_sessions(db)}
+
+
+@jobs.handler("prune_product_changes")
+def prune_product_changes(db) -> dict:
+    """Delete product changes older than CHANGE_LOG_RETENTION_SECONDS."""
+    return {"pruned": changes.prune(db)}
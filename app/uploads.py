@@ -0,0 +1,157 @@
+import hashlib
+import os
+import re
+import tempfile
+from typing import AsyncIterable, BinaryIO
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from app import crud, storage
+from app.config import MAX_UPLOAD_SIZE, UPLOAD_CHUNK_SIZE
+
+# Magic bytes -> extension used for the stored file
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+]
+SIGNATURE_LENGTH = max(len(sig) for sig, _ in IMAGE_SIGNATURES)
+# Name of a stored upload: SHA-256 of the content plus the detected extension
+STORED_NAME_RE = re.compile(r"^[0-9a-f]{64}\.(jpg|png)$")
+EXT_BY_CONTENT_TYPE = {"image/jpeg": ".jpg", "image/png": ".png"}
+
+
+def detect_image_ext(head: bytes):
+    """Return the extension matching the file's magic bytes, or None."""
+    for signature, ext in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    return None
+
+
+class ImageWriter:
+    """
+    Write an upload chunk by chunk into storage (local files in
+    `upload_dir` unless another backend is given).
+    Data goes to a hidden temp file and is only handed to the backend on
+    commit(), so readers never see a partial image. The file is named
+    after the SHA-256 of its content, computed while writing, so identical
+    uploads end up as one file. The name is claimed in the database (bind)
+    before storage is looked at, so the cleanup cannot delete a file this
+    upload is about to reuse.
+    """
+
+    def __init__(self, upload_dir: str, bind, max_size: int = MAX_UPLOAD_SIZE, backend=None):
+        self.backend = backend or storage.LocalStorage(upload_dir)
+        self.bind = bind
+        self.max_size = max_size
+        self.size = 0
+        self.ext = None
+        self.name = None
+        self._head = b""
+        self._hash = hashlib.sha256()
+        fd, self.tmp_path = tempfile.mkstemp(dir=self.backend.staging_dir, prefix=".upload-", suffix=".part")
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise HTTPException(status_code=413, detail="File is too large")
+        if self.ext is None:
+            self._head += chunk[:SIGNATURE_LENGTH]
+            if len(self._head) >= SIGNATURE_LENGTH:
+                self._check_signature()
+        self._hash.update(chunk)
+        self._file.write(chunk)
+
+    def _check_signature(self):
+        self.ext = detect_image_ext(self._head)
+        if self.ext is None:
+            raise HTTPException(status_code=400, detail="File must be JPG or PNG")
+
+    def commit(self) -> str:
+        """Hand the finished upload to storage and return its location."""
+        self._file.close()
+        if self.ext is None:
+            self._check_signature()
+        self.name = f"{self._hash.hexdigest()}{self.ext}"
+        crud.claim_image(self.bind, self.name, self.size)
+        return self.backend.store(self.tmp_path, self.name)
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+
+
+def check_stored_image(name: str, backend, bind, max_size: int = MAX_UPLOAD_SIZE) -> str:
+    """
+    Validate an image a client uploaded straight to storage and return
+    its location for Product.image_path. One over max_size is refused and
+    left to the cleanup.
+    """
+    if not STORED_NAME_RE.match(name):
+        raise HTTPException(status_code=400, detail="Invalid image name")
+    crud.claim_image(bind, name)
+    try:
+        if backend.size(name) > max_size:
+            raise HTTPException(status_code=413, detail="File is too large")
+        head = backend.read_head(name, SIGNATURE_LENGTH)
+    except FileNotFoundError:
+        raise HTTPException(status_code=400, detail="Image has not been uploaded")
+    if detect_image_ext(head) != os.path.splitext(name)[1]:
+        raise HTTPException(status_code=400, detail="File must be JPG or PNG")
+    return backend.location(name)
+
+
+def check_content_length(content_length, max_size: int = MAX_UPLOAD_SIZE):
+    """Reject a request up front when its declared size is over the limit."""
+    if content_length is not None and content_length.isdigit() and int(content_length) > max_size:
+        raise HTTPException(status_code=413, detail="File is too large")
+
+
+def copy_upload(source: BinaryIO, upload_dir: str, bind, max_size: int = MAX_UPLOAD_SIZE,
+                chunk_size: int = UPLOAD_CHUNK_SIZE, backend=None) -> str:
+    """
+    Copy a file object into storage in fixed-size chunks and return its
+    location. bind is the database the stored name is claimed in.
+    """
+    with ImageWriter(upload_dir, bind, max_size, backend) as writer:
+        while chunk := source.read(chunk_size):
+            writer.write(chunk)
+        return writer.commit()
+
+
+async def stream_upload(chunks: AsyncIterable[bytes], upload_dir: str, bind,
+                        max_size: int = MAX_UPLOAD_SIZE, chunk_size: int = UPLOAD_CHUNK_SIZE,
+                        backend=None) -> str:
+    """
+    Write an async stream of chunks (e.g. `request.stream()`) straight to
+    storage and return its location. Incoming pieces are regrouped into
+    chunk_size writes that run in the threadpool, so the event loop keeps
+    serving other requests.
+    """
+    writer = await run_in_threadpool(ImageWriter, upload_dir, bind, max_size, backend)
+    try:
+        pending, pending_size = [], 0
+        async for chunk in chunks:
+            pending.append(chunk)
+            pending_size += len(chunk)
+            if writer.size + pending_size > max_size:
+                raise HTTPException(status_code=413, detail="File is too large")
+            if pending_size >= chunk_size:
+                await run_in_threadpool(writer.write, b"".join(pending))
+                pending, pending_size = [], 0
+        if pending:
+            await run_in_threadpool(writer.write, b"".join(pending))
+        return await run_in_threadpool(writer.commit)
+    except BaseException:
+        await run_in_threadpool(writer.abort)
+        raise
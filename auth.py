@@ -1,4 +1,7 @@
 import os
+import threading
+import time
+from collections import OrderedDict
 from dotenv import load_dotenv
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
@@ -11,6 +14,7 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 1 day
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -34,7 +38,18 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def decode_access_token(token: str):
+# Tokens that already passed signature and claim checks.
+# token -> (secret used to verify, payload, exp as unix timestamp)
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+
+def clear_token_cache():
+    with _token_cache_lock:
+        _token_cache.clear()
+
+
+def _decode_uncached(token: str):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         return payload
@@ -42,6 +57,34 @@ def decode_access_token(token: str):
         return None
 
 
+def decode_access_token(token: str):
+    """
+    Verify token and return its claims, or None when invalid/expired.
+    Verified tokens are kept in a small LRU until their `exp`, so a token
+    that is sent again skips the base64 + JSON + HMAC work.
+    """
+    now = time.time()
+    with _token_cache_lock:
+        entry = _token_cache.get(token)
+        if entry is not None:
+            secret, payload, exp = entry
+            if secret == SECRET_KEY and now < exp:
+                _token_cache.move_to_end(token)
+                return dict(payload)
+            del _token_cache[token]
+
+    payload = _decode_uncached(token)
+    # Only tokens with an expiry are cached, so every entry drops out on its own
+    exp = payload.get("exp") if payload else None
+    if TOKEN_CACHE_SIZE > 0 and isinstance(exp, (int, float)):
+        with _token_cache_lock:
+            _token_cache[token] = (SECRET_KEY, dict(payload), exp)
+            _token_cache.move_to_end(token)
+            while len(_token_cache) > TOKEN_CACHE_SIZE:
+                _token_cache.popitem(last=False)
+    return payload
+
+
 # ✅ Dependency: Get user from token JWT
 def get_current_user(token: str = Depends(oauth2_scheme)):
     payload = decode_access_token(token)
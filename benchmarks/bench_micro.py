@@ -0,0 +1,237 @@
+"""
+Micro-benchmarks for the hot primitives: every function in app/crud.py,
+ProductResponse validation and serialization, JWT create/decode and
+save_upload_file. Database benchmarks run against both an in-memory and a
+file-backed SQLite database seeded with --products rows.
+
+Each benchmark runs a fixed number of calls --repeat times; the JSON output
+has the best and median time per call. Pass an earlier output to --compare
+to see the change per benchmark, and to exit 1 if any got slower than
+--threshold.
+
+Run from the project root:
+    python -m benchmarks.bench_micro --output before.json
+    python -m benchmarks.bench_micro --compare before.json
+    python -m benchmarks.bench_micro --filter crud.list
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("SECRET_KEY", "benchmark_secret_key")
+
+from fastapi import UploadFile
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import auth
+import seed as seeder
+from app import crud, schemas
+from app.database import init_db
+from app.models import Product
+
+REPEAT = 3
+PRODUCTS = 1000
+
+
+class Suite:
+    def __init__(self, repeat: int, name_filter: str = None):
+        self.repeat = repeat
+        self.name_filter = name_filter
+        self.results = []
+
+    def bench(self, name: str, func, number: int, setup=None):
+        """Time number calls of func(i); setup(), if any, runs untimed before each repeat."""
+        if self.name_filter and self.name_filter not in name:
+            return
+        timings = []
+        offset = 0
+        for _ in range(self.repeat):
+            if setup:
+                setup()
+            started = time.perf_counter()
+            for i in range(offset, offset + number):
+                func(i)
+            timings.append((time.perf_counter() - started) / number)
+            offset += number
+        self.results.append({
+            "name": name,
+            "number": number,
+            "repeat": self.repeat,
+            "best_us": round(min(timings) * 1e6, 2),
+            "median_us": round(statistics.median(timings) * 1e6, 2),
+        })
+        print(f"{name:48} {min(timings) * 1e6:10.2f} us", file=sys.stderr)
+
+
+def make_engine(kind: str, workdir: str):
+    if kind == "memory":
+        return create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    return create_engine(f"sqlite:///{os.path.join(workdir, 'bench.db')}", connect_args={"check_same_thread": False})
+
+
+def bench_crud(suite: Suite, kind: str, workdir: str, products: int, scale: float):
+    bind = make_engine(kind, workdir)
+    init_db(bind)
+    seeder.generate(bind, products=products)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=bind)()
+    rng = random.Random(0)
+    ids = [rng.randint(1, products) for _ in range(100000)]
+    # Paths of files that don't exist: the refcount work without the stat
+    image = os.path.join(workdir, "missing", "0" * 64 + ".jpg")
+    n = lambda count: max(int(count * scale), 1)  # noqa: E731
+    prefix = f"crud[{kind}]"
+
+    def committed(func):
+        # Functions that leave committing to the caller
+        def run(i):
+            func(i)
+            db.commit()
+        return run
+
+    suite.bench(f"{prefix}.get_product", lambda i: crud.get_product(db, ids[i % len(ids)]), n(500))
+    suite.bench(f"{prefix}.list_products", lambda i: crud.list_products(db, skip=ids[i % len(ids)] % products, limit=20), n(300))
+    suite.bench(f"{prefix}.list_products(search)", lambda i: crud.list_products(db, search="kunyit", limit=20), n(100))
+    suite.bench(f"{prefix}.create_product", lambda i: crud.create_product(db, f"New {i}", "Tea", 1000.0), n(200))
+    suite.bench(
+        f"{prefix}.update_product",
+        lambda i: crud.update_product(db, ids[i % len(ids)], f"Renamed {i}", "Tea", float(i)), n(200),
+    )
+    suite.bench(f"{prefix}.acquire_image", committed(lambda i: crud.acquire_image(db, image)), n(200))
+    suite.bench(f"{prefix}.release_image", committed(lambda i: crud.release_image(db, image)), n(200))
+    suite.bench(f"{prefix}.queue_if_unreferenced", committed(lambda i: crud.queue_if_unreferenced(db, "0" * 64 + ".jpg")), n(200))
+    suite.bench(
+        f"{prefix}.track_unclaimed_image",
+        committed(lambda i: crud.track_unclaimed_image(db, f"{i:064x}.jpg", 1024)), n(200),
+    )
+    suite.bench(f"{prefix}.discard_upload", lambda i: crud.discard_upload(bind, os.path.join(workdir, f"{i:064x}.png")), n(200))
+
+    # Rows for delete_product, inserted before each timed run
+    deletable = []
+
+    def add_deletable():
+        with bind.begin() as conn:
+            rows = conn.execute(
+                insert(Product).returning(Product.id),
+                [{"name": "Delete me", "category": "Tea", "price": 1.0} for _ in range(n(200))],
+            )
+            deletable[:] = [row.id for row in rows]
+
+    suite.bench(f"{prefix}.delete_product", lambda i: crud.delete_product(db, deletable[i % len(deletable)]),
+                n(200), setup=add_deletable)
+    db.close()
+    bind.dispose()
+
+
+def bench_schemas(suite: Suite, scale: float):
+    rng = random.Random(0)
+    products = [
+        Product(id=i, name=f"Jahe Merah {i}", category="Tea", price=rng.randint(1, 500) * 1000,
+                image_path=f"/uploads/ab/cd/{i:064x}.jpg", image_width=800, image_height=600,
+                image_bytes=123456, dominant_color="#aabbcc", blurhash="LxH2cg2kwzX5l?WGjue:gLfkfQfj",
+                derivatives={"thumb": {"webp": f"{i:064x}_thumb.webp"}})
+        for i in range(50)
+    ]
+    page = TypeAdapter(list[schemas.ProductResponse])
+    validated = page.validate_python(products)
+    n = lambda count: max(int(count * scale), 1)  # noqa: E731
+
+    suite.bench("schema.ProductResponse.validate", lambda i: schemas.ProductResponse.model_validate(products[i % 50]), n(20000))
+    suite.bench("schema.ProductResponse.validate(list of 50)", lambda i: page.validate_python(products), n(1000))
+    suite.bench("schema.ProductResponse.dump_json(list of 50)", lambda i: page.dump_json(validated), n(2000))
+
+
+def bench_auth(suite: Suite, scale: float):
+    n = lambda count: max(int(count * scale), 1)  # noqa: E731
+    token = auth.create_access_token({"sub": "admin"})
+    auth.clear_token_cache()
+    auth.decode_access_token(token)
+
+    suite.bench("auth.create_access_token", lambda i: auth.create_access_token({"sub": f"user{i}"}), n(5000))
+    suite.bench("auth.decode_access_token(cached)", lambda i: auth.decode_access_token(token), n(50000))
+    suite.bench("auth.decode_access_token(uncached)", lambda i: auth._decode_uncached(token), n(5000))
+
+
+def bench_uploads(suite: Suite, workdir: str, scale: float, size: int = 256 * 1024):
+    from main import save_upload_file
+
+    upload_dir = os.path.join(workdir, "uploads")
+    os.makedirs(upload_dir)
+    # Stored names are claimed in a database of the benchmark's own, next to the files
+    bind = create_engine(f"sqlite:///{os.path.join(workdir, 'uploads.db')}")
+    init_db(bind)
+    number = max(int(200 * scale), 1)
+    base = b"\xff\xd8\xff\xe0" + os.urandom(size - 4)
+    # Distinct contents, so every call stores a new file instead of finding it
+    bodies = [base + i.to_bytes(8, "big") for i in range(number * suite.repeat)]
+    suite.bench(
+        "uploads.save_upload_file(256KB)",
+        lambda i: save_upload_file(UploadFile(io.BytesIO(bodies[i]), filename="a.jpg"), upload_dir, bind), number,
+    )
+    bind.dispose()
+
+
+def run(repeat: int = REPEAT, products: int = PRODUCTS, scale: float = 1.0, name_filter: str = None):
+    suite = Suite(repeat, name_filter)
+    with tempfile.TemporaryDirectory() as workdir:
+        for kind in ("memory", "file"):
+            bench_crud(suite, kind, workdir, products, scale)
+        bench_schemas(suite, scale)
+        bench_auth(suite, scale)
+        bench_uploads(suite, workdir, scale)
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "products": products,
+        "results": suite.results,
+    }
+
+
+def compare(current: dict, previous: dict, threshold: float) -> list:
+    """Print the change per benchmark; return the names slower than threshold."""
+    before = {r["name"]: r for r in previous["results"]}
+    slower = []
+    for result in current["results"]:
+        old = before.get(result["name"])
+        if old is None:
+            continue
+        change = result["best_us"] / old["best_us"] - 1
+        flag = ""
+        if change > threshold:
+            slower.append(result["name"])
+            flag = "  SLOWER"
+        print(f"{result['name']:48} {old['best_us']:10.2f} -> {result['best_us']:10.2f} us  {change:+7.1%}{flag}",
+              file=sys.stderr)
+    return slower
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--products", type=int, default=PRODUCTS, help="rows in the benchmark databases")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply the calls per benchmark")
+    parser.add_argument("--filter", help="only benchmarks whose name contains this")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--compare", help="earlier JSON results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown that fails --compare")
+    args = parser.parse_args()
+
+    result = run(args.repeat, args.products, args.scale, args.filter)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+            f.write("\n")
+    else:
+        print(json.dumps(result, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            sys.exit(1 if compare(result, json.load(f), args.threshold) else 0)
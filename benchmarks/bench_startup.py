@@ -0,0 +1,68 @@
+"""
+Cold-start cost of the app: time to import main, to run the startup
+lifespan, and to serve the first and a second request.
+
+Each sample runs in a fresh interpreter, so module caches do not carry
+over. The first request is measured with and without the startup warmup.
+
+Run from the project root:
+    python -m benchmarks.bench_startup [--runs 5]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Runs in the child interpreter, prints one JSON line of timings in ms
+SAMPLE = """
+import json, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+from fastapi.testclient import TestClient
+from app.config import Settings
+app = main.create_app(Settings(job_workers=0, run_scheduler=False, warmup={warmup}))
+with TestClient(app) as client:
+    t2 = time.perf_counter()
+    client.get("/products/")
+    t3 = time.perf_counter()
+    client.get("/products/")
+    t4 = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (t1 - t0) * 1000,
+    "startup_ms": (t2 - t1) * 1000,
+    "first_request_ms": (t3 - t2) * 1000,
+    "second_request_ms": (t4 - t3) * 1000,
+}}))
+"""
+
+
+def sample(warmup: bool) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", SAMPLE.format(warmup=warmup)],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def run(runs: int = 5) -> dict:
+    results = {}
+    for warmup in (False, True):
+        samples = [sample(warmup) for _ in range(runs)]
+        results["warmup" if warmup else "no_warmup"] = {
+            key: statistics.median(s[key] for s in samples) for key in samples[0]
+        }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    results = run(args.runs)
+    print(f"{'':12} {'import':>10} {'startup':>10} {'1st req':>10} {'2nd req':>10}   (median ms)")
+    for label, r in results.items():
+        print(f"{label:12} {r['import_ms']:10.1f} {r['startup_ms']:10.1f} "
+              f"{r['first_request_ms']:10.1f} {r['second_request_ms']:10.1f}")
@@ -0,0 +1,40 @@
+"""
+Compare decode_access_token with and without the verified-token cache.
+
+Run from the project root:
+    python -m benchmarks.bench_token_cache
+"""
+import os
+import timeit
+
+import auth
+
+ROUNDS = 20000
+
+
+def run(rounds: int = ROUNDS):
+    if not auth.SECRET_KEY:
+        auth.SECRET_KEY = os.getenv("SECRET_KEY", "benchmark_secret_key")
+
+    token = auth.create_access_token({"sub": "admin", "role": "admin"})
+
+    auth.clear_token_cache()
+    uncached = timeit.timeit(lambda: auth._decode_uncached(token), number=rounds)
+
+    auth.clear_token_cache()
+    auth.decode_access_token(token)  # warm the cache
+    cached = timeit.timeit(lambda: auth.decode_access_token(token), number=rounds)
+
+    return {
+        "rounds": rounds,
+        "uncached_us": uncached / rounds * 1e6,
+        "cached_us": cached / rounds * 1e6,
+        "speedup": uncached / cached if cached else None,
+    }
+
+
+if __name__ == "__main__":
+    result = run()
+    print(f"jwt.decode (uncached): {result['uncached_us']:.2f} us/op")
+    print(f"decode_access_token (cached): {result['cached_us']:.2f} us/op")
+    print(f"speedup: {result['speedup']:.1f}x")
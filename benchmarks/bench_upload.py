@@ -0,0 +1,113 @@
+"""
+Compare upload write throughput:
+  - legacy: body spooled to a temp file (as UploadFile does), then copied with shutil.copyfileobj
+  - stream: body chunks written straight to the final location by app.uploads.stream_upload
+
+The stream path also does work the legacy one never did: it hashes the
+body for its content-addressed name and commits a claim of that name in
+the database. Those two costs are timed on their own and reported next to
+it, with the stream throughput they leave once taken out, which is the
+figure to compare with legacy.
+
+Run from the project root:
+    python -m benchmarks.bench_upload
+"""
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+from sqlalchemy import create_engine
+
+from app import crud
+from app.database import init_db
+from app.uploads import stream_upload
+
+SIZE = 8 * 1024 * 1024  # 8 MB image
+CHUNK = 64 * 1024  # roughly what the ASGI server hands over per receive()
+ROUNDS = 20
+
+
+def make_body(size: int = SIZE) -> bytes:
+    return b"\xff\xd8\xff\xe0" + os.urandom(size - 4)
+
+
+def legacy_upload(body: bytes, upload_dir: str) -> str:
+    # Multipart parser spools the body (rolls over to disk above 1 MB) ...
+    spooled = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    for i in range(0, len(body), CHUNK):
+        spooled.write(body[i:i + CHUNK])
+    spooled.seek(0)
+    # ... then save_upload_file copied it a second time
+    file_path = os.path.join(upload_dir, f"{uuid.uuid4()}.jpg")
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(spooled, buffer)
+    spooled.close()
+    return file_path
+
+
+async def streamed_upload(body: bytes, upload_dir: str, bind) -> str:
+    async def chunks():
+        for i in range(0, len(body), CHUNK):
+            yield body[i:i + CHUNK]
+
+    return await stream_upload(chunks(), upload_dir, bind, max_size=len(body))
+
+
+def hash_body(body: bytes) -> str:
+    # As ImageWriter.write does, chunk by chunk
+    digest = hashlib.sha256()
+    for i in range(0, len(body), CHUNK):
+        digest.update(body[i:i + CHUNK])
+    return digest.hexdigest()
+
+
+def run(rounds: int = ROUNDS, size: int = SIZE):
+    body = make_body(size)
+    results = {}
+    with tempfile.TemporaryDirectory() as upload_dir:
+        # Stored names are claimed in a throwaway database, not the app's
+        bind = create_engine(f"sqlite:///{os.path.join(upload_dir, '.bench.db')}")
+        init_db(bind)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            os.remove(legacy_upload(body, upload_dir))
+        results["legacy_mb_s"] = rounds * size / (time.perf_counter() - start) / 1e6
+
+        async def stream_rounds():
+            for _ in range(rounds):
+                os.remove(await streamed_upload(body, upload_dir, bind))
+
+        start = time.perf_counter()
+        asyncio.run(stream_rounds())
+        stream_seconds = time.perf_counter() - start
+        results["stream_mb_s"] = rounds * size / stream_seconds / 1e6
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            hash_body(body)
+        hash_seconds = time.perf_counter() - start
+        results["hash_mb_s"] = rounds * size / hash_seconds / 1e6
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            crud.claim_image(bind, f"{uuid.uuid4().hex}.jpg", size)
+        claim_seconds = time.perf_counter() - start
+        results["claim_ms"] = claim_seconds / rounds * 1000
+
+        write_seconds = max(stream_seconds - hash_seconds - claim_seconds, 1e-9)
+        results["stream_write_mb_s"] = rounds * size / write_seconds / 1e6
+        bind.dispose()
+    return results
+
+
+if __name__ == "__main__":
+    result = run()
+    print(f"legacy spool + copyfileobj: {result['legacy_mb_s']:.1f} MB/s")
+    print(f"chunked stream writer:      {result['stream_mb_s']:.1f} MB/s (hash + claim included)")
+    print(f"  sha256 of the body:       {result['hash_mb_s']:.1f} MB/s")
+    print(f"  name claim commit:        {result['claim_ms']:.2f} ms per upload")
+    print(f"  writes alone (estimate):  {result['stream_write_mb_s']:.1f} MB/s")
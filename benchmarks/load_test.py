@@ -0,0 +1,309 @@
+"""
+HTTP load test against a seeded catalog.
+
+Seeds a fresh database with --products rows (10k, 100k, 1m or a number),
+boots the app in-process (httpx ASGI transport, lifespan included) or under
+uvicorn, then drives a weighted mix of requests from --concurrency clients:
+list pages, search, get by id, authenticated creates/updates and image
+uploads. Prints throughput and p50/p99 per operation as JSON.
+
+With a stored baseline for the same size and mode the run fails (exit 1)
+when an operation's throughput drops, or its p99 grows, by more than
+--tolerance. Baselines depend on the machine: record one with
+--save-baseline before comparing changes; they are not committed.
+
+Run from the project root:
+    python -m benchmarks.load_test --products 10k
+    python -m benchmarks.load_test --products 1m --mode uvicorn --workers 4 --duration 30
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+# Operation -> share of requests
+MIX = {"list": 35, "search": 15, "get": 35, "write": 10, "upload": 5}
+
+SEARCH_TERMS = ["jahe", "kunyit", "madu", "kelor", "temu", "sirih", "capsule", "xyz"]
+CATEGORIES = ["Traditional Drinks", "Teas", "Capsules", "Powders", "Syrups"]
+ADMIN = "loadtest"
+
+
+def parse_size(value: str) -> int:
+    value = value.lower()
+    for suffix, factor in (("k", 1000), ("m", 1000000)):
+        if value.endswith(suffix):
+            return int(float(value[:-1]) * factor)
+    return int(value)
+
+
+def seed_catalog(bind, products: int, seed: int = 0):
+    """The generated catalog from seed.py, plus an admin user for the writes."""
+    import seed as seeder
+    from app.models import User
+    from auth import hash_password
+
+    seeder.generate(bind, products=products, seed=seed)
+    with bind.begin() as conn:
+        conn.execute(User.__table__.insert(), [
+            {"username": ADMIN, "hashed_password": hash_password(ADMIN), "is_admin": True}
+        ])
+
+
+def make_images(count: int, seed: int = 0) -> list:
+    """Small distinct PNGs, so uploads aren't all deduplicated into one file."""
+    from PIL import Image
+
+    rng = random.Random(seed)
+    images = []
+    for _ in range(count):
+        img = Image.new("RGB", (64, 64), tuple(rng.randrange(256) for _ in range(3)))
+        img.putpixel((rng.randrange(64), rng.randrange(64)), (0, 0, 0))
+        buffer = io.BytesIO()
+        img.save(buffer, format="PNG")
+        images.append(buffer.getvalue())
+    return images
+
+
+class Context:
+    def __init__(self, products: int, token: str, images: list):
+        self.products = products
+        self.auth = {"Authorization": f"Bearer {token}"}
+        self.images = images
+
+
+async def op_list(client, rng, ctx):
+    limit = rng.choice([10, 20, 50])
+    return await client.get("/products/", params={"skip": rng.randrange(max(ctx.products - limit, 1)), "limit": limit})
+
+
+async def op_search(client, rng, ctx):
+    return await client.get("/products/", params={"search": rng.choice(SEARCH_TERMS), "limit": 20})
+
+
+async def op_get(client, rng, ctx):
+    return await client.get(f"/products/{rng.randint(1, ctx.products)}")
+
+
+async def op_write(client, rng, ctx):
+    data = {"name": f"Load {rng.randrange(10 ** 6)}", "category": rng.choice(CATEGORIES), "price": rng.randint(1, 500) * 1000}
+    if rng.random() < 0.5:
+        return await client.post("/products/", data=data, headers=ctx.auth)
+    return await client.put(f"/products/{rng.randint(1, ctx.products)}", data=data, headers=ctx.auth)
+
+
+async def op_upload(client, rng, ctx):
+    return await client.put(
+        f"/products/{rng.randint(1, ctx.products)}/image",
+        content=rng.choice(ctx.images),
+        headers={**ctx.auth, "Content-Type": "image/png"},
+    )
+
+
+OPS = {"list": op_list, "search": op_search, "get": op_get, "write": op_write, "upload": op_upload}
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
+
+
+async def drive(client, ctx, duration: float, concurrency: int, seed: int = 0, mix: dict = MIX):
+    names, weights = list(mix), list(mix.values())
+    latencies = {name: [] for name in names}
+    errors = Counter()
+    deadline = time.perf_counter() + duration
+
+    async def worker(n):
+        rng = random.Random(seed * 1000 + n)
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                response = await OPS[name](client, rng, ctx)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies[name].append(time.perf_counter() - started)
+            errors[name] += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker(n) for n in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    ops = {}
+    for name, values in latencies.items():
+        values.sort()
+        ops[name] = {
+            "requests": len(values),
+            "errors": errors[name],
+            "rps": round(len(values) / elapsed, 1),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        }
+    every = sorted(v for values in latencies.values() for v in values)
+    total = {
+        "requests": len(every),
+        "errors": sum(errors.values()),
+        "rps": round(len(every) / elapsed, 1),
+        "p50_ms": round(percentile(every, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(every, 0.99) * 1000, 2),
+    }
+    return {"seconds": round(elapsed, 2), "ops": ops, "total": total}
+
+
+async def run_in_process(ctx, duration, concurrency, seed):
+    from app.config import Settings
+    from main import create_app
+
+    app = create_app(Settings(run_scheduler=False))
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+            return await drive(client, ctx, duration, concurrency, seed)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def run_uvicorn(ctx, workdir, duration, concurrency, seed, workers):
+    port = _free_port()
+    env = {**os.environ, "PYTHONPATH": ROOT, "RUN_SCHEDULER": "false"}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=workdir, env=env,
+        # Own process group, so the image pool processes of every worker go with it
+        start_new_session=True,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        limits = httpx.Limits(max_connections=concurrency)
+        async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+            for _ in range(300):
+                try:
+                    if (await client.get("/products/", params={"limit": 1})).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError("uvicorn did not start")
+            return await drive(client, ctx, duration, concurrency, seed)
+    finally:
+        os.killpg(server.pid, signal.SIGTERM)
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            pass
+        # Anything still around after a graceful shutdown
+        try:
+            os.killpg(server.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        server.wait()
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """Operations slower than the baseline by more than tolerance, as messages."""
+    regressions = []
+    for name, base in baseline["ops"].items():
+        current = result["ops"].get(name)
+        if current is None or not base["requests"]:
+            continue
+        if current["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: {current['rps']} req/s, baseline {base['rps']}")
+        if current["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {current['p99_ms']} ms, baseline {base['p99_ms']}")
+        if current["errors"] > base["errors"]:
+            regressions.append(f"{name}: {current['errors']} errors, baseline {base['errors']}")
+    return regressions
+
+
+def run(products: int, mode: str = "inprocess", duration: float = 10, concurrency: int = 32,
+        seed: int = 0, workers: int = 1, keep: bool = False):
+    workdir = tempfile.mkdtemp(prefix="apipy-load-")
+    # The app uses ./product.db and ./uploads, so everything lands in workdir
+    os.chdir(workdir)
+    os.environ.setdefault("SECRET_KEY", "load-test-secret")
+    sys.path.insert(0, ROOT)
+
+    from sqlalchemy import create_engine
+    from app.database import init_db
+    from auth import create_access_token
+
+    bind = create_engine(f"sqlite:///{os.path.join(workdir, 'product.db')}")
+    init_db(bind)
+    started = time.perf_counter()
+    seed_catalog(bind, products, seed)
+    seed_seconds = time.perf_counter() - started
+    bind.dispose()
+
+    ctx = Context(products, create_access_token({"sub": ADMIN}), make_images(32, seed))
+    try:
+        if mode == "uvicorn":
+            result = asyncio.run(run_uvicorn(ctx, workdir, duration, concurrency, seed, workers))
+        else:
+            result = asyncio.run(run_in_process(ctx, duration, concurrency, seed))
+    finally:
+        os.chdir(ROOT)
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    config = {"products": products, "mode": mode, "workers": workers, "concurrency": concurrency,
+              "duration": duration, "seed": seed, "seed_seconds": round(seed_seconds, 2)}
+    return {"config": config, **result}
+
+
+def baseline_path(products: int, mode: str) -> str:
+    return os.path.join(BASELINE_DIR, f"load_{products}_{mode}.json")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", default="10k", help="10k, 100k, 1m or a number")
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn"], default="inprocess")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown vs the baseline")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--keep", action="store_true", help="keep the seeded database and uploads")
+    args = parser.parse_args()
+
+    products = parse_size(args.products)
+    result = run(products, args.mode, args.duration, args.concurrency, args.seed, args.workers, args.keep)
+    print(json.dumps(result, indent=2))
+
+    path = baseline_path(products, args.mode)
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(result, f, indent=2)
+            f.write("\n")
+        print(f"Baseline saved to {path}", file=sys.stderr)
+    elif os.path.exists(path):
+        with open(path) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
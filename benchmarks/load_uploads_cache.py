@@ -0,0 +1,116 @@
+"""
+Repeat-view load test for image serving.
+
+Simulates clients that each view a catalog page of product images several
+times, honouring Cache-Control/ETag like a browser or CDN would, and counts
+what reaches the app:
+  - before: plain StaticFiles mount (no caching policy, every view revalidates)
+  - after:  /uploads/{name} with immutable Cache-Control and name-based ETags
+
+Run from the project root:
+    python -m benchmarks.load_uploads_cache [--clients 50] [--views 5] [--images 24]
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import tempfile
+import time
+from unittest.mock import patch
+
+import httpx
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.staticfiles import StaticFiles
+
+from app.storage import prepare_path
+
+
+class CachingClient:
+    """Tiny private HTTP cache: fresh entries are reused, stale ones revalidated."""
+
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self.entries = {}  # url -> (etag, fresh_until)
+        self.requests = 0
+        self.not_modified = 0
+        self.bytes = 0
+
+    async def get(self, url: str):
+        now = time.monotonic()
+        entry = self.entries.get(url)
+        if entry and entry[1] > now:
+            return
+        headers = {"If-None-Match": entry[0]} if entry and entry[0] else {}
+        response = await self.client.get(url, headers=headers)
+        self.requests += 1
+        self.bytes += len(response.content)
+        if response.status_code == 304:
+            self.not_modified += 1
+        match = re.search(r"max-age=(\d+)", response.headers.get("cache-control", ""))
+        max_age = int(match.group(1)) if match else 0
+        self.entries[url] = (response.headers.get("etag"), now + max_age)
+
+
+async def run_scenario(app, urls, clients: int, views: int):
+    transport = httpx.ASGITransport(app=app)
+    caches = []
+    start = time.perf_counter()
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        async def one_client():
+            cache = CachingClient(client)
+            caches.append(cache)
+            for _ in range(views):
+                await asyncio.gather(*[cache.get(url) for url in urls])
+
+        await asyncio.gather(*[one_client() for _ in range(clients)])
+    elapsed = time.perf_counter() - start
+    requests = sum(c.requests for c in caches)
+    return {
+        "page_views": clients * views,
+        "image_views": clients * views * len(urls),
+        "requests": requests,
+        "not_modified": sum(c.not_modified for c in caches),
+        "bytes": sum(c.bytes for c in caches),
+        "seconds": round(elapsed, 3),
+    }
+
+
+def run(clients: int = 50, views: int = 5, image_count: int = 24, image_size: int = 64 * 1024):
+    with tempfile.TemporaryDirectory() as upload_dir:
+        names = []
+        for i in range(image_count):
+            name = f"{i:064x}.jpg"
+            with open(prepare_path(name, upload_dir), "wb") as f:
+                f.write(b"\xff\xd8\xff\xe0" + os.urandom(image_size))
+            names.append(name)
+
+        # Old behaviour: flat StaticFiles mount, same files copied flat
+        flat_dir = os.path.join(upload_dir, "_flat")
+        os.makedirs(flat_dir)
+        for name in names:
+            with open(prepare_path(name, upload_dir), "rb") as src, open(os.path.join(flat_dir, name), "wb") as dst:
+                dst.write(src.read())
+        before_app = Starlette(routes=[Mount("/uploads", StaticFiles(directory=flat_dir))])
+
+        import main
+        urls = [f"/uploads/{name}" for name in names]
+        with patch("main.UPLOAD_DIR", upload_dir):
+            before = asyncio.run(run_scenario(before_app, urls, clients, views))
+            after = asyncio.run(run_scenario(main.app, urls, clients, views))
+
+    return {
+        "before": before,
+        "after": after,
+        "request_reduction": round(1 - after["requests"] / before["requests"], 3),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--views", type=int, default=5)
+    parser.add_argument("--images", type=int, default=24)
+    args = parser.parse_args()
+    print(json.dumps(run(args.clients, args.views, args.images), indent=2))
@@ -1,25 +1,82 @@
-from fastapi import FastAPI, Depends, UploadFile, File, Form, HTTPException
+from fastapi import APIRouter, FastAPI, Depends, UploadFile, File, Form, Header, HTTPException, Request, Response, Query
 from sqlalchemy.orm import Session
-from app import crud, schemas
-from app.database import Base, SessionLocal, engine, get_db
-import os, shutil, uuid
-from fastapi.staticfiles import StaticFiles
-import glob
-from apscheduler.schedulers.background import BackgroundScheduler
-import atexit
+from starlette.concurrency import run_in_threadpool
+from app import (
+    change_stream, changes, cleanup, crud, file_responses, images, jobs, metrics, profiling, response_cache,
+    resumable, scheduler, schemas, singleflight, storage, tasks, uploads,
+)
+from app.config import MAX_UPLOAD_SIZE, UPLOAD_DIR, VARIANT_MAX_EDGE, Settings
+from app.image_cache import VariantCache, get_variant_cache
+from app.database import SessionLocal, after_rollback, get_db, init_db
+import base64
+import os
+from pydantic import TypeAdapter
+from contextlib import asynccontextmanager
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi import Depends, HTTPException, status
 from auth import verify_password, create_access_token, decode_access_token, get_current_admin
 from app.models import User
 
-Base.metadata.create_all(bind=engine)
+router = APIRouter()
 
-app = FastAPI(title="FastAPI Product API")
 
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+def warmup():
+    """
+    Pay one-time costs before the first request: DB connection, mapper
+    configuration and statement compilation, and the image worker processes.
+    """
+    db = SessionLocal()
+    try:
+        crud.list_products(db, limit=1)
+    finally:
+        db.close()
+    images.warm_pool()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    settings = app.state.settings
+    if settings.init_db:
+        await run_in_threadpool(init_db)
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+    workers = jobs.WorkerPool(size=settings.job_workers)
+    if settings.job_workers:
+        workers.start()
+    # Every worker starts one, only the lock holder runs the jobs
+    leader = scheduler.LeaderScheduler()
+    if settings.run_scheduler:
+        leader.start()
+    # Other workers' product changes reach this one's caches through the bus
+    bus = changes.get_bus()
+    bus.start()
+    if settings.warmup:
+        await run_in_threadpool(warmup)
+    yield
+    bus.stop()
+    leader.shutdown()
+    workers.shutdown()
+    images.shutdown_pool()
+
+
+def create_app(settings: Settings = None) -> FastAPI:
+    """
+    Build the application. Importing this module has no side effects;
+    database setup, background threads and warmups run in the lifespan.
+    """
+    settings = settings or Settings()
+    app = FastAPI(title=settings.title, lifespan=lifespan)
+    app.state.settings = settings
+    if settings.metrics or settings.debug:
+        app.add_middleware(metrics.MetricsMiddleware, debug_headers=settings.debug)
+    if settings.metrics:
+        app.include_router(metrics.router)
+    if settings.profiling:
+        app.add_middleware(profiling.ProfileMiddleware, authorize=profiling_admin)
+    app.include_router(router)
+    return app
 
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -38,8 +95,26 @@ def get_current_admin(current_user = Depends(get_current_user)):
         raise HTTPException(status_code=403, detail="Admin access required")
     return current_user
 
+def profiling_admin(token: str):
+    """Admin check for profiled requests, which is made before routing."""
+    db = SessionLocal()
+    try:
+        return get_current_admin(get_current_user(token, db))
+    finally:
+        db.close()
+
+
+@router.get("/profiles/{profile_id}", include_in_schema=False)
+def get_profile(profile_id: str, current_user = Depends(get_current_admin)):
+    """A saved request profile, as collapsed stacks for flamegraph.pl or speedscope."""
+    path = profiling.profile_path(profile_id)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain")
+
+
 # Token endpoint
-@app.post("/token", response_model=schemas.Token)
+@router.post("/token", response_model=schemas.Token)
 def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     user = db.query(User).filter(User.username == form_data.username).first()
     if not user or not verify_password(form_data.password, user.hashed_password):
@@ -55,72 +130,305 @@ def get_db():
         db.close()
 
 
-def save_upload_file(upload_file: UploadFile, upload_dir: str) -> str:
+def save_upload_file(upload_file: UploadFile, upload_dir: str, bind) -> str:
     """
-    Stor uploaded to folder and return path.
-    File name created uniquely (use UUID).
+    Stor uploaded to storage and return its location.
+    File name is the content hash, type is checked from magic bytes.
     """
-    ext = os.path.splitext(upload_file.filename)[1].lower()
-    if ext not in [".jpg", ".jpeg", ".png"]:
-        raise HTTPException(status_code=400, detail="File must be JPG or PNG")
+    return uploads.copy_upload(upload_file.file, upload_dir, bind, backend=storage.get_backend(upload_dir))
+
+
+def resolve_image(db: Session, file: UploadFile, image_name: str, upload_id: str = None) -> str:
+    """
+    Image location for a product: a new upload, an image uploaded straight
+    to storage, or a finalized resumable upload.
+    """
+    if file:
+        return save_upload_file(file, UPLOAD_DIR, db.get_bind())
+    if upload_id:
+        image_name = resumable.finalized_image(db, upload_id)
+    if image_name:
+        return uploads.check_stored_image(image_name, storage.get_backend(UPLOAD_DIR), db.get_bind())
+    return None
 
-    unique_name = f"{uuid.uuid4()}{ext}"
-    file_path = os.path.join(upload_dir, unique_name)
 
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(upload_file.file, buffer)
+def discard_on_rollback(db: Session, image_path: str):
+    """If the request's transaction does not commit, hand the new upload to the cleanup."""
+    if image_path:
+        after_rollback(db, crud.discard_upload, db.get_bind(), image_path)
 
-    return file_path
+
+FORMAT_BY_EXT = {".jpg": "jpeg", ".jpeg": "jpeg", ".png": "png", ".webp": "webp", ".avif": "avif"}
+
+
+@router.api_route("/uploads/{name}", methods=["GET", "HEAD"])
+async def get_upload(
+    request: Request,
+    name: str,
+    w: int | None = Query(None, ge=1, le=VARIANT_MAX_EDGE, description="Max width"),
+    h: int | None = Query(None, ge=1, le=VARIANT_MAX_EDGE, description="Max height"),
+    fmt: str | None = Query(None, description="Output format: webp, avif, jpeg, png"),
+):
+    """
+    Serve an uploaded image. With w/h/fmt a resized variant is rendered
+    once and then served from the disk cache. Originals in object storage
+    are a redirect to a presigned URL.
+    Names never change content, so responses are cacheable for a year and
+    a matching If-None-Match is answered with 304 without touching storage.
+    """
+    if name != os.path.basename(name) or name.startswith("."):
+        raise HTTPException(status_code=404, detail="File not found")
+    backend = storage.get_backend(UPLOAD_DIR)
+
+    if w is None and h is None and fmt is None:
+        cached = file_responses.not_modified(request, name)
+        if cached:
+            return cached
+        read_url = backend.read_url(name)
+        if read_url:
+            return file_responses.presigned_redirect(read_url, name)
+        file_path = backend.local_path(name)
+        if file_path is None:
+            raise HTTPException(status_code=404, detail="File not found")
+        return file_responses.immutable_file_response(file_path, name)
+
+    fmt = (fmt or FORMAT_BY_EXT.get(os.path.splitext(name)[1].lower(), "")).lower()
+    if fmt not in images.OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail="Unsupported format")
+
+    variant_name = VariantCache.variant_name(name, w, h, fmt)
+    cached = file_responses.not_modified(request, variant_name)
+    if cached:
+        return cached
+    try:
+        variant_path = await get_variant_cache().get(name, w, h, fmt, backend)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    return file_responses.immutable_file_response(variant_path, variant_name, media_type=f"image/{fmt}")
 
 
-@app.post("/products/", response_model=schemas.ProductResponse)
+@router.post("/uploads/presign", response_model=schemas.PresignedUpload)
+def presign_upload(request: schemas.PresignRequest, current_user = Depends(get_current_admin)):
+    """
+    Let a client upload an image straight to object storage.
+    Hash the file (SHA-256) first, upload it to the returned URL, then pass
+    the returned name as image_name when creating or updating the product.
+    The URL only accepts a body of the declared size.
+    """
+    if request.size > MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=413, detail="File is too large")
+    backend = storage.get_backend(UPLOAD_DIR)
+    name = f"{request.sha256}{uploads.EXT_BY_CONTENT_TYPE[request.content_type]}"
+    if backend.exists(name):
+        return {"name": name, "exists": True}
+
+    sha256_b64 = base64.b64encode(bytes.fromhex(request.sha256)).decode()
+    upload = backend.presigned_upload(name, request.content_type, sha256_b64, request.size)
+    if upload is None:
+        raise HTTPException(status_code=400, detail="Direct uploads need the s3 storage backend")
+    return {"name": name, "exists": False, **upload}
+
+
+@router.post("/uploads/sessions", status_code=201, response_model=schemas.UploadSessionResponse)
+def create_upload_session(
+    response: Response,
+    upload_length: int = Header(..., description="Total size of the file in bytes"),
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_admin)
+):
+    """
+    Start a resumable upload. Send the data with PATCH, in as many requests
+    as needed, then finalize it and attach it to a product with upload_id.
+    """
+    session = resumable.create_session(db, upload_length)
+    response.headers["Location"] = f"/uploads/sessions/{session.id}"
+    return session
+
+
+@router.api_route(
+    "/uploads/sessions/{session_id}", methods=["GET", "HEAD"], response_model=schemas.UploadSessionResponse
+)
+def get_upload_session(
+    session_id: str,
+    response: Response,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_admin)
+):
+    """Progress of a resumable upload; Upload-Offset is where the next PATCH starts."""
+    session = resumable.get_session(db, session_id)
+    response.headers["Upload-Offset"] = str(session.offset)
+    response.headers["Upload-Length"] = str(session.length)
+    response.headers["Cache-Control"] = "no-store"
+    return session
+
+
+@router.patch("/uploads/sessions/{session_id}", status_code=204)
+async def append_upload_session(
+    session_id: str,
+    request: Request,
+    upload_offset: int = Header(...),
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_admin)
+):
+    """Append the raw request body (application/offset+octet-stream) at Upload-Offset."""
+    if request.headers.get("content-type") != "application/offset+octet-stream":
+        raise HTTPException(status_code=415, detail="Content-Type must be application/offset+octet-stream")
+    offset = await resumable.append(db, session_id, upload_offset, request.stream())
+    return Response(status_code=204, headers={"Upload-Offset": str(offset)})
+
+
+@router.post("/uploads/sessions/{session_id}/finalize", response_model=schemas.UploadSessionResponse)
+def finalize_upload_session(
+    session_id: str,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_admin)
+):
+    """Check the complete upload and move it into image storage."""
+    return resumable.finalize(db, session_id, storage.get_backend(UPLOAD_DIR))
+
+
+@router.post("/products/", response_model=schemas.ProductResponse)
 def create_product(
     name: str = Form(...),
     category: str = Form(None),
     price: float = Form(...),
     file: UploadFile = File(None),
+    image_name: str = Form(None),
+    upload_id: str = Form(None),
     db: Session = Depends(get_db),
     current_user = Depends(get_current_admin)
 ):
-    image_path = None
-    if file:
-        image_path = save_upload_file(file, UPLOAD_DIR)
+    image_path = resolve_image(db, file, image_name, upload_id)
+    discard_on_rollback(db, image_path)
 
     product = crud.create_product(db, name=name, category=category, price=price, image_path=image_path)
 
+    # Thumbnails are built by a job worker after the response is sent
+    if image_path:
+        jobs.enqueue(db, "process_image", {"product_id": product.id, "image_path": image_path})
+
     # Tambahkan URL image
     if product.image_path:
-        product.image_path = f"/uploads/{os.path.basename(product.image_path)}"
+        product.image_path = storage.url(os.path.basename(product.image_path))
 
     return product
 
 
-@app.get("/products/", response_model=list[schemas.ProductResponse])
-def list_products(skip: int = 0, limit: int = 10, search: str = None, db: Session = Depends(get_db)):
-    products = crud.list_products(db, skip=skip, limit=limit, search=search)
-    for p in products:
-        if p.image_path:
-            p.image_path = f"/uploads/{os.path.basename(p.image_path)}"
-    return products
+def product_response(product) -> schemas.ProductResponse:
+    """Response model of a product, with its image as a URL."""
+    response = schemas.ProductResponse.model_validate(product)
+    if response.image_path:
+        response.image_path = storage.url(os.path.basename(response.image_path))
+    return response
+
+
+def product_page(db: Session, skip: int, limit: int, search: str) -> list:
+    return [product_response(p) for p in crud.list_products(db, skip=skip, limit=limit, search=search)]
+
 
+product_list_adapter = TypeAdapter(list[schemas.ProductResponse])
 
-@app.get("/products/{product_id}", response_model=schemas.ProductResponse)
-def get_product(product_id: int, db: Session = Depends(get_db)):
+
+def encoded_product_page(db: Session, skip: int, limit: int, search: str) -> tuple:
+    """
+    The page as JSON, and the change version it is at least as new as. The
+    version is read first: a change committed in between is in the page and
+    replayed again by a stream from that version, which does no harm.
+    """
+    version = change_stream.latest_version(db)
+    return version, product_list_adapter.dump_json(product_page(db, skip, limit, search))
+
+
+def product_event(product) -> dict:
+    """The product as sent in change stream events."""
+    return product_response(product).model_dump(mode="json")
+
+
+def product_detail(db: Session, product_id: int) -> schemas.ProductResponse:
     product = crud.get_product(db, product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    if product.image_path:
-        product.image_path = f"/uploads/{os.path.basename(product.image_path)}"
-    return product
+    return product_response(product)
+
+
+# Identical reads in flight at the same time run once and share the result
+product_reads = singleflight.Group("product_reads")
+
+
+def in_own_session(bind, func, *args):
+    """
+    Run func(db, *args) in a session of its own. A coalesced call serves
+    every request that joined it, so it must not borrow the session of the
+    request that started it, which is closed when that request ends.
+    """
+    db = SessionLocal(bind=bind)
+    try:
+        return func(db, *args)
+    finally:
+        db.close()
+
+
+@router.get("/products/", response_model=list[schemas.ProductResponse])
+async def list_products(
+    request: Request, skip: int = 0, limit: int = 10, search: str = None, db: Session = Depends(get_db)
+):
+    """
+    Pages are cached as encoded JSON for LIST_CACHE_TTL_SECONDS, and
+    dropped as soon as any product changes in this process.
+    X-Changes-Version is the version to stream changes from (since=) to
+    catch up from this page, however long it was cached.
+    """
+    cache = response_cache.product_lists
+    key = singleflight.key("/products/", skip=skip, limit=limit, search=search or None)
+    entry = cache.get(key)
+    if entry is None:
+        # A call started before the last write must not be joined, so the generation is part of its key
+        generation = cache.generation
+        version, body = await product_reads.do_async(
+            (key, generation), in_own_session, db.get_bind(), encoded_product_page, skip, limit, search
+        )
+        entry = cache.set(key, body, generation, {"X-Changes-Version": str(version)})
+    return cache.response(entry, request)
+
+
+@router.get("/products/changes/stream")
+async def stream_product_changes(
+    since: int | None = Query(None, ge=0, description="Last version the client has"),
+    last_event_id: int | None = Header(None, ge=0),
+):
+    """
+    Server-Sent Events of product creates, updates and deletes, each with
+    its version and the product as it is now. A client loads GET /products/
+    first and streams since the smallest X-Changes-Version of the pages it
+    got. 410 means since is too old: reload and reconnect.
+    """
+    version = await run_in_threadpool(change_stream.start_version, since if since is not None else last_event_id)
+    return StreamingResponse(
+        change_stream.stream(version, describe=product_event),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/products/{product_id}", response_model=schemas.ProductResponse)
+async def get_product(product_id: int, db: Session = Depends(get_db)):
+    key = singleflight.key("/products/{product_id}", product_id=product_id)
+    # As in list_products, a read started before the last product write is not joined
+    generation = response_cache.product_lists.generation
+    return await product_reads.do_async(
+        (key, generation), in_own_session, db.get_bind(), product_detail, product_id
+    )
 
 
-@app.put("/products/{product_id}", response_model=schemas.ProductResponse)
+@router.put("/products/{product_id}", response_model=schemas.ProductResponse)
 def update_product(
     product_id: int,
     name: str = Form(...),
     category: str = Form(None),
     price: float = Form(...),
     file: UploadFile = File(None),
+    image_name: str = Form(None),
+    upload_id: str = Form(None),
     db: Session = Depends(get_db),
     current_user = Depends(get_current_admin)
 ):
@@ -128,85 +436,103 @@ def update_product(
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
 
-    image_path = None
-    if file:
-        # Delete old if exist
-        if product.image_path:
-            old_file_path = os.path.join(UPLOAD_DIR, os.path.basename(product.image_path))
-            if os.path.exists(old_file_path):
-                os.remove(old_file_path)
-
-        # Store new file
-        image_path = save_upload_file(file, UPLOAD_DIR)
+    # Store new file, the old one is deleted by the cleanup once unused
+    image_path = resolve_image(db, file, image_name, upload_id)
+    discard_on_rollback(db, image_path)
 
     product = crud.update_product(db, product_id, name, category, price, image_path)
 
+    if image_path:
+        jobs.enqueue(db, "process_image", {"product_id": product.id, "image_path": image_path})
+
     if product.image_path:
-        product.image_path = f"/uploads/{os.path.basename(product.image_path)}"
+        product.image_path = storage.url(os.path.basename(product.image_path))
 
     return product
 
 
-@app.delete("/products/{product_id}")
-def delete_product(
+@router.put("/products/{product_id}/image", response_model=schemas.ProductResponse)
+async def upload_product_image(
     product_id: int,
+    request: Request,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_admin)
 ):
-    crud.delete_product(db, product_id)
-    return {"message": "Deleted successfully"}
-
-
-@app.post("/cleanup-uploads")
-def cleanup_uploads(db: Session = Depends(get_db), current_user = Depends(get_current_admin)):
     """
-    Delete related files in uploads folder.
+    Replace product image with the raw request body (image/jpeg or image/png).
+    Body is streamed to disk in chunks, without multipart spooling.
     """
-    # Get all products image_path produk in database
-    products = db.query(crud.ProductResponse).all()
-    used_files = set()
-    for p in products:
-        if p.image_path:
-            used_files.add(os.path.basename(p.image_path))
+    uploads.check_content_length(request.headers.get("content-length"))
 
-    # Get all files in uploads folder
-    all_files = glob.glob(os.path.join(UPLOAD_DIR, "*"))
+    product = await run_in_threadpool(crud.get_product, db, product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
 
-    deleted_files = []
-    for file_path in all_files:
-        filename = os.path.basename(file_path)
-        if filename not in used_files:
-            os.remove(file_path)
-            deleted_files.append(filename)
+    backend = storage.get_backend(UPLOAD_DIR)
+    image_path = await uploads.stream_upload(request.stream(), UPLOAD_DIR, db.get_bind(), backend=backend)
+    discard_on_rollback(db, image_path)
+    product = await run_in_threadpool(
+        crud.update_product, db, product_id, product.name, product.category, product.price, image_path
+    )
 
-    return {"deleted_files": deleted_files, "message": "Cleanup finishd"}
+    await run_in_threadpool(
+        jobs.enqueue, db, "process_image", {"product_id": product.id, "image_path": image_path}
+    )
 
+    if product.image_path:
+        product.image_path = storage.url(os.path.basename(product.image_path))
 
-# Scheduler background
-scheduler = BackgroundScheduler()
+    return product
 
-def scheduled_cleanup():
-    db = next(get_db())  # Get session db
-    products = db.query(crud.Product).all()
-    used_files = set()
-    for p in products:
-        if p.image_path:
-            used_files.add(os.path.basename(p.image_path))
 
-    all_files = glob.glob(os.path.join(UPLOAD_DIR, "*"))
-    deleted_files = []
-    for file_path in all_files:
-        filename = os.path.basename(file_path)
-        if filename not in used_files:
-            os.remove(file_path)
-            deleted_files.append(filename)
+@router.delete("/products/{product_id}")
+def delete_product(
+    product_id: int,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_admin)
+):
+    crud.delete_product(db, product_id)
+    return {"message": "Deleted successfully"}
+
 
-    if deleted_files:
-        print(f"[Cleanup] Deleted files: {deleted_files}")
+@router.post("/cleanup-uploads")
+def cleanup_uploads(
+    dry_run: bool = False,
+    full: bool = False,
+    rebuild: bool = False,
+    background: bool = False,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_admin)
+):
+    """
+    Delete uploaded files that no product uses any more, from the orphan queue.
+    dry_run=true only reports what would be deleted.
+    full=true scans the whole storage instead (slow, for drift repair).
+    rebuild=true recounts image references from the products first.
+    background=true queues the cleanup as a job and answers 202 at once.
+    """
+    options = {"dry_run": dry_run, "full": full, "rebuild": rebuild}
+    if background:
+        job = jobs.enqueue(db, "cleanup", options)
+        return JSONResponse(
+            status_code=202,
+            content={"job_id": job.id, "status": job.status},
+            headers={"Location": f"/jobs/{job.id}"},
+        )
+    result = tasks.cleanup_uploads(db, **options)
+    return {**result, "metrics": dict(cleanup.metrics), "message": "Cleanup finishd"}
+
+
+@router.get("/jobs/{job_id}", response_model=schemas.JobResponse)
+def get_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    job = jobs.get_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
-# Start cleanup every 00:00
-scheduler.add_job(scheduled_cleanup, 'cron', hour=0, minute=0)
-scheduler.start()
 
-# Stop scheduler when app shutdown
-atexit.register(lambda: scheduler.shutdown())
\ No newline at end of file
+app = create_app()
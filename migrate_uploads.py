@@ -0,0 +1,28 @@
+"""
+Move uploads from the flat directory into the sharded layout (ab/cd/<name>).
+
+Safe to run while the API is serving: files are found in either layout.
+Interrupt it at any time and run it again to continue.
+
+    python migrate_uploads.py [--limit N] [--pause SECONDS]
+"""
+import argparse
+
+from app.config import UPLOAD_DIR
+from app.storage import migrate_flat_files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shard the uploads directory")
+    parser.add_argument("--upload-dir", default=UPLOAD_DIR)
+    parser.add_argument("--limit", type=int, default=None, help="Stop after moving N files")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--pause", type=float, default=0.0, help="Sleep between batches (seconds)")
+    args = parser.parse_args()
+
+    moved = migrate_flat_files(args.upload_dir, limit=args.limit, pause=args.pause, batch_size=args.batch_size)
+    print(f"[Migrate] Moved {moved} files into the sharded layout")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,91 @@
-from app.database import Base, SessionLocal, engine
-from app.models import User
+"""
+Seed the database: the admin user, and optionally a generated catalog
+for benchmarks and capacity tests.
+
+    python seed.py                                  # admin user only
+    python seed.py --products 1000000 --users 10000 --images 0.3 --seed 42
+
+Generated data is deterministic for a given --seed. Rows are loaded with
+Core executemany in large transactions, with journaling and fsync
+relaxed for the load, so a million products take seconds.
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import math
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+from itertools import accumulate
+from statistics import NormalDist
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.pool import NullPool
+
+from app import storage
+from app.config import UPLOAD_DIR
+from app.database import SessionLocal, engine, init_db
+from app.models import Product, StoredImage, User
 from auth import hash_password
 
-# Create all tables
-Base.metadata.create_all(bind=engine)
+QUALIFIERS = ["Organic", "Premium", "Original", "Instant", "Super", "Traditional", "Red", "Black", "Wild", "Pure"]
+HERBS = [
+    "Jahe", "Kunyit", "Temulawak", "Kencur", "Sirih", "Sambiloto", "Kayu Manis", "Serai", "Daun Kelor",
+    "Mengkudu", "Madu", "Habbatussauda", "Pegagan", "Brotowali", "Temu Putih", "Lidah Buaya", "Asam Jawa",
+    "Beras Kencur", "Secang", "Cengkeh",
+]
+# Form -> (category, pack sizes); earlier forms are more common
+FORMS = {
+    "Drink": ("Traditional Drinks", ["250 ml", "500 ml", "1 l"]),
+    "Tea": ("Teas", ["20 bags", "50g", "100g"]),
+    "Capsule": ("Capsules", ["30 caps", "60 caps", "100 caps"]),
+    "Powder": ("Powders", ["100g", "250g", "500g"]),
+    "Syrup": ("Syrups", ["100 ml", "250 ml"]),
+    "Extract": ("Supplements", ["30 ml", "60 ml"]),
+    "Tablet": ("Supplements", ["30 tabs", "60 tabs"]),
+    "Oil": ("Oils & Balms", ["30 ml", "60 ml"]),
+    "Balm": ("Oils & Balms", ["20g", "40g"]),
+    "Candy": ("Snacks", ["100g", "250g"]),
+}
+# Prices in rupiah: log-normal around 35k, so a few products cost far more than most
+PRICE_MEDIAN = 35000
+PRICE_SIGMA = 0.7
+PRICE_STEP = 500
+
+
+def _catalog():
+    """Every (name, category) combination with its weight, and a table of price quantiles."""
+    entries, weights = [], []
+    for rank, (form, (category, sizes)) in enumerate(FORMS.items()):
+        for qualifier in QUALIFIERS:
+            for herb in HERBS:
+                for size in sizes:
+                    entries.append((f"{qualifier} {herb} {form} {size}", category))
+                    weights.append(1 / (rank + 1) / len(sizes))
+    normal = NormalDist(0, PRICE_SIGMA)
+    prices = [
+        float(max(round(math.exp(normal.inv_cdf((i + 0.5) / 1000)) * PRICE_MEDIAN / PRICE_STEP), 1) * PRICE_STEP)
+        for i in range(1000)
+    ]
+    return entries, list(accumulate(weights)), prices
+
+
+# Tuned for a one-off bulk load, not for serving; see _load_connection
+LOAD_PRAGMAS = [
+    "PRAGMA journal_mode=MEMORY",
+    "PRAGMA synchronous=OFF",
+    "PRAGMA cache_size=-262144",  # 256 MB
+    "PRAGMA temp_store=MEMORY",
+]
+
 
 # Seeder admin
-def seed_admin():
-    db = SessionLocal()
+def seed_admin(db=None):
+    db = db or SessionLocal()
     username = "admin"
     password = "admin123"
     existing = db.query(User).filter(User.username == username).first()
@@ -26,5 +104,146 @@ def seed_admin():
     db.close()
 
 
+def product_rows(rng: random.Random, count: int, image_paths=(), image_share: float = 0.0, batch_size: int = 100000):
+    """
+    Batches of (name, category, price, image_path) tuples. Choices are made
+    a batch at a time from precomputed tables, which is what makes a million
+    rows cheap. Image popularity is skewed too: a few images are on many products.
+    """
+    entries, cum_weights, prices = _catalog()
+    images, image_weights = [None], [1.0]
+    if image_paths and image_share > 0:
+        weights = [1 / (rank + 1) for rank in range(len(image_paths))]
+        images = list(image_paths) + [None]
+        image_weights = [w / sum(weights) * image_share for w in weights] + [1 - image_share]
+    image_cum_weights = list(accumulate(image_weights))
+    for start in range(0, count, batch_size):
+        n = min(batch_size, count - start)
+        yield [
+            (name, category, price, image)
+            for (name, category), price, image in zip(
+                rng.choices(entries, cum_weights=cum_weights, k=n),
+                rng.choices(prices, k=n),
+                rng.choices(images, cum_weights=image_cum_weights, k=n),
+            )
+        ]
+
+
+def make_images(rng: random.Random, count: int, upload_dir: str = UPLOAD_DIR) -> dict:
+    """Store count small distinct PNGs; return their sizes by location."""
+    from PIL import Image
+
+    os.makedirs(upload_dir, exist_ok=True)
+    backend = storage.get_backend(upload_dir)
+    sizes = {}
+    for _ in range(count):
+        img = Image.new("RGB", (256, 256), tuple(rng.randrange(256) for _ in range(3)))
+        for _ in range(16):
+            img.putpixel((rng.randrange(256), rng.randrange(256)), tuple(rng.randrange(256) for _ in range(3)))
+        buffer = io.BytesIO()
+        img.save(buffer, format="PNG")
+        data = buffer.getvalue()
+        fd, tmp_path = tempfile.mkstemp(dir=backend.staging_dir, prefix=".seed-", suffix=".part")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        sizes[backend.store(tmp_path, f"{hashlib.sha256(data).hexdigest()}.png")] = len(data)
+    return sizes
+
+
+@contextlib.contextmanager
+def _load_connection(bind):
+    """
+    Connection with LOAD_PRAGMAS set, from an engine of its own without a
+    pool: it is closed afterwards instead of going back to bind's pool to
+    serve requests with fsync off. In-memory databases are only reachable
+    through bind, and have no journal or fsync to relax anyway.
+    """
+    in_memory = bind.url.database in (None, "", ":memory:")
+    load_engine = bind if in_memory else create_engine(bind.url, poolclass=NullPool)
+    try:
+        with load_engine.connect() as conn:
+            if not in_memory:
+                for pragma in LOAD_PRAGMAS:
+                    conn.exec_driver_sql(pragma)
+                conn.commit()
+            yield conn
+    finally:
+        if not in_memory:
+            load_engine.dispose()
+
+
+def generate(bind=engine, products: int = 0, users: int = 0, seed: int = 0, images: float = 0.0,
+             image_files: int = 200, batch_size: int = 100000, upload_dir: str = UPLOAD_DIR) -> dict:
+    """
+    Add products and users to the database. With images > 0 that share of
+    the products points at one of image_files generated images, and the
+    image reference counts are kept in step.
+    """
+    rng = random.Random(seed)
+    counts = {"products": 0, "users": 0, "images": 0}
+    image_sizes = make_images(rng, image_files, upload_dir) if images > 0 and products else {}
+    image_paths = list(image_sizes)
+    refcounts = Counter()
+
+    with _load_connection(bind) as conn:
+        # Built with Core, run as a plain executemany of tuples, which skips per-row parameter processing
+        product_insert = str(
+            insert(Product).compile(dialect=bind.dialect, column_keys=["name", "category", "price", "image_path"])
+        )
+        for rows in product_rows(rng, products, image_paths, images, batch_size):
+            with conn.begin():
+                conn.exec_driver_sql(product_insert, rows)
+            if image_paths:
+                refcounts.update(row[3] for row in rows if row[3])
+            counts["products"] += len(rows)
+
+        if image_paths:
+            with conn.begin():
+                for path in image_paths:
+                    stmt = sqlite_insert(StoredImage).values(
+                        name=os.path.basename(path), size=image_sizes[path], refcount=refcounts.get(path, 0)
+                    )
+                    conn.execute(stmt.on_conflict_do_update(
+                        index_elements=[StoredImage.name],
+                        set_={"refcount": StoredImage.refcount + stmt.excluded.refcount},
+                    ))
+            counts["images"] = len(image_paths)
+
+        if users:
+            # Hashing is deliberately slow, so every generated user shares one password
+            hashed = hash_password("password")
+            with conn.begin():
+                taken = {name for (name,) in conn.exec_driver_sql("SELECT username FROM users")}
+            for start in range(0, users, batch_size):
+                rows = [
+                    {"username": f"user{i:07d}", "hashed_password": hashed, "is_admin": False}
+                    for i in range(start, min(start + batch_size, users))
+                    if f"user{i:07d}" not in taken
+                ]
+                if rows:
+                    with conn.begin():
+                        conn.execute(insert(User), rows)
+                counts["users"] += len(rows)
+    return counts
+
+
 if __name__ == "__main__":
-    seed_admin()
+    parser = argparse.ArgumentParser(description="Create the admin user and, optionally, generated data.")
+    parser.add_argument("--products", type=int, default=0, help="products to generate")
+    parser.add_argument("--users", type=int, default=0, help="users to generate (password: password)")
+    parser.add_argument("--images", type=float, default=0.0, help="share of products with an image, 0-1")
+    parser.add_argument("--image-files", type=int, default=200, help="distinct generated images")
+    parser.add_argument("--seed", type=int, default=0, help="same seed, same data")
+    parser.add_argument("--batch-size", type=int, default=100000, help="rows per transaction")
+    parser.add_argument("--database", help="SQLite file to fill instead of the app database")
+    args = parser.parse_args()
+
+    bind = create_engine(f"sqlite:///{args.database}") if args.database else engine
+    # Create all tables
+    init_db(bind)
+    seed_admin(SessionLocal(bind=bind))
+    if args.products or args.users:
+        started = time.perf_counter()
+        counts = generate(bind, args.products, args.users, args.seed, args.images, args.image_files, args.batch_size)
+        print(f"Generated {counts['products']} products, {counts['users']} users and {counts['images']} images "
+              f"in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,54 @@
+import pytest
+from app.database import init_db
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    """Some endpoint tests reach the default database; create its tables once, like app startup does."""
+    init_db()
+
+
+@pytest.fixture(autouse=True)
+def product_list_cache():
+    """Cached product pages would leak from one test into the next."""
+    from app.response_cache import product_lists, product_searches
+
+    product_lists.clear()
+    product_searches.clear()
+    yield product_lists
+    product_lists.clear()
+    product_searches.clear()
+
+
+@pytest.fixture
+def memory_engine():
+    """An in-memory database with every table, one connection shared by all threads."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import StaticPool
+    from app.database import Base
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def db_session(tmp_path_factory):
+    """
+    A session on a database file of its own, usable from other threads. The
+    file is outside tmp_path, which tests use as an upload directory.
+    """
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from app.database import Base
+
+    path = tmp_path_factory.mktemp("db") / "test.db"
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
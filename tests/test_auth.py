@@ -8,10 +8,11 @@ from auth import (
     create_access_token,
     decode_access_token,
     get_current_user,
-    get_current_admin
+    get_current_admin,
+    clear_token_cache
 )
 from fastapi import HTTPException, status
-from jose import jwt
+from jose import jwt, JWTError
 
 
 def test_hash_password():
@@ -108,6 +109,65 @@ def test_decode_access_token_invalid():
     assert decoded is None
 
 
+def test_decode_access_token_uses_cache():
+    """Test that a verified token is served from the cache on the next decode"""
+    clear_token_cache()
+    with patch('auth.SECRET_KEY', 'test_secret_key_for_testing'):
+        token = create_access_token({"sub": "test_user"})
+
+        with patch('auth.jwt.decode', wraps=jwt.decode) as mock_decode:
+            first = decode_access_token(token)
+            second = decode_access_token(token)
+
+        assert first == second
+        assert second["sub"] == "test_user"
+        # Only the first call should verify the signature
+        assert mock_decode.call_count == 1
+
+        # Mutating the returned claims must not leak into the cache
+        second["sub"] = "someone_else"
+        assert decode_access_token(token)["sub"] == "test_user"
+
+
+def test_decode_access_token_cache_drops_expired():
+    """Test that cached tokens are not returned after their expiry"""
+    clear_token_cache()
+    with patch('auth.SECRET_KEY', 'test_secret_key_for_testing'):
+        token = create_access_token({"sub": "test_user"}, expires_delta=timedelta(minutes=5))
+        assert decode_access_token(token) is not None
+
+        # Past `exp` the cache must fall through to a full verification
+        exp = jwt.get_unverified_claims(token)["exp"]
+        with patch('auth.time.time', return_value=exp + 1), \
+                patch('auth.jwt.decode', side_effect=JWTError("expired")) as mock_decode:
+            assert decode_access_token(token) is None
+            mock_decode.assert_called_once()
+
+
+def test_decode_access_token_cache_respects_secret():
+    """Test that a cached token is re-verified when the secret changes"""
+    clear_token_cache()
+    with patch('auth.SECRET_KEY', 'test_secret_key_for_testing'):
+        token = create_access_token({"sub": "test_user"})
+        assert decode_access_token(token) is not None
+
+    with patch('auth.SECRET_KEY', 'another_secret_key'):
+        assert decode_access_token(token) is None
+
+
+def test_decode_access_token_cache_is_bounded():
+    """Test that the cache evicts the least recently used token"""
+    clear_token_cache()
+    with patch('auth.SECRET_KEY', 'test_secret_key_for_testing'), \
+            patch('auth.TOKEN_CACHE_SIZE', 2):
+        tokens = [create_access_token({"sub": f"user_{i}"}) for i in range(3)]
+        for token in tokens:
+            decode_access_token(token)
+
+        import auth
+        assert list(auth._token_cache) == tokens[1:]
+
+
 @patch('auth.decode_access_token')
 def test_get_current_user_valid_token(mock_decode):
     """Test getting current user with valid token"""
@@ -0,0 +1,23 @@
+from app.blurhash import base83, encode
+
+# A 32x32 gradient, expected values from the reference implementation
+GRADIENT = [(x * 8, y * 8, (x + y) * 4) for y in range(32) for x in range(32)]
+
+
+def test_base83():
+    """Test base 83 encoding with a fixed length"""
+    assert base83(0, 2) == "00"
+    assert base83(82, 1) == "~"
+    assert base83(83, 2) == "10"
+
+
+def test_encode_matches_reference():
+    """Test hashes against the reference encoder"""
+    assert encode(GRADIENT, 32, 32) == "LxH2cg2kwzX5l?WGjue:gLfkfQfj"
+    assert encode(GRADIENT, 32, 32, 3, 3) == "KxH2cg2kwzl?WGjugLfkfQ"
+
+
+def test_encode_length():
+    """Test that the hash length follows the component count"""
+    assert len(encode([(10, 20, 30)] * 16, 4, 4, 1, 1)) == 6
+    assert len(encode([(10, 20, 30)] * 16, 4, 4, 4, 3)) == 4 + 2 * 12
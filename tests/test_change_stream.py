@@ -0,0 +1,135 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from unittest.mock import patch
+
+from app import changes
+from app.change_stream import read_batch, start_version, stream
+from app.database import init_db
+from app.models import Product, ProductChange
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'changes.db'}", connect_args={"check_same_thread": False})
+    init_db(engine)
+    with patch("app.changes._bus", changes.LocalBus()):
+        yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+def describe(product):
+    return {"id": product.id, "name": product.name, "price": product.price}
+
+
+def parse(chunk: str) -> dict:
+    fields = dict(line.split(": ", 1) for line in chunk.strip().splitlines())
+    return {"id": int(fields["id"]), "event": fields["event"], "data": json.loads(fields["data"])}
+
+
+async def next_event(events) -> dict:
+    chunk = await anext(events)
+    while chunk.startswith(":"):
+        chunk = await anext(events)
+    return parse(chunk)
+
+
+def add_products(session_factory, *names):
+    db = session_factory()
+    products = [Product(name=name, category="Tea", price=1.0) for name in names]
+    db.add_all(products)
+    db.commit()
+    ids = [p.id for p in products]
+    db.close()
+    return ids
+
+
+def test_start_version(session_factory):
+    """Test that streams start at since, or the newest version, and 410 when changes are gone"""
+    assert start_version(None, session_factory) == 0
+    add_products(session_factory, "Jahe", "Kunyit", "Sirih")
+    assert start_version(None, session_factory) == 3
+    assert start_version(0, session_factory) == 0
+
+    db = session_factory()
+    db.query(ProductChange).filter(ProductChange.id <= 2).delete()
+    db.commit()
+    db.close()
+    assert start_version(2, session_factory) == 2
+    for since in (1, 4):
+        with pytest.raises(HTTPException) as exc:
+            start_version(since, session_factory)
+        assert exc.value.status_code == 410
+
+
+def test_stream_replays_then_follows_commits(session_factory):
+    """Test that changes after since are replayed, then new commits are pushed"""
+    jahe, kunyit = add_products(session_factory, "Jahe", "Kunyit")
+
+    def update_and_delete():
+        db = session_factory()
+        db.get(Product, jahe).price = 2.0
+        db.delete(db.get(Product, kunyit))
+        db.commit()
+        db.close()
+
+    async def read():
+        events = stream(1, describe, session_factory, heartbeat=0.01)
+        received = [parse(await anext(events)), parse(await anext(events))]
+        assert await anext(events) == ": keepalive\n\n"
+        threading.Thread(target=update_and_delete).start()
+        received += [await next_event(events), await next_event(events)]
+        await events.aclose()
+        return received
+
+    received = asyncio.run(read())
+
+    assert [(e["event"], e["id"]) for e in received] == [("ready", 1), ("create", 2), ("update", 3), ("delete", 4)]
+    assert received[1]["data"] == {
+        "version": 2, "product_id": kunyit, "op": "create", "product": {"id": kunyit, "name": "Kunyit", "price": 1.0},
+    }
+    assert received[2]["data"]["product"] == {"id": jahe, "name": "Jahe", "price": 2.0}
+    assert received[3]["data"]["product"] is None
+    assert changes.get_bus().subscribers == []
+
+
+def test_streams_share_batch_reads(session_factory):
+    """Test that streams at the same version read the changes after it once between them"""
+    add_products(session_factory, "Jahe", "Kunyit")
+    reads = []
+
+    def slow_read_batch(version, describe, session_factory):
+        reads.append(version)
+        time.sleep(0.05)
+        return read_batch(version, describe, session_factory)
+
+    async def read():
+        streams = [stream(0, describe, session_factory, heartbeat=5) for _ in range(5)]
+        for events in streams:
+            await anext(events)
+        received = await asyncio.gather(*[next_event(events) for events in streams])
+        for events in streams:
+            await events.aclose()
+        return received
+
+    with patch("app.change_stream.read_batch", side_effect=slow_read_batch):
+        received = asyncio.run(read())
+
+    assert reads == [0]
+    assert [e["id"] for e in received] == [1] * 5
+
+
+def test_stream_endpoint_rejects_pruned_since():
+    """Test that the endpoint answers 410 when the changes since the version are gone"""
+    from fastapi.testclient import TestClient
+    from main import app
+
+    with patch("main.change_stream.start_version", side_effect=HTTPException(status_code=410, detail="gone")):
+        response = TestClient(app).get("/products/changes/stream", params={"since": 5})
+    assert response.status_code == 410
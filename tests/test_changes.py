@@ -0,0 +1,107 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, insert
+from unittest.mock import patch
+
+from app import changes
+from app.changes import ChangeEvent, LocalBus, SQLiteBus
+from app.database import init_db
+from app.models import Product, ProductChange
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.fixture
+def bus():
+    bus = LocalBus()
+    with patch("app.changes._bus", bus):
+        yield bus
+
+
+def test_committed_writes_are_recorded_and_published(bus, db_session):
+    """Test that creates, updates and deletes are logged and delivered once committed"""
+    received = []
+    bus.subscribe(received.extend)
+
+    product = Product(name="Jahe", category="Tea", price=1.0)
+    db_session.add(product)
+    db_session.commit()
+    product.price = 2.0
+    db_session.commit()
+    db_session.delete(product)
+    db_session.commit()
+
+    assert [(e.product_id, e.op) for e in received] == [(1, "create"), (1, "update"), (1, "delete")]
+    assert [e.version for e in received] == [1, 2, 3]
+    assert db_session.query(ProductChange).count() == 3
+
+
+def test_rolled_back_writes_are_not_published(bus, db_session):
+    """Test that a rolled back transaction leaves no change and publishes nothing"""
+    received = []
+    bus.subscribe(received.extend)
+
+    db_session.add(Product(name="Jahe", category="Tea", price=1.0))
+    db_session.flush()
+    db_session.rollback()
+    product = Product(name="Kunyit", category="Tea", price=1.0)
+    db_session.add(product)
+    db_session.commit()
+
+    assert [(e.product_id, e.op) for e in received] == [(product.id, "create")]
+    assert db_session.query(ProductChange).count() == 1
+
+
+def test_failing_subscriber_does_not_stop_delivery(bus):
+    """Test that one subscriber raising does not keep events from the others"""
+    received = []
+    bus.subscribe(lambda events: 1 / 0)
+    bus.subscribe(received.extend)
+
+    bus.publish([ChangeEvent(1, 7, "update")])
+    assert received == [ChangeEvent(1, 7, "update")]
+
+
+def test_sqlite_bus_delivers_other_processes_changes(tmp_path):
+    """Test that changes committed by another process arrive through polling, and our own are skipped"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'bus.db'}", connect_args={"check_same_thread": False})
+    init_db(engine)
+    bus = SQLiteBus(engine, interval=0.005)
+    received = []
+    bus.subscribe(received.extend)
+    bus.poll()
+
+    bus.start()
+    try:
+        with engine.begin() as conn:
+            conn.execute(insert(ProductChange), [
+                {"product_id": 7, "op": "update", "origin": "other-worker"},
+                {"product_id": 8, "op": "create", "origin": changes.origin()},
+                {"product_id": 9, "op": "delete", "origin": "other-worker"},
+            ])
+        assert wait_for(lambda: len(received) == 2)
+    finally:
+        bus.stop()
+
+    assert received == [ChangeEvent(1, 7, "update"), ChangeEvent(3, 9, "delete")]
+    assert bus.version == 3
+
+
+def test_prune_deletes_old_changes(db_session):
+    """Test that changes older than the retention are deleted and newer ones kept"""
+    now = datetime.utcnow()
+    db_session.add_all([
+        ProductChange(product_id=1, op="create", origin="a", changed_at=now - timedelta(days=8)),
+        ProductChange(product_id=1, op="update", origin="a", changed_at=now - timedelta(days=1)),
+    ])
+    db_session.commit()
+
+    assert changes.prune(db_session, retention_seconds=7 * 24 * 3600) == 1
+    assert [c.op for c in db_session.query(ProductChange)] == ["update"]
@@ -0,0 +1,331 @@
+import io
+import os
+import threading
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app import crud
+from app.database import Base
+from app.models import PendingOrphan, Product, StoredImage
+from app.cleanup import reconcile, rebuild_image_refs, run_cleanup
+from app.storage import LocalStorage, prepare_path
+
+
+@pytest.fixture
+def derivative_config():
+    with patch('app.images.IMAGE_DERIVATIVE_SIZES', "thumb:100"), \
+            patch('app.images.IMAGE_DERIVATIVE_FORMATS', "webp"):
+        yield
+
+
+def store(upload_dir, name, data=b"x", age=0):
+    path = prepare_path(name, str(upload_dir))
+    with open(path, "wb") as f:
+        f.write(data)
+    if age:
+        old = datetime.now().timestamp() - age
+        os.utime(path, (old, old))
+    return path
+
+
+def queue(db, name, refcount=0, age=7200, size=1):
+    db.add_all([
+        StoredImage(name=name, refcount=refcount, size=size),
+        PendingOrphan(name=name, queued_at=datetime.utcnow() - timedelta(seconds=age)),
+    ])
+    db.commit()
+
+
+def test_run_cleanup_deletes_queued_orphans(db_session, tmp_path, derivative_config):
+    """Test that queued images with no references are deleted, with their derivatives"""
+    for name in ["used.jpg", "unused.jpg", "unused_thumb.webp"]:
+        store(tmp_path, name)
+    db_session.add(StoredImage(name="used.jpg", refcount=1))
+    queue(db_session, "unused.jpg", size=10)
+
+    result = run_cleanup(db_session, LocalStorage(str(tmp_path)), grace_seconds=3600)
+
+    assert sorted(result["deleted_files"]) == ["unused.jpg", "unused_thumb.webp"]
+    assert result["bytes_freed"] == 10
+    assert os.path.exists(prepare_path("used.jpg", str(tmp_path)))
+    assert not os.path.exists(prepare_path("unused.jpg", str(tmp_path)))
+    assert db_session.get(StoredImage, "unused.jpg") is None
+    assert db_session.query(PendingOrphan).count() == 0
+
+
+def test_run_cleanup_drops_cached_variants(db_session, tmp_path, derivative_config):
+    """Test that cached variants of a deleted image are removed with it"""
+    variants = tmp_path / "variants"
+    variants.mkdir()
+    for name in ["unused_w200_h0.webp", "unused_w0_h100.jpeg", "used_w200_h0.webp"]:
+        (variants / name).write_bytes(b"x")
+    store(tmp_path, "unused.jpg")
+    db_session.add(StoredImage(name="used.jpg", refcount=1))
+    queue(db_session, "unused.jpg")
+
+    with patch('app.image_cache.VARIANT_CACHE_DIR', str(variants)):
+        run_cleanup(db_session, LocalStorage(str(tmp_path)), grace_seconds=3600)
+
+    assert os.listdir(variants) == ["used_w200_h0.webp"]
+
+
+def test_run_cleanup_respects_grace_period(db_session, tmp_path, derivative_config):
+    """Test that recently released images are kept"""
+    store(tmp_path, "recent.jpg")
+    queue(db_session, "recent.jpg", age=10)
+
+    result = run_cleanup(db_session, LocalStorage(str(tmp_path)), grace_seconds=3600)
+
+    assert result["deleted_files"] == []
+    assert db_session.get(PendingOrphan, "recent.jpg") is not None
+
+
+def test_run_cleanup_skips_reacquired_image(db_session, tmp_path, derivative_config):
+    """Test that an image referenced again after being queued survives and leaves the queue"""
+    store(tmp_path, "back.jpg")
+    queue(db_session, "back.jpg", refcount=1)
+
+    result = run_cleanup(db_session, LocalStorage(str(tmp_path)), grace_seconds=0)
+
+    assert result["deleted_files"] == []
+    assert db_session.get(StoredImage, "back.jpg") is not None
+    assert db_session.get(PendingOrphan, "back.jpg") is None
+
+
+def test_run_cleanup_in_batches(db_session, tmp_path, derivative_config):
+    """Test that the queue is drained batch by batch, up to max_batches"""
+    for i in range(5):
+        store(tmp_path, f"o{i}.jpg")
+        queue(db_session, f"o{i}.jpg")
+
+    result = run_cleanup(db_session, LocalStorage(str(tmp_path)), batch_size=2, max_batches=2)
+
+    assert result["batches"] == 2
+    assert result["images"] == 4
+    assert db_session.query(PendingOrphan).count() == 1
+
+
+def test_run_cleanup_dry_run(db_session, tmp_path, derivative_config):
+    """Test that a dry run reports every queued orphan and changes nothing"""
+    for i in range(3):
+        store(tmp_path, f"o{i}.jpg")
+        queue(db_session, f"o{i}.jpg")
+
+    result = run_cleanup(db_session, LocalStorage(str(tmp_path)), batch_size=2, dry_run=True)
+
+    assert result["images"] == 3
+    assert "o0_thumb.webp" in result["deleted_files"]
+    assert db_session.query(PendingOrphan).count() == 3
+    assert all(os.path.exists(prepare_path(f"o{i}.jpg", str(tmp_path))) for i in range(3))
+
+
+def test_release_and_acquire_update_queue(db_session):
+    """Test that releasing the last reference queues the image and acquiring unqueues it"""
+    crud.acquire_image(db_session, "uploads/a.jpg")
+    crud.acquire_image(db_session, "uploads/a.jpg")
+    crud.release_image(db_session, "uploads/a.jpg")
+    db_session.commit()
+    assert db_session.get(PendingOrphan, "a.jpg") is None
+
+    crud.release_image(db_session, "uploads/a.jpg")
+    db_session.commit()
+    assert db_session.get(PendingOrphan, "a.jpg") is not None
+
+    crud.acquire_image(db_session, "uploads/a.jpg")
+    db_session.commit()
+    assert db_session.get(PendingOrphan, "a.jpg") is None
+
+
+def test_rebuild_image_refs(db_session):
+    """Test recounting references from the product table"""
+    db_session.add_all([
+        Product(name="A", category="C", price=1.0, image_path="uploads/abc.jpg"),
+        Product(name="B", category="C", price=1.0, image_path="uploads/abc.jpg"),
+        Product(name="C", category="C", price=1.0),
+        StoredImage(name="stale.jpg", refcount=5),
+    ])
+    db_session.commit()
+
+    rebuild_image_refs(db_session)
+
+    db_session.expire_all()
+    assert db_session.get(StoredImage, "abc.jpg").refcount == 2
+    assert db_session.get(StoredImage, "stale.jpg").refcount == 0
+    assert db_session.get(PendingOrphan, "stale.jpg") is not None
+    assert db_session.get(PendingOrphan, "abc.jpg") is None
+
+
+def test_reconcile_deletes_untracked_files(db_session, tmp_path):
+    """Test that the full scan removes old files no product uses and keeps the rest"""
+    db_session.add(Product(name="A", category="C", price=1.0, image_path="uploads/live.jpg"))
+    db_session.commit()
+    store(tmp_path, "live.jpg", age=7200)
+    store(tmp_path, "live_thumb.webp", age=7200)
+    store(tmp_path, "lost.png", b"xyz", age=7200)
+    store(tmp_path, "gone_thumb.webp", age=7200)
+    store(tmp_path, "new.jpg")
+    (tmp_path / ".upload-123.part").write_bytes(b"x")
+
+    result = reconcile(db_session, LocalStorage(str(tmp_path)), batch_size=2, grace_seconds=3600)
+
+    assert sorted(result["deleted_files"]) == ["gone_thumb.webp", "lost.png"]
+    assert result["scanned"] == 5
+    assert result["bytes_freed"] == 4
+    assert os.path.exists(prepare_path("live_thumb.webp", str(tmp_path)))
+    assert os.path.exists(prepare_path("new.jpg", str(tmp_path)))
+    assert (tmp_path / ".upload-123.part").exists()
+
+
+def test_reconcile_counts_only_deleted_files(db_session, tmp_path):
+    """Test that files that fail to delete are reported as errors, not freed bytes"""
+    store(tmp_path, "lost.png", b"xyz", age=7200)
+    store(tmp_path, "stuck.png", b"xyzxyz", age=7200)
+    backend = LocalStorage(str(tmp_path))
+    real_delete = backend.delete
+
+    def delete(name):
+        if name == "stuck.png":
+            raise PermissionError(name)
+        return real_delete(name)
+
+    with patch.object(backend, "delete", side_effect=delete):
+        result = reconcile(db_session, backend, grace_seconds=3600)
+
+    assert result["deleted_files"] == ["lost.png"]
+    assert result["bytes_freed"] == 3
+    assert result["errors"] == 1
+
+
+def test_reconcile_dry_run(db_session, tmp_path):
+    """Test that a dry-run scan reports orphans without touching files or refcounts"""
+    db_session.add(Product(name="A", category="C", price=1.0, image_path="uploads/live.jpg"))
+    db_session.commit()
+    store(tmp_path, "live.jpg", age=7200)
+    store(tmp_path, "lost.png", age=7200)
+
+    result = reconcile(db_session, LocalStorage(str(tmp_path)), grace_seconds=3600, dry_run=True)
+
+    assert result["deleted_files"] == ["lost.png"]
+    assert os.path.exists(prepare_path("lost.png", str(tmp_path)))
+    assert db_session.query(StoredImage).count() == 0
+
+
+PNG_BYTES = b"\x89PNG\r\n\x1a\n" + b"\x01" * 100
+
+
+@pytest.fixture
+def file_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'cleanup.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+def queued_upload(engine, upload_dir):
+    """Store PNG_BYTES as an image no product uses, queued and written long ago."""
+    import hashlib
+
+    name = hashlib.sha256(PNG_BYTES).hexdigest() + ".png"
+    store(upload_dir, name, PNG_BYTES, age=7200)
+    db = sessionmaker(bind=engine)()
+    queue(db, name)
+    db.close()
+    return name
+
+
+class BlockingStorage(LocalStorage):
+    """Local storage whose first delete waits until the test lets it go on."""
+
+    def __init__(self, upload_dir):
+        super().__init__(upload_dir)
+        self.deleting = threading.Event()
+        self.proceed = threading.Event()
+
+    def delete(self, name):
+        self.deleting.set()
+        self.proceed.wait(5)
+        return super().delete(name)
+
+
+def test_upload_claiming_image_before_cleanup_keeps_it(file_engine, tmp_path):
+    """Test that an upload reusing a queued image restarts its grace period, so the cleanup keeps it"""
+    from app.uploads import copy_upload
+
+    upload_dir = tmp_path / "uploads"
+    upload_dir.mkdir()
+    name = queued_upload(file_engine, upload_dir)
+
+    path = copy_upload(io.BytesIO(PNG_BYTES), str(upload_dir), file_engine)
+    db = sessionmaker(bind=file_engine)()
+    result = run_cleanup(db, LocalStorage(str(upload_dir)), grace_seconds=3600)
+    reconciled = reconcile(db, LocalStorage(str(upload_dir)), grace_seconds=3600)
+    crud.create_product(db, "Jahe", "Tea", 1.0, image_path=path)
+
+    assert result["deleted_files"] == [] and reconciled["deleted_files"] == []
+    assert os.path.exists(path)
+    assert db.get(StoredImage, name).refcount == 1
+    db.close()
+
+
+def test_upload_during_cleanup_stores_image_again(file_engine, tmp_path):
+    """Test that an upload claiming an image the cleanup is deleting waits, then stores it again"""
+    from app.uploads import copy_upload
+
+    upload_dir = tmp_path / "uploads"
+    upload_dir.mkdir()
+    name = queued_upload(file_engine, upload_dir)
+    backend = BlockingStorage(str(upload_dir))
+    cleanup = threading.Thread(
+        target=lambda: run_cleanup(sessionmaker(bind=file_engine)(), backend, grace_seconds=3600)
+    )
+    cleanup.start()
+    assert backend.deleting.wait(5)
+
+    stored = []
+    upload = threading.Thread(
+        target=lambda: stored.append(copy_upload(io.BytesIO(PNG_BYTES), str(upload_dir), file_engine))
+    )
+    upload.start()
+    upload.join(0.2)
+    # The claim waits for the cleanup's transaction
+    assert stored == []
+    backend.proceed.set()
+    cleanup.join(5)
+    upload.join(5)
+
+    db = sessionmaker(bind=file_engine)()
+    crud.create_product(db, "Jahe", "Tea", 1.0, image_path=stored[0])
+    assert os.path.exists(stored[0])
+    assert db.get(StoredImage, name).refcount == 1
+    assert db.get(PendingOrphan, name) is None
+    db.close()
+
+
+def test_cleanup_deletes_files_without_holding_write_lock(file_engine, tmp_path):
+    """Test that product writes go through while the cleanup waits on slow storage"""
+    upload_dir = tmp_path / "uploads"
+    upload_dir.mkdir()
+    name = queued_upload(file_engine, upload_dir)
+    backend = BlockingStorage(str(upload_dir))
+    cleanup = threading.Thread(
+        target=lambda: run_cleanup(sessionmaker(bind=file_engine)(), backend, grace_seconds=3600)
+    )
+    cleanup.start()
+    try:
+        assert backend.deleting.wait(5)
+        # A writer that gives up at once instead of waiting out the busy timeout
+        impatient = create_engine(file_engine.url, connect_args={"timeout": 0.1})
+        db = sessionmaker(bind=impatient)()
+        crud.create_product(db, "Jahe", "Tea", 1.0)
+        db.close()
+        impatient.dispose()
+    finally:
+        backend.proceed.set()
+        cleanup.join(5)
+
+    db = sessionmaker(bind=file_engine)()
+    assert db.get(StoredImage, name) is None
+    assert db.get(PendingOrphan, name) is None
+    db.close()
@@ -198,4 +198,26 @@ def test_delete_product_not_found():
         
         # Verify that delete was not called
         mock_db.delete.assert_not_called()
-        mock_db.commit.assert_not_called()
\ No newline at end of file
+        mock_db.commit.assert_not_called()
+
+def test_image_refcounts_follow_products(db_session):
+    """Test that products sharing one stored image are reference counted"""
+    from app.models import StoredImage
+
+    first = create_product(db_session, "Jamu A", "Drinks", 1.0, "uploads/abc.jpg")
+    second = create_product(db_session, "Jamu B", "Drinks", 2.0, "uploads/abc.jpg")
+    assert db_session.get(StoredImage, "abc.jpg").refcount == 2
+
+    update_product(db_session, first.id, "Jamu A", "Drinks", 1.0, "uploads/def.jpg")
+    db_session.expire_all()
+    assert db_session.get(StoredImage, "abc.jpg").refcount == 1
+    assert db_session.get(StoredImage, "def.jpg").refcount == 1
+
+    # Uploading the same image again does not count twice
+    update_product(db_session, first.id, "Jamu A", "Drinks", 1.0, "uploads/def.jpg")
+    db_session.expire_all()
+    assert db_session.get(StoredImage, "def.jpg").refcount == 1
+
+    delete_product(db_session, second.id)
+    db_session.expire_all()
+    assert db_session.get(StoredImage, "abc.jpg").refcount == 0
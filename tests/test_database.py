@@ -42,4 +42,129 @@ def test_get_db_generator():
             pass
         
         # Verify close was called
-        mock_session_instance.close.assert_called_once()
\ No newline at end of file
+        mock_session_instance.close.assert_called_once()
+
+def test_init_db_adds_missing_columns():
+    """Test that init_db adds columns missing from an existing table"""
+    from sqlalchemy import inspect
+    from sqlalchemy.pool import StaticPool
+    from app.database import init_db
+
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE product (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, "
+            "category VARCHAR NOT NULL, price FLOAT NOT NULL, image_path VARCHAR(255))"
+        )
+
+    init_db(engine)
+
+    columns = {column["name"] for column in inspect(engine).get_columns("product")}
+    assert "derivatives" in columns
+    assert inspect(engine).has_table("users")
+
+
+def test_transaction_callbacks(db_session):
+    """Test that commit callbacks run only on commit and rollback callbacks otherwise"""
+    from unittest.mock import MagicMock
+    from app.database import after_commit, after_rollback
+
+    on_commit, on_rollback = MagicMock(), MagicMock()
+    after_commit(db_session, on_commit, "a")
+    after_rollback(db_session, on_rollback, "a")
+    db_session.add(Product(name="A", category="C", price=1.0))
+    db_session.commit()
+    on_commit.assert_called_once_with("a")
+    on_rollback.assert_not_called()
+
+    after_commit(db_session, on_commit, "b")
+    after_rollback(db_session, on_rollback, "b")
+    db_session.add(Product(name=None, category="C", price=1.0))
+    with pytest.raises(Exception):
+        db_session.commit()
+    db_session.rollback()
+    on_rollback.assert_called_once_with("b")
+    assert on_commit.call_count == 1
+
+
+def test_rollback_callback_runs_on_close_without_commit(db_session):
+    """Test that closing a session that never committed counts as a rollback"""
+    from unittest.mock import MagicMock
+    from app.database import after_rollback
+
+    on_rollback = MagicMock(side_effect=OSError("ignored"))
+    after_rollback(db_session, on_rollback)
+    db_session.close()
+
+    on_rollback.assert_called_once_with()
+
+
+@pytest.fixture
+def instrumented_session():
+    from app.database import instrument
+
+    engine = create_engine("sqlite:///:memory:")
+    instrument(engine)
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def test_track_queries_counts_statements(instrumented_session):
+    """Test that statements run inside track_queries are counted and timed"""
+    from app.database import track_queries
+
+    instrumented_session.query(Product).all()
+    with track_queries() as stats:
+        instrumented_session.add(Product(name="Herb", category="Tea", price=1.0))
+        instrumented_session.commit()
+        instrumented_session.query(Product).filter(Product.name == "Herb").all()
+    instrumented_session.query(Product).all()
+
+    # The insert, its product_changes row and the select
+    assert stats.count == 3
+    assert stats.seconds > 0
+    assert stats.slow == 0
+
+
+def test_failed_statement_does_not_leak_timer_state(instrumented_session):
+    """Test that a statement that raises leaves nothing behind on the connection"""
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+
+    connection = instrumented_session.connection()
+    with pytest.raises(OperationalError):
+        connection.execute(text("SELECT * FROM missing_table"))
+    instrumented_session.rollback()
+    connection = instrumented_session.connection()
+    connection.execute(text("SELECT 1"))
+
+    assert "query_started" not in connection.info
+
+
+def test_normalize_sql():
+    """Test that queries differing only in literals and list lengths normalize the same"""
+    from app.database import normalize_sql
+
+    assert normalize_sql("SELECT *\n  FROM products WHERE id IN (?, ?, ?) AND name = 'x''y' LIMIT 10") == \
+        "SELECT * FROM products WHERE id IN (?...) AND name = ? LIMIT ?"
+    assert normalize_sql("SELECT * FROM products WHERE id IN (?,?)") == \
+        "SELECT * FROM products WHERE id IN (?...)"
+
+
+def test_slow_query_logged_with_plan(instrumented_session, caplog):
+    """Test that slow statements are logged with normalized SQL and their query plan"""
+    from app.database import track_queries
+
+    with patch('app.database.SLOW_QUERY_SECONDS', 0), track_queries() as stats, \
+            caplog.at_level("WARNING", logger="app.database"):
+        instrumented_session.query(Product).filter(Product.name == "Herb").all()
+
+    assert stats.slow == 1
+    message = caplog.records[0].getMessage()
+    assert "Slow query" in message
+    assert "FROM product WHERE product.name = ?" in message
+    assert "plan: SCAN product" in message
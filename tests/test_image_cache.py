@@ -0,0 +1,120 @@
+import asyncio
+import os
+import time
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+from PIL import Image
+from app.image_cache import DiskLRUCache, VariantCache, discard_variants
+from app.storage import LocalStorage
+
+
+@pytest.fixture
+def image_file(tmp_path):
+    """Create a real 800x600 PNG image"""
+    path = tmp_path / "photo.png"
+    Image.new("RGB", (800, 600), (10, 150, 60)).save(path, "PNG")
+    return str(path)
+
+
+def write_entry(cache, name, size):
+    with open(cache.path(name), "wb") as f:
+        f.write(b"x" * size)
+    cache.add(name, size)
+
+
+def test_disk_lru_cache_evicts_least_recently_used(tmp_path):
+    """Test that the total size stays under the cap, oldest entries go first"""
+    cache = DiskLRUCache(str(tmp_path / "cache"), max_bytes=25)
+    write_entry(cache, "a", 10)
+    write_entry(cache, "b", 10)
+    assert cache.get("a") is not None  # "a" is now the most recent
+
+    write_entry(cache, "c", 10)
+
+    assert cache.get("b") is None
+    assert not os.path.exists(cache.path("b"))
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.total_bytes == 20
+
+
+def test_disk_lru_cache_loads_existing_files(tmp_path):
+    """Test that files written by a previous process are picked up"""
+    directory = tmp_path / "cache"
+    first = DiskLRUCache(str(directory), max_bytes=100)
+    write_entry(first, "a", 10)
+
+    second = DiskLRUCache(str(directory), max_bytes=100)
+    assert second.total_bytes == 10
+    assert second.get("a") == first.path("a")
+
+
+def test_disk_lru_cache_shared_between_workers(tmp_path):
+    """Test that workers sharing a directory see each other's files and keep the limit on it"""
+    directory = str(tmp_path / "cache")
+    first = DiskLRUCache(directory, max_bytes=25)
+    second = DiskLRUCache(directory, max_bytes=25)
+    write_entry(first, "a", 10)
+
+    assert second.get("a") == first.path("a")
+
+    time.sleep(0.05)  # file times are coarse
+    write_entry(first, "b", 10)
+    time.sleep(0.05)
+    write_entry(second, "c", 10)
+
+    assert sorted(os.listdir(directory)) == ["b", "c"]
+    assert second.total_bytes == 20
+    assert first.get("a") is None
+
+
+def test_discard_variants(tmp_path):
+    """Test that only the variants of the given images are removed"""
+    for name in ["abc_w200_h0.webp", "abc_w0_h50.jpeg", "abcd_w200_h0.webp", "abc_w10_h0.webp.part"]:
+        (tmp_path / name).write_bytes(b"x")
+
+    assert discard_variants(["abc.jpg"], str(tmp_path)) == 2
+    assert sorted(os.listdir(tmp_path)) == ["abc_w10_h0.webp.part", "abcd_w200_h0.webp"]
+    assert discard_variants(["abc.jpg"], str(tmp_path / "missing")) == 0
+
+
+def test_variant_cache_renders_and_reuses(image_file, tmp_path):
+    """Test that a variant is rendered once and then served from disk"""
+    cache = VariantCache(str(tmp_path / "variants"), max_bytes=10 * 1024 * 1024)
+
+    with patch('app.image_cache.images.get_pool', return_value=ThreadPoolExecutor(2)):
+        backend = LocalStorage(os.path.dirname(image_file))
+        first = asyncio.run(cache.get("photo.png", 200, None, "webp", backend))
+        second = asyncio.run(cache.get("photo.png", 200, None, "webp", backend))
+
+    assert first == second
+    assert cache.renders == 1
+    with Image.open(first) as variant:
+        assert variant.size == (200, 150)
+        assert variant.format == "WEBP"
+
+
+def test_variant_cache_coalesces_concurrent_requests(image_file, tmp_path):
+    """Test that concurrent requests for the same variant share one render"""
+    cache = VariantCache(str(tmp_path / "variants"), max_bytes=10 * 1024 * 1024)
+
+    backend = LocalStorage(os.path.dirname(image_file))
+
+    async def fetch_many():
+        return await asyncio.gather(*[cache.get("photo.png", 100, 100, "jpeg", backend) for _ in range(5)])
+
+    with patch('app.image_cache.images.get_pool', return_value=ThreadPoolExecutor(2)):
+        paths = asyncio.run(fetch_many())
+
+    assert len(set(paths)) == 1
+    assert cache.renders == 1
+    assert cache.coalesced == 4
+
+
+def test_variant_cache_missing_image(tmp_path):
+    """Test that a variant of a missing image raises FileNotFoundError"""
+    cache = VariantCache(str(tmp_path / "variants"), max_bytes=1024)
+
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(cache.get("missing.png", 100, None, "webp", LocalStorage(str(tmp_path))))
@@ -0,0 +1,132 @@
+import os
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+from PIL import Image
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.database import Base
+from app.storage import LocalStorage, resolve
+from app.models import Product
+from app.images import (
+    parse_sizes,
+    parse_formats,
+    generate_derivatives,
+    derivative_files,
+    derivative_names,
+    image_metadata,
+    process_product_image
+)
+
+
+@pytest.fixture
+def image_file(tmp_path):
+    """Create a real 800x400 JPEG image"""
+    path = tmp_path / "photo.jpg"
+    Image.new("RGB", (800, 400), (200, 120, 40)).save(path, "JPEG")
+    return str(path)
+
+
+def test_parse_sizes():
+    """Test parsing the derivative size setting"""
+    assert parse_sizes("thumb:100, medium:640") == {"thumb": 100, "medium": 640}
+    assert parse_sizes("") == {}
+
+
+def test_parse_formats_skips_unknown():
+    """Test that unknown output formats are ignored"""
+    assert parse_formats("webp,gif, JPEG") == ["webp", "jpeg"]
+
+
+def test_generate_derivatives(image_file, tmp_path):
+    """Test generating resized copies in several formats"""
+    result = generate_derivatives(image_file, str(tmp_path), {"thumb": 100, "medium": 400}, ["webp", "jpeg"])
+
+    assert result["thumb"]["webp"] == "photo_thumb.webp"
+    assert result["medium"]["jpeg"] == "photo_medium.jpeg"
+    with Image.open(tmp_path / "photo_thumb.webp") as thumb:
+        # Aspect ratio is kept, longest edge fits the size
+        assert thumb.size == (100, 50)
+        assert thumb.format == "WEBP"
+
+
+def test_derivative_names_and_files():
+    """Test listing derivative file names for an image and for a product"""
+    with patch('app.images.IMAGE_DERIVATIVE_SIZES', "thumb:100,medium:640"), \
+            patch('app.images.IMAGE_DERIVATIVE_FORMATS', "webp,avif"):
+        names = derivative_names("abc.jpg")
+
+    assert sorted(names) == ["abc_medium.avif", "abc_medium.webp", "abc_thumb.avif", "abc_thumb.webp"]
+    assert derivative_files({"thumb": {"webp": "/uploads/abc_thumb.webp"}}) == ["abc_thumb.webp"]
+    assert derivative_files(None) == []
+
+
+def test_generate_derivatives_skips_existing(image_file, tmp_path):
+    """Test that derivatives already stored are not rendered again"""
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+
+    result = generate_derivatives(
+        image_file, str(out_dir), {"thumb": 100}, ["webp"], image_name="abc.jpg", skip={"abc_thumb.webp"}
+    )
+
+    assert result == {"thumb": {"webp": "abc_thumb.webp"}}
+    assert os.listdir(out_dir) == []
+
+
+def test_process_product_image_stores_urls(image_file):
+    """Test the background task stores derivative URLs on the product"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    db = TestingSessionLocal()
+    db.add(Product(id=1, name="Jamu", category="Drinks", price=1.0, image_path=image_file))
+    db.commit()
+    db.close()
+
+    with patch('app.database.SessionLocal', TestingSessionLocal), \
+            patch('app.images.get_pool', return_value=ThreadPoolExecutor(1)), \
+            patch('app.images.IMAGE_DERIVATIVE_SIZES', "thumb:100"), \
+            patch('app.images.IMAGE_DERIVATIVE_FORMATS', "webp"):
+        process_product_image(1, image_file, LocalStorage(os.path.dirname(image_file)))
+
+    db = TestingSessionLocal()
+    product = db.get(Product, 1)
+    assert product.derivatives == {"thumb": {"webp": "/uploads/photo_thumb.webp"}}
+    assert (product.image_width, product.image_height) == (800, 400)
+    assert product.blurhash is not None
+    assert resolve("photo_thumb.webp", os.path.dirname(image_file)) is not None
+    db.close()
+
+
+def test_process_product_image_missing_file(tmp_path):
+    """Test that a missing source image is ignored"""
+    with patch('app.images.get_pool') as mock_pool:
+        process_product_image(1, str(tmp_path / "missing.jpg"), LocalStorage(str(tmp_path)))
+        mock_pool.assert_not_called()
+
+
+def test_pool_does_not_fork_the_app(image_file):
+    """Test that image workers are not forked from the threaded app process"""
+    from app import images
+    try:
+        pool = images.get_pool()
+        assert pool._mp_context.get_start_method() in ("forkserver", "spawn")
+        assert pool.submit(image_metadata, image_file).result(timeout=30)["image_width"] == 800
+    finally:
+        images.shutdown_pool()
+
+
+def test_image_metadata(image_file):
+    """Test reading dimensions, size, dominant color and blurhash"""
+    Image.new("RGB", (800, 400), (200, 120, 40)).save(image_file, "PNG")
+
+    metadata = image_metadata(image_file)
+
+    assert metadata["image_width"] == 800
+    assert metadata["image_height"] == 400
+    assert metadata["image_bytes"] == os.path.getsize(image_file)
+    assert metadata["dominant_color"] == "#c87828"
+    assert len(metadata["blurhash"]) == 28
@@ -0,0 +1,195 @@
+import threading
+import time
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import sessionmaker
+from app import jobs
+from app.database import Base
+from app.models import Job
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    # A file database, so worker threads get their own connections
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+@pytest.fixture
+def handlers():
+    registered = {}
+    with patch.dict(jobs.handlers, clear=True):
+        @jobs.handler("echo")
+        def echo(db, value):
+            registered.setdefault("echo", []).append(value)
+            return {"value": value}
+
+        @jobs.handler("broken")
+        def broken(db):
+            raise RuntimeError("boom")
+
+        yield registered
+
+
+def test_enqueue_unknown_kind(session_factory, handlers):
+    """Test that only registered job kinds can be queued"""
+    db = session_factory()
+    with pytest.raises(ValueError):
+        jobs.enqueue(db, "nope")
+    db.close()
+
+
+def test_claim_is_exclusive(session_factory, handlers):
+    """Test that a queued job is handed out once"""
+    db = session_factory()
+    job = jobs.enqueue(db, "echo", {"value": 1})
+
+    claimed = jobs.claim_next(db, "w1")
+    again = jobs.claim_next(db, "w2")
+
+    assert claimed.id == job.id
+    assert claimed.attempts == 1
+    assert again is None
+    db.expire_all()
+    assert db.get(Job, job.id).locked_by == "w1"
+    db.close()
+
+
+def test_run_job_success(session_factory, handlers):
+    """Test that the handler result is stored"""
+    db = session_factory()
+    job = jobs.enqueue(db, "echo", {"value": 5})
+
+    jobs.run_job(jobs.claim_next(db, "w"), session_factory)
+
+    db.expire_all()
+    job = db.get(Job, job.id)
+    assert job.status == "succeeded"
+    assert job.result == {"value": 5}
+    assert job.finished_at is not None
+    db.close()
+
+
+def test_run_job_retries_with_backoff_then_fails(session_factory, handlers):
+    """Test that a failing job is re-queued later and fails after max_attempts"""
+    db = session_factory()
+    job = jobs.enqueue(db, "broken", max_attempts=2)
+
+    jobs.run_job(jobs.claim_next(db, "w"), session_factory)
+    db.expire_all()
+    retried = db.get(Job, job.id)
+    assert retried.status == "queued"
+    assert retried.error == "RuntimeError: boom"
+    assert retried.run_after > datetime.utcnow()
+    assert jobs.claim_next(db, "w") is None
+
+    retried.run_after = datetime.utcnow()
+    db.commit()
+    jobs.run_job(jobs.claim_next(db, "w"), session_factory)
+    db.expire_all()
+    failed = db.get(Job, job.id)
+    assert failed.status == "failed"
+    assert failed.attempts == 2
+    db.close()
+
+
+def test_requeue_stale(session_factory, handlers):
+    """Test that jobs left running by a dead worker are queued again"""
+    db = session_factory()
+    old = datetime.utcnow() - timedelta(hours=2)
+    db.add_all([
+        Job(kind="echo", status="running", started_at=old),
+        Job(kind="echo", status="running", started_at=datetime.utcnow()),
+        Job(kind="echo", status="running", started_at=old, heartbeat_at=datetime.utcnow()),
+    ])
+    db.commit()
+
+    assert jobs.requeue_stale(db, stale_seconds=3600) == 1
+    db.close()
+
+
+def test_requeue_stale_fails_jobs_out_of_attempts(session_factory, handlers):
+    """Test that a stale job on its last attempt fails instead of running again"""
+    db = session_factory()
+    old = datetime.utcnow() - timedelta(hours=2)
+    job = Job(kind="echo", status="running", started_at=old, attempts=2, max_attempts=2)
+    db.add(job)
+    db.commit()
+
+    assert jobs.requeue_stale(db, stale_seconds=3600) == 1
+    db.expire_all()
+    assert job.status == "failed"
+    assert job.error == "Worker stopped responding"
+    assert job.finished_at is not None
+    db.close()
+
+
+def test_run_job_outcome_dropped_once_taken_back(session_factory, handlers):
+    """Test that a worker whose job was re-queued as stale does not overwrite its next run"""
+    db = session_factory()
+    job = jobs.enqueue(db, "echo", {"value": 1})
+    stale_claim = jobs.claim_next(db, "w1")
+    db.execute(update(Job).where(Job.id == job.id).values(heartbeat_at=datetime.utcnow() - timedelta(hours=2)))
+    db.commit()
+    assert jobs.requeue_stale(db, stale_seconds=3600) == 1
+    assert jobs.claim_next(db, "w2").locked_by == "w2"
+
+    jobs.run_job(stale_claim, session_factory)
+
+    db.expire_all()
+    job = db.get(Job, job.id)
+    assert job.status == "running"
+    assert job.locked_by == "w2"
+    assert job.result is None
+    db.close()
+
+
+def test_long_running_job_keeps_its_heartbeat(session_factory, handlers):
+    """Test that a job running longer than the stale limit is not re-queued while its worker is alive"""
+    started = threading.Event()
+    release = threading.Event()
+
+    @jobs.handler("slow")
+    def slow(db):
+        started.set()
+        release.wait(5)
+
+    db = session_factory()
+    job = jobs.enqueue(db, "slow")
+    runner = threading.Thread(
+        target=jobs.run_job, args=(jobs.claim_next(db, "w"), session_factory), kwargs={"heartbeat_seconds": 0.01}
+    )
+    runner.start()
+    try:
+        assert started.wait(5)
+        time.sleep(0.2)
+        assert jobs.requeue_stale(db, stale_seconds=0.1) == 0
+    finally:
+        release.set()
+        runner.join()
+
+    db.expire_all()
+    assert db.get(Job, job.id).status == "succeeded"
+    db.close()
+
+
+def test_worker_pool_runs_jobs(session_factory, handlers):
+    """Test that pool threads pick up queued jobs"""
+    db = session_factory()
+    ids = [jobs.enqueue(db, "echo", {"value": i}).id for i in range(5)]
+    pool = jobs.WorkerPool(size=2, poll_seconds=0.05, session_factory=session_factory)
+    pool.start()
+    try:
+        deadline = time.monotonic() + 5
+        while len(handlers.get("echo", [])) < 5 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        pool.shutdown()
+
+    assert sorted(handlers["echo"]) == [0, 1, 2, 3, 4]
+    db.expire_all()
+    assert {db.get(Job, i).status for i in ids} == {"succeeded"}
+    db.close()
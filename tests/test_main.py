@@ -280,4 +280,477 @@ def test_delete_product():
                 
                 assert response.status_code == 200
                 response_data = response.json()
-                assert response_data["message"] == "Deleted successfully"
\ No newline at end of file
+                assert response_data["message"] == "Deleted successfully"
+
+
+def test_upload_product_image(tmp_path):
+    """Test streaming a raw image body to a product"""
+    image_bytes = b"\x89PNG\r\n\x1a\n" + b"\x00" * 100
+    existing_product = Product(id=1, name="Test Product", category="Test Category", price=10.5)
+
+    def fake_update(db, product_id, name, category, price, image_path=None):
+        return Product(id=product_id, name=name, category=category, price=price, image_path=image_path)
+
+    with patch('main.UPLOAD_DIR', str(tmp_path)), \
+            patch('main.crud.get_product', return_value=existing_product), \
+            patch('main.crud.update_product', side_effect=fake_update), \
+            patch('main.jobs.enqueue') as mock_enqueue:
+        response = client.put(
+            "/products/1/image",
+            content=image_bytes,
+            headers={"Content-Type": "image/png"}
+        )
+
+    assert response.status_code == 200
+    assert mock_enqueue.call_args.args[1] == "process_image"
+    image_path = response.json()["image_path"]
+    assert image_path.startswith("/uploads/") and image_path.endswith(".png")
+    from app.storage import resolve
+    with open(resolve(os.path.basename(image_path), str(tmp_path)), "rb") as f:
+        assert f.read() == image_bytes
+
+
+def test_upload_product_image_rejects_non_image(tmp_path):
+    """Test that the streamed body must be a JPG or PNG"""
+    existing_product = Product(id=1, name="Test Product", category="Test Category", price=10.5)
+
+    with patch('main.UPLOAD_DIR', str(tmp_path)), \
+            patch('main.crud.get_product', return_value=existing_product):
+        response = client.put("/products/1/image", content=b"plain text body")
+
+    assert response.status_code == 400
+    assert os.listdir(tmp_path) == []
+
+def test_get_upload_original_and_variant(tmp_path):
+    """Test serving an original upload and a resized variant"""
+    from concurrent.futures import ThreadPoolExecutor
+    from PIL import Image
+    from app.image_cache import VariantCache
+
+    Image.new("RGB", (640, 480), (255, 0, 0)).save(tmp_path / "photo.jpg", "JPEG")
+    variant_cache = VariantCache(str(tmp_path / "variants"), max_bytes=1024 * 1024)
+
+    with patch('main.UPLOAD_DIR', str(tmp_path)), \
+            patch('main.get_variant_cache', return_value=variant_cache), \
+            patch('app.image_cache.images.get_pool', return_value=ThreadPoolExecutor(1)):
+        original = client.get("/uploads/photo.jpg")
+        variant = client.get("/uploads/photo.jpg?w=320&fmt=webp")
+        missing = client.get("/uploads/missing.jpg")
+        bad_format = client.get("/uploads/photo.jpg?fmt=gif")
+
+    assert original.status_code == 200
+    assert original.headers["content-type"] == "image/jpeg"
+    assert variant.status_code == 200
+    assert variant.headers["content-type"] == "image/webp"
+    assert "immutable" in variant.headers["cache-control"]
+    assert missing.status_code == 404
+    assert bad_format.status_code == 400
+
+
+def test_presign_upload_needs_object_storage(tmp_path):
+    """Test that direct uploads are refused with the local backend"""
+    with patch('main.UPLOAD_DIR', str(tmp_path)):
+        response = client.post(
+            "/uploads/presign",
+            json={"sha256": "a" * 64, "content_type": "image/png", "size": 1024}
+        )
+
+    assert response.status_code == 400
+
+
+def test_presign_upload_existing_image(tmp_path):
+    """Test that already stored content needs no upload"""
+    from app.storage import prepare_path
+
+    with open(prepare_path("a" * 64 + ".png", str(tmp_path)), "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+
+    with patch('main.UPLOAD_DIR', str(tmp_path)):
+        response = client.post(
+            "/uploads/presign",
+            json={"sha256": "a" * 64, "content_type": "image/png", "size": 1024}
+        )
+
+    assert response.status_code == 200
+    assert response.json()["name"] == "a" * 64 + ".png"
+    assert response.json()["exists"] is True
+
+
+def test_presign_upload_too_large():
+    """Test that a presigned upload is refused for files over MAX_UPLOAD_SIZE"""
+    with patch('main.MAX_UPLOAD_SIZE', 1024):
+        response = client.post(
+            "/uploads/presign",
+            json={"sha256": "a" * 64, "content_type": "image/png", "size": 1025}
+        )
+
+    assert response.status_code == 413
+
+
+def test_create_product_with_stored_image_name(tmp_path):
+    """Test attaching an image that was uploaded straight to storage"""
+    from app.storage import prepare_path
+
+    name = "b" * 64 + ".png"
+    with open(prepare_path(name, str(tmp_path)), "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n" + b"\x00" * 10)
+
+    def fake_create(db, name, category, price, image_path=None):
+        return Product(id=1, name=name, category=category, price=price, image_path=image_path)
+
+    with patch('main.UPLOAD_DIR', str(tmp_path)), \
+            patch('main.crud.create_product', side_effect=fake_create), \
+            patch('main.jobs.enqueue') as mock_enqueue:
+        response = client.post(
+            "/products/",
+            data={"name": "Jamu", "category": "Drinks", "price": "1.0", "image_name": name}
+        )
+        bad_name = client.post(
+            "/products/",
+            data={"name": "Jamu", "category": "Drinks", "price": "1.0", "image_name": "../etc/passwd"}
+        )
+
+    assert response.status_code == 200
+    assert response.json()["image_path"] == f"/uploads/{name}"
+    assert bad_name.status_code == 400
+    mock_enqueue.assert_called_once()
+    assert mock_enqueue.call_args.args[2]["image_path"].endswith(name)
+
+
+def test_cleanup_uploads_in_background():
+    """Test that a background cleanup is queued and its status can be read"""
+    from sqlalchemy.pool import StaticPool
+    from main import get_db
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def override_get_db():
+        db = TestingSessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    try:
+        response = client.post("/cleanup-uploads?background=true&dry_run=true")
+        status = client.get(response.headers["location"])
+        missing = client.get("/jobs/999")
+    finally:
+        del app.dependency_overrides[get_db]
+
+    assert response.status_code == 202
+    assert response.json()["status"] == "queued"
+    assert status.status_code == 200
+    assert status.json()["kind"] == "cleanup"
+    assert status.json()["attempts"] == 0
+    assert missing.status_code == 404
+
+
+def test_get_upload_cache_headers_etag_and_range(tmp_path):
+    """Test immutable caching, conditional requests and byte ranges"""
+    from app.storage import prepare_path
+
+    name = "c" * 64 + ".png"
+    content = b"\x89PNG\r\n\x1a\n" + bytes(range(100))
+    with open(prepare_path(name, str(tmp_path)), "wb") as f:
+        f.write(content)
+
+    with patch('main.UPLOAD_DIR', str(tmp_path)):
+        full = client.get(f"/uploads/{name}")
+        etag = full.headers["etag"]
+        revalidated = client.get(f"/uploads/{name}", headers={"If-None-Match": etag})
+        changed = client.get(f"/uploads/{name}", headers={"If-None-Match": '"other"'})
+        partial = client.get(f"/uploads/{name}", headers={"Range": "bytes=0-7"})
+        head = client.head(f"/uploads/{name}")
+
+    assert full.status_code == 200
+    assert full.headers["cache-control"] == "public, max-age=31536000, immutable"
+    assert etag == '"' + "c" * 64 + '"'
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert changed.status_code == 200
+    assert partial.status_code == 206
+    assert partial.content == content[:8]
+    assert partial.headers["content-range"] == f"bytes 0-7/{len(content)}"
+    assert head.status_code == 200
+    assert head.headers["content-length"] == str(len(content))
+
+
+def test_get_upload_not_modified_skips_storage(tmp_path):
+    """Test that a matching If-None-Match is answered without a file lookup"""
+    with patch('main.UPLOAD_DIR', str(tmp_path)), \
+            patch('main.storage.LocalStorage.local_path') as mock_local_path:
+        response = client.get("/uploads/abc.jpg", headers={"If-None-Match": '"abc"'})
+
+    assert response.status_code == 304
+    mock_local_path.assert_not_called()
+
+
+def test_get_upload_wildcard_if_none_match_is_not_a_hit(tmp_path):
+    """Test that If-None-Match: * does not make a missing image look cached"""
+    with patch('main.UPLOAD_DIR', str(tmp_path)):
+        response = client.get("/uploads/" + "d" * 64 + ".jpg", headers={"If-None-Match": "*"})
+
+    assert response.status_code == 404
+
+
+def test_failed_update_keeps_product_and_queues_new_upload(tmp_path):
+    """Test that a failed update leaves the old image in place and the new file to the cleanup"""
+    from sqlalchemy.exc import OperationalError
+    from sqlalchemy.pool import StaticPool
+    from app import crud
+    from app.cleanup import run_cleanup
+    from app.models import PendingOrphan, StoredImage
+    from app.storage import LocalStorage, resolve
+    from main import get_db
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = TestingSessionLocal()
+    old_path = str(tmp_path / "old.jpg")
+    product = crud.create_product(db, name="Jamu", category="Drinks", price=1.0, image_path=old_path)
+    db.close()
+
+    def override_get_db():
+        session = TestingSessionLocal()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    failing_client = TestClient(app, raise_server_exceptions=False)
+    app.dependency_overrides[get_db] = override_get_db
+    # The database fails halfway through the update transaction
+    failure = OperationalError("UPDATE images", {}, Exception("disk I/O error"))
+    try:
+        with patch('main.UPLOAD_DIR', str(tmp_path)), \
+                patch('app.crud.release_image', side_effect=failure), \
+                patch('main.jobs.enqueue') as mock_enqueue:
+            response = failing_client.put(
+                f"/products/{product.id}",
+                data={"name": "Jamu", "category": "Drinks", "price": "2.0"},
+                files={"file": ("new.png", b"\x89PNG\r\n\x1a\n" + b"\x01" * 10, "image/png")},
+            )
+    finally:
+        del app.dependency_overrides[get_db]
+
+    assert response.status_code == 500
+    mock_enqueue.assert_not_called()
+    db = TestingSessionLocal()
+    assert db.get(Product, product.id).image_path == old_path
+    assert db.get(Product, product.id).price == 1.0
+    assert db.get(StoredImage, "old.jpg").refcount == 1
+    new_name = db.query(PendingOrphan.name).scalar()
+    assert new_name.endswith(".png")
+    assert db.get(StoredImage, new_name).refcount == 0
+
+    result = run_cleanup(db, LocalStorage(str(tmp_path)), grace_seconds=0)
+    assert new_name in result["deleted_files"]
+    assert resolve(new_name, str(tmp_path)) is None
+    db.close()
+
+
+def test_resumable_upload_flow(tmp_path):
+    """Test creating, resuming and finalizing an upload, then attaching it to a product"""
+    from sqlalchemy.pool import StaticPool
+    from main import get_db
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def override_get_db():
+        db = TestingSessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    content = b"\xff\xd8\xff" + b"\x10" * 500
+    chunk_headers = {"Content-Type": "application/offset+octet-stream"}
+    app.dependency_overrides[get_db] = override_get_db
+    try:
+        with patch('main.UPLOAD_DIR', str(tmp_path)), \
+                patch('app.resumable.UPLOAD_SESSION_DIR', str(tmp_path / ".sessions")), \
+                patch('main.jobs.enqueue'):
+            created = client.post("/uploads/sessions", headers={"Upload-Length": str(len(content))})
+            location = created.headers["location"]
+            first = client.patch(location, content=content[:200], headers={**chunk_headers, "Upload-Offset": "0"})
+            head = client.head(location)
+            stale = client.patch(location, content=content[200:], headers={**chunk_headers, "Upload-Offset": "0"})
+            wrong_type = client.patch(location, content=content[200:], headers={"Upload-Offset": "200"})
+            second = client.patch(location, content=content[200:], headers={**chunk_headers, "Upload-Offset": "200"})
+            finalized = client.post(f"{location}/finalize")
+            product = client.post(
+                "/products/",
+                data={"name": "Jamu", "category": "Drinks", "price": "1.0", "upload_id": created.json()["id"]}
+            )
+    finally:
+        del app.dependency_overrides[get_db]
+
+    assert created.status_code == 201
+    assert created.json()["offset"] == 0
+    assert first.status_code == 204
+    assert first.headers["upload-offset"] == "200"
+    assert head.headers["upload-offset"] == "200"
+    assert head.headers["upload-length"] == str(len(content))
+    assert stale.status_code == 409
+    assert wrong_type.status_code == 415
+    assert second.headers["upload-offset"] == str(len(content))
+    assert finalized.status_code == 200
+    image_name = finalized.json()["image_name"]
+    assert image_name.endswith(".jpg")
+    assert product.status_code == 200
+    assert product.json()["image_path"] == f"/uploads/{image_name}"
+
+
+def test_create_app_runs_startup_in_lifespan(tmp_path):
+    """Test that startup work happens when the app starts, not on import"""
+    from main import create_app
+    from app.config import Settings
+
+    settings = Settings(job_workers=0, run_scheduler=False)
+    upload_dir = tmp_path / "uploads"
+    with patch('main.UPLOAD_DIR', str(upload_dir)), \
+            patch('main.init_db') as mock_init_db, \
+            patch('main.images.warm_pool') as mock_warm_pool, \
+            patch('main.scheduler.LeaderScheduler.start') as mock_scheduler_start:
+        factory_app = create_app(settings)
+        assert not upload_dir.exists()
+        mock_init_db.assert_not_called()
+
+        with TestClient(factory_app) as started:
+            assert started.get("/products/999").status_code == 404
+            mock_init_db.assert_called_once()
+            mock_warm_pool.assert_called_once()
+            assert upload_dir.exists()
+
+    mock_scheduler_start.assert_not_called()
+    assert factory_app.state.settings is settings
+
+
+def test_metrics_endpoint_reports_routes():
+    """Test that requests are recorded by route template and exported at /metrics"""
+    from app import metrics
+
+    metrics.registry.reset()
+    with patch('main.crud.get_product', return_value=None):
+        client.get("/products/999")
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_responses_total{method="GET",route="/products/{product_id}",status="404"} 1' in response.text
+
+
+def test_get_profile(tmp_path):
+    """Test that admins can download a saved profile, and unknown ids are 404"""
+    (tmp_path / "0123456789abcdef.folded").write_text("MainThread;main:list_products 3\n")
+    with patch('app.profiling.PROFILE_DIR', str(tmp_path)):
+        response = client.get("/profiles/0123456789abcdef")
+        assert client.get("/profiles/fedcba9876543210").status_code == 404
+        assert client.get("/profiles/..%2Fproduct.db").status_code == 404
+
+    assert response.status_code == 200
+    assert response.text == "MainThread;main:list_products 3\n"
+
+
+def test_concurrent_identical_reads_are_coalesced():
+    """Test that identical GET /products/{id} requests in flight together run the query once"""
+    import asyncio
+    import time
+    import httpx
+    import main as main_module
+
+    def slow_get_product(db, product_id):
+        time.sleep(0.1)
+        return Product(id=product_id, name="Flash Sale", category="Tea", price=1.0)
+
+    async def fire():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            return await asyncio.gather(*[ac.get("/products/7") for _ in range(10)])
+
+    coalesced = main_module.product_reads.coalesced
+    with patch('main.crud.get_product', side_effect=slow_get_product) as mock_get_product:
+        responses = asyncio.run(fire())
+
+    assert [r.status_code for r in responses] == [200] * 10
+    assert all(r.json()["name"] == "Flash Sale" for r in responses)
+    assert mock_get_product.call_count == 1
+    assert main_module.product_reads.coalesced - coalesced == 9
+    # The shared call ran in a session of its own, not in one of the requests' sessions
+    request_sessions = []
+
+    def track_db():
+        db = main_module.SessionLocal()
+        request_sessions.append(db)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[main_module.get_db] = track_db
+    try:
+        with patch('main.crud.get_product', side_effect=slow_get_product) as mock_get_product:
+            asyncio.run(fire())
+    finally:
+        del app.dependency_overrides[main_module.get_db]
+    assert mock_get_product.call_args.args[0] not in request_sessions
+
+
+def test_reads_started_before_a_write_are_not_joined():
+    """Test that a GET /products/{id} after a product write does not share a read started before it"""
+    import asyncio
+    import time
+    import httpx
+    from app.response_cache import product_lists
+
+    def slow_get_product(db, product_id):
+        time.sleep(0.2)
+        return Product(id=product_id, name="Flash Sale", category="Tea", price=1.0)
+
+    async def fire():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            before = asyncio.ensure_future(ac.get("/products/7"))
+            await asyncio.sleep(0.05)
+            product_lists.invalidate()  # what a product write does
+            return await asyncio.gather(before, ac.get("/products/7"))
+
+    with patch('main.crud.get_product', side_effect=slow_get_product) as mock_get_product:
+        responses = asyncio.run(fire())
+
+    assert [r.status_code for r in responses] == [200, 200]
+    assert mock_get_product.call_count == 2
+
+
+def test_list_products_served_from_cache_until_product_write():
+    """Test that listing pages are cached, answer If-None-Match, and are dropped on a product write"""
+    with patch('main.crud.list_products') as mock_list_products:
+        mock_list_products.return_value = [Product(id=1, name="Jahe", category="Tea", price=1.0)]
+        first = client.get("/products/", params={"limit": 5, "skip": 0})
+        second = client.get("/products/", params={"skip": 0, "limit": 5, "search": ""})
+        not_modified = client.get("/products/?limit=5", headers={"If-None-Match": first.headers["etag"]})
+        assert mock_list_products.call_count == 1
+
+        assert first.status_code == 200
+        assert first.headers["cache-control"].startswith("public, max-age=")
+        assert second.json() == first.json() == [
+            {"name": "Jahe", "category": "Tea", "price": 1.0, "id": 1, "image_path": None, "derivatives": None,
+             "image_width": None, "image_height": None, "image_bytes": None, "dominant_color": None,
+             "blurhash": None}
+        ]
+        assert not_modified.status_code == 304
+        # Cached or not, a page says which change version to stream from
+        assert first.headers["x-changes-version"] == second.headers["x-changes-version"]
+        assert int(first.headers["x-changes-version"]) >= 0
+
+        from app.response_cache import product_lists
+        product_lists.invalidate()
+        client.get("/products/?limit=5")
+        assert mock_list_products.call_count == 2
@@ -0,0 +1,100 @@
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from app import metrics
+
+
+@pytest.fixture
+def registry():
+    return metrics.Registry()
+
+
+@pytest.fixture
+def client(registry):
+    app = FastAPI()
+    app.add_middleware(metrics.MetricsMiddleware, registry=registry)
+
+    @app.get("/items/{item_id}")
+    def get_item(item_id: int):
+        if item_id == 0:
+            raise HTTPException(status_code=404, detail="Not found")
+        return {"id": item_id, "name": "x" * 100}
+
+    return TestClient(app)
+
+
+def test_histogram_quantile_interpolates_within_bucket():
+    h = metrics.Histogram((0.1, 0.2, 0.4))
+    for value in [0.05] * 50 + [0.15] * 45 + [0.3] * 5:
+        h.observe(value)
+    assert h.count == 100
+    assert h.counts == [50, 45, 5, 0]
+    assert h.quantile(0.5) == pytest.approx(0.1)
+    assert h.quantile(0.95) == pytest.approx(0.2)
+    assert h.quantile(0.99) == pytest.approx(0.36)
+
+
+def test_histogram_quantile_of_overflow_bucket_is_last_bound():
+    h = metrics.Histogram((0.1,))
+    h.observe(5)
+    assert h.counts == [0, 1]
+    assert h.quantile(0.99) == 0.1
+
+
+def test_middleware_labels_by_route_template(client, registry):
+    body_sizes = [len(client.get(path).content) for path in ("/items/1", "/items/2", "/items/0")]
+    client.get("/nothing-here")
+
+    assert registry.responses == {
+        ("GET", "/items/{item_id}", 200): 2,
+        ("GET", "/items/{item_id}", 404): 1,
+        ("GET", metrics.UNMATCHED, 404): 1,
+    }
+    assert registry.latency[("GET", "/items/{item_id}")].count == 3
+    sizes = registry.sizes[("GET", "/items/{item_id}")]
+    assert sizes.sum == sum(body_sizes)
+    assert registry.in_flight == 0
+
+
+def test_render_prometheus_text(client, registry):
+    client.get("/items/1")
+    text = registry.render()
+
+    assert "http_requests_in_flight 0" in text
+    assert 'http_responses_total{method="GET",route="/items/{item_id}",status="200"} 1' in text
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/items/{item_id}",le="+Inf"} 1' in text
+    assert 'http_request_duration_seconds_count{method="GET",route="/items/{item_id}"} 1' in text
+    assert 'http_request_duration_quantile_seconds{method="GET",route="/items/{item_id}",quantile="0.99"}' in text
+    assert 'http_response_size_bytes_count{method="GET",route="/items/{item_id}"} 1' in text
+
+
+def test_render_escapes_label_values(registry):
+    registry.started()
+    registry.finished("GET", 'a"b', 200, 0.01, 10)
+    assert 'route="a\\"b"' in registry.render()
+
+
+def test_debug_headers_count_queries_from_threadpool(registry):
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.pool import StaticPool
+    from app.database import instrument
+
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    instrument(engine)
+    app = FastAPI()
+    app.add_middleware(metrics.MetricsMiddleware, registry=registry, debug_headers=True)
+
+    @app.get("/n-plus-one/{n}")
+    def n_plus_one(n: int):
+        with engine.connect() as conn:
+            for i in range(n):
+                conn.execute(text("SELECT :i"), {"i": i})
+        return {}
+
+    response = TestClient(app).get("/n-plus-one/3")
+
+    assert response.headers["x-db-queries"] == "3"
+    assert float(response.headers["x-db-time"]) >= 0
+    queries = registry.db_queries[("GET", "/n-plus-one/{n}")]
+    assert queries.count == 1 and queries.sum == 3
+    assert 'http_request_db_queries_sum{method="GET",route="/n-plus-one/{n}"} 3' in registry.render()
@@ -0,0 +1,117 @@
+import os
+import time
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from app import profiling
+
+
+def busy_loop(seconds):
+    deadline = time.perf_counter() + seconds
+    n = 0
+    while time.perf_counter() < deadline:
+        n += 1
+    return n
+
+
+@pytest.fixture
+def client(tmp_path):
+    def authorize(token):
+        if token != "admin-token":
+            raise HTTPException(status_code=403, detail="Admin access required")
+
+    app = FastAPI()
+    app.add_middleware(profiling.ProfileMiddleware, authorize=authorize, profile_dir=str(tmp_path))
+
+    @app.get("/slow")
+    def slow():
+        busy_loop(0.05)
+        return {"ok": True}
+
+    return TestClient(app)
+
+
+def test_sampler_records_busy_thread_stacks():
+    sampler = profiling.Sampler(0.001)
+    sampler.start()
+    busy_loop(0.05)
+    sampler.stop()
+
+    assert sampler.samples > 0
+    assert any("test_profiling:busy_loop" in stack for stack in sampler.stacks)
+    line = next(line for line in sampler.collapsed().splitlines() if "busy_loop" in line)
+    stack, count = line.rsplit(" ", 1)
+    assert stack.startswith("MainThread;") and int(count) > 0
+
+
+def test_requests_without_header_are_not_profiled(client, tmp_path):
+    response = client.get("/slow")
+    assert response.status_code == 200
+    assert "x-profile-id" not in response.headers
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_profiling_requires_admin(client, tmp_path):
+    assert client.get("/slow", headers={"X-Profile": "true"}).status_code == 401
+    response = client.get("/slow", headers={"X-Profile": "true", "Authorization": "Bearer user-token"})
+    assert response.status_code == 403
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_profiled_request_saves_collapsed_stacks(client, tmp_path):
+    response = client.get("/slow", headers={
+        "X-Profile": "true", "X-Profile-Interval": "1", "Authorization": "Bearer admin-token",
+    })
+
+    assert response.status_code == 200
+    assert response.json() == {"ok": True}
+    profile = (tmp_path / f"{response.headers['x-profile-id']}.folded").read_text()
+    assert "test_profiling:slow;test_profiling:busy_loop" in profile
+
+
+def test_sampler_is_stopped_off_the_event_loop(client, tmp_path):
+    import asyncio
+    from unittest.mock import patch
+
+    stopped_on_loop = []
+    stop = profiling.Sampler.stop
+
+    def checking_stop(sampler):
+        try:
+            asyncio.get_running_loop()
+            stopped_on_loop.append(True)
+        except RuntimeError:
+            stopped_on_loop.append(False)
+        stop(sampler)
+
+    with patch.object(profiling.Sampler, "stop", checking_stop):
+        response = client.get("/slow", headers={"X-Profile": "true", "Authorization": "Bearer admin-token"})
+
+    assert response.status_code == 200
+    assert stopped_on_loop == [False]
+
+
+def test_interval_is_clamped():
+    assert profiling.interval_seconds("") == profiling.PROFILE_INTERVAL_MS / 1000
+    assert profiling.interval_seconds("0.01") == profiling.MIN_INTERVAL_MS / 1000
+    assert profiling.interval_seconds("5000") == profiling.MAX_INTERVAL_MS / 1000
+    with pytest.raises(HTTPException):
+        profiling.interval_seconds("fast")
+
+
+def test_profile_path_rejects_bad_ids():
+    with pytest.raises(HTTPException) as exc:
+        profiling.profile_path("../../etc/passwd")
+    assert exc.value.status_code == 404
+
+
+def test_save_keeps_only_newest_profiles(tmp_path):
+    for i in range(3):
+        old = tmp_path / f"{i:016x}.folded"
+        old.write_text("old 1\n")
+        os.utime(old, (1000 + i, 1000 + i))
+    (tmp_path / "notes.txt").write_text("kept")
+
+    profiling.save(profiling.Sampler(0.001), "f" * 16, str(tmp_path), keep=2)
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == [f"{2:016x}.folded", "f" * 16 + ".folded", "notes.txt"]
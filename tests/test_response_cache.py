@@ -0,0 +1,82 @@
+from unittest.mock import patch
+from app.models import Product
+from app.response_cache import ResponseCache, product_lists
+
+
+def test_get_returns_stored_body():
+    """Test that a stored body is returned with an ETag of its content"""
+    cache = ResponseCache(ttl=10, max_bytes=1000)
+    cache.set("a", b"[1]", cache.generation)
+
+    entry = cache.get("a")
+    assert entry.body == b"[1]"
+    assert entry.etag.startswith('"') and entry.etag.endswith('"')
+    assert cache.get("b") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_invalidate_drops_entries_and_late_sets():
+    """Test that entries, and bodies computed before an invalidation, are misses afterwards"""
+    cache = ResponseCache(ttl=10, max_bytes=1000)
+    generation = cache.generation
+    cache.set("a", b"[1]", generation)
+    cache.invalidate()
+
+    assert cache.get("a") is None
+    cache.set("b", b"[2]", generation)
+    assert cache.get("b") is None
+    assert cache.total_bytes == 0
+
+
+def test_entries_expire_after_ttl():
+    """Test that entries older than the TTL are misses"""
+    cache = ResponseCache(ttl=10, max_bytes=1000)
+    with patch("app.response_cache.time.monotonic", return_value=100.0):
+        cache.set("a", b"[1]", cache.generation)
+    with patch("app.response_cache.time.monotonic", return_value=109.0):
+        assert cache.get("a") is not None
+    with patch("app.response_cache.time.monotonic", return_value=110.0):
+        assert cache.get("a") is None
+
+
+def test_least_recently_used_evicted_past_max_bytes():
+    """Test that the least recently used entries are evicted to stay under max_bytes"""
+    cache = ResponseCache(ttl=10, max_bytes=10)
+    cache.set("a", b"aaaa", cache.generation)
+    cache.set("b", b"bbbb", cache.generation)
+    cache.get("a")
+    cache.set("c", b"cccc", cache.generation)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.total_bytes == 8
+
+
+def test_disabled_with_zero_ttl():
+    """Test that nothing is stored when the TTL is 0"""
+    cache = ResponseCache(ttl=0, max_bytes=1000)
+    entry = cache.set("a", b"[1]", cache.generation)
+
+    assert entry.body == b"[1]"
+    assert cache.get("a") is None
+
+
+def test_product_commit_invalidates_product_lists(db_session):
+    """Test that committing a product change invalidates the listing cache, and a rollback does not"""
+    generation = product_lists.generation
+    db_session.add(Product(name="Jahe", category="Tea", price=1.0))
+    db_session.flush()
+    db_session.rollback()
+    assert product_lists.generation == generation
+
+    product = Product(name="Jahe", category="Tea", price=1.0)
+    db_session.add(product)
+    db_session.commit()
+    assert product_lists.generation == generation + 1
+
+    product.price = 2.0
+    db_session.flush()
+    product.name = "Kunyit"
+    db_session.commit()
+    assert product_lists.generation == generation + 2
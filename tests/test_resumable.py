@@ -0,0 +1,143 @@
+import asyncio
+import hashlib
+import os
+import pytest
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from sqlalchemy.orm import sessionmaker
+from app import resumable
+from app.models import PendingOrphan, StoredImage, UploadSession
+from app.storage import LocalStorage, resolve
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(200))
+
+
+@pytest.fixture
+def session_dir(tmp_path):
+    return str(tmp_path / "sessions")
+
+
+def append(db, session_id, offset, *chunks, fail_after=False, session_dir=None):
+    async def stream():
+        for chunk in chunks:
+            yield chunk
+        if fail_after:
+            raise ConnectionResetError("client went away")
+
+    return asyncio.run(resumable.append(db, session_id, offset, stream(), session_dir=session_dir, chunk_size=4))
+
+
+def test_create_session_limits(db_session, session_dir):
+    """Test that the declared length must be positive and within the limit"""
+    with pytest.raises(HTTPException) as too_large:
+        resumable.create_session(db_session, 101, session_dir, max_size=100)
+    with pytest.raises(HTTPException) as empty:
+        resumable.create_session(db_session, 0, session_dir)
+
+    assert too_large.value.status_code == 413
+    assert empty.value.status_code == 400
+
+
+def test_append_in_parts_and_resume_after_disconnect(db_session, session_dir):
+    """Test that data arrives over several requests and a broken one keeps what it got"""
+    session = resumable.create_session(db_session, len(PNG), session_dir)
+
+    assert append(db_session, session.id, 0, PNG[:10], PNG[10:50], session_dir=session_dir) == 50
+    with pytest.raises(ConnectionResetError):
+        append(db_session, session.id, 50, PNG[50:60], PNG[60:61], fail_after=True, session_dir=session_dir)
+    assert resumable.get_session(db_session, session.id).offset == 61
+
+    with pytest.raises(HTTPException) as mismatch:
+        append(db_session, session.id, 50, PNG[50:], session_dir=session_dir)
+    assert mismatch.value.status_code == 409
+
+    assert append(db_session, session.id, 61, PNG[61:], session_dir=session_dir) == len(PNG)
+    with open(resumable.session_path(session.id, session_dir), "rb") as f:
+        assert f.read() == PNG
+
+
+def test_append_rejects_extra_bytes(db_session, session_dir):
+    """Test that a body past the declared length is refused, keeping the bytes before it"""
+    session = resumable.create_session(db_session, 8, session_dir)
+
+    with pytest.raises(HTTPException) as exc_info:
+        append(db_session, session.id, 0, b"1234", b"56789", session_dir=session_dir)
+
+    assert exc_info.value.status_code == 413
+    assert resumable.get_session(db_session, session.id).offset == 4
+
+
+def test_stalled_writer_loses_lock_to_new_request(db_session, session_dir):
+    """Test that a writer whose lock expired and was taken over fails without writing further"""
+    session = resumable.create_session(db_session, len(PNG), session_dir)
+    other = sessionmaker(bind=db_session.get_bind())()
+    taken = {}
+
+    async def stalled():
+        yield PNG[:4]
+        # The writer stalls past LOCK_SECONDS and another request claims the session
+        other.query(UploadSession).update({UploadSession.locked_until: datetime.utcnow() - timedelta(seconds=1)})
+        other.commit()
+        taken["token"] = resumable._claim(other, session.id, 0)
+        yield PNG[4:8]
+
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(resumable.append(db_session, session.id, 0, stalled(), session_dir=session_dir, chunk_size=4))
+
+    assert exc_info.value.status_code == 409
+    assert taken["token"] is not None
+    other.expire_all()
+    current = other.get(UploadSession, session.id)
+    assert current.offset == 0
+    assert current.lock_token == taken["token"]
+    assert os.path.getsize(resumable.session_path(session.id, session_dir)) == 4
+    other.close()
+
+
+def test_finalize_stores_image(db_session, session_dir, tmp_path):
+    """Test that a complete upload is stored by content hash and tracked for the cleanup"""
+    backend = LocalStorage(str(tmp_path / "uploads"))
+    session = resumable.create_session(db_session, len(PNG), session_dir)
+
+    with pytest.raises(HTTPException) as incomplete:
+        resumable.finalize(db_session, session.id, backend, session_dir)
+    assert incomplete.value.status_code == 409
+
+    append(db_session, session.id, 0, PNG, session_dir=session_dir)
+    finalized = resumable.finalize(db_session, session.id, backend, session_dir)
+    name = hashlib.sha256(PNG).hexdigest() + ".png"
+
+    assert finalized.image_name == name
+    assert resumable.finalize(db_session, session.id, backend, session_dir).image_name == name
+    assert resumable.finalized_image(db_session, session.id) == name
+    assert resolve(name, backend.upload_dir) is not None
+    assert not os.path.exists(resumable.session_path(session.id, session_dir))
+    assert db_session.get(StoredImage, name).refcount == 0
+    assert db_session.get(PendingOrphan, name) is not None
+
+
+def test_finalize_rejects_non_image(db_session, session_dir, tmp_path):
+    """Test that a finished upload that is not an image is dropped"""
+    session = resumable.create_session(db_session, 5, session_dir)
+    append(db_session, session.id, 0, b"hello", session_dir=session_dir)
+
+    with pytest.raises(HTTPException) as exc_info:
+        resumable.finalize(db_session, session.id, LocalStorage(str(tmp_path)), session_dir)
+
+    assert exc_info.value.status_code == 400
+    assert db_session.get(UploadSession, session.id) is None
+    assert not os.path.exists(resumable.session_path(session.id, session_dir))
+
+
+def test_expire_sessions(db_session, session_dir):
+    """Test that stale sessions and their partial files are deleted"""
+    stale = resumable.create_session(db_session, 10, session_dir)
+    fresh = resumable.create_session(db_session, 10, session_dir)
+    stale.expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db_session.commit()
+
+    with pytest.raises(HTTPException):
+        resumable.get_session(db_session, stale.id)
+    assert resumable.expire_sessions(db_session, session_dir) == 1
+    assert not os.path.exists(resumable.session_path(stale.id, session_dir))
+    assert resumable.get_session(db_session, fresh.id) is not None
@@ -1,6 +1,7 @@
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock
+from app.routers import product as product_router
 from app.routers.product import router
 from fastapi import FastAPI
 from app.models.product_model import Product
@@ -203,6 +204,12 @@ def test_update_product_router():
     mock_existing_product.category = "Old Category"
     mock_existing_product.price = 5.0
     mock_existing_product.image_path = None  # This should be a proper value, not a mock
+    mock_existing_product.derivatives = None
+    mock_existing_product.image_width = None
+    mock_existing_product.image_height = None
+    mock_existing_product.image_bytes = None
+    mock_existing_product.dominant_color = None
+    mock_existing_product.blurhash = None
     
     # Set up query chain
     mock_db.query.return_value = mock_query
@@ -328,4 +335,39 @@ def test_delete_product_not_found():
         
         assert response.status_code == 404
         response_data = response.json()
-        assert response_data["detail"] == "Product not found"
\ No newline at end of file
+        assert response_data["detail"] == "Product not found"
+
+def test_get_all_products_cached_until_product_write(memory_engine):
+    """Test that listing responses are cached per normalized query and dropped on a product write"""
+    from app.database import get_db
+
+    TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=memory_engine)
+
+    def override_get_db():
+        db = TestingSessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    try:
+        client.post("/products/", json={"name": "Jahe", "category": "Tea", "price": 1.0})
+        with patch('app.routers.product.search_products', wraps=product_router.search_products) as search:
+            first = client.get("/products/", params={"keyword": "tea", "sort_by": "price"})
+            second = client.get("/products/", params={"sort_by": "price", "keyword": "tea", "page": 1})
+            not_modified = client.get("/products/?keyword=tea&sort_by=price",
+                                      headers={"If-None-Match": first.headers["etag"]})
+            assert search.call_count == 1
+
+            client.post("/products/", json={"name": "Kopi", "category": "Tea", "price": 2.0})
+            third = client.get("/products/", params={"keyword": "tea", "sort_by": "price"})
+            assert search.call_count == 2
+    finally:
+        del app.dependency_overrides[get_db]
+
+    assert first.headers["cache-control"].startswith("public, max-age=")
+    assert second.json() == first.json()
+    assert first.json()["total_items"] == 1
+    assert not_modified.status_code == 304
+    assert third.json()["total_items"] == 2
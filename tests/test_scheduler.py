@@ -0,0 +1,59 @@
+import time
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from sqlalchemy import create_engine
+from app.scheduler import LeaderScheduler, lock_file
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_lock_file_is_exclusive(tmp_path):
+    """Test that only one holder gets the lock until it is released"""
+    path = str(tmp_path / "scheduler.lock")
+    first = lock_file(path)
+    assert first is not None
+    assert lock_file(path) is None
+    first.close()
+    second = lock_file(path)
+    assert second is not None
+    second.close()
+
+
+def test_only_one_leader_runs_jobs(tmp_path):
+    """Test that a second worker waits and takes over when the leader stops"""
+    path = str(tmp_path / "scheduler.lock")
+    leader = LeaderScheduler(path, retry_seconds=0.05, jobstore=MemoryJobStore())
+    follower = LeaderScheduler(path, retry_seconds=0.05, jobstore=MemoryJobStore())
+    try:
+        leader.start()
+        follower.start()
+        assert leader.is_leader
+        assert not follower.is_leader
+        assert {job.id for job in leader.scheduler.get_jobs()} == {"cleanup", "reconcile", "expire_uploads", "prune_changes"}
+
+        leader.shutdown()
+        assert wait_for(lambda: follower.is_leader)
+    finally:
+        leader.shutdown()
+        follower.shutdown()
+
+
+def test_jobs_persist_in_database(tmp_path):
+    """Test that jobs are stored in the database and re-registered without duplicates"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}")
+    path = str(tmp_path / "scheduler.lock")
+    for _ in range(2):
+        leader = LeaderScheduler(path, jobstore=SQLAlchemyJobStore(engine=engine))
+        leader.start()
+        leader.shutdown()
+
+    jobs = SQLAlchemyJobStore(engine=engine)
+    jobs.start(None, "default")
+    stored = jobs.get_all_jobs()
+    assert sorted(job.id for job in stored) == ["cleanup", "expire_uploads", "prune_changes", "reconcile"]
+    assert stored[0].coalesce is True
@@ -0,0 +1,73 @@
+import os
+from sqlalchemy import create_engine, func, select
+import seed
+from app.database import init_db
+from app.models import Product, StoredImage, User
+from app.storage import prepare_path
+
+
+def make_engine(path):
+    engine = create_engine(f"sqlite:///{path}")
+    init_db(engine)
+    return engine
+
+
+def products_of(engine):
+    with engine.connect() as conn:
+        return conn.execute(select(Product.name, Product.category, Product.price).order_by(Product.id)).all()
+
+
+def test_generate_is_deterministic(tmp_path):
+    first, second = make_engine(tmp_path / "a.db"), make_engine(tmp_path / "b.db")
+    seed.generate(first, products=500, seed=7, batch_size=128)
+    seed.generate(second, products=500, seed=7, batch_size=128)
+    other = make_engine(tmp_path / "c.db")
+    seed.generate(other, products=500, seed=8)
+
+    rows = products_of(first)
+    assert len(rows) == 500
+    assert rows == products_of(second)
+    assert rows != products_of(other)
+    categories = {category for _, (category, _) in seed.FORMS.items()}
+    assert {category for _, category, _ in rows} <= categories
+    assert all(price >= seed.PRICE_STEP and price % seed.PRICE_STEP == 0 for _, _, price in rows)
+
+
+def test_generate_images_keeps_refcounts(tmp_path):
+    engine = make_engine(tmp_path / "a.db")
+    counts = seed.generate(engine, products=1000, images=0.5, image_files=5, upload_dir=str(tmp_path / "uploads"))
+
+    assert counts == {"products": 1000, "users": 0, "images": 5}
+    with engine.connect() as conn:
+        with_image = conn.execute(select(func.count()).where(Product.image_path.is_not(None))).scalar()
+        refcounts = conn.execute(select(func.sum(StoredImage.refcount))).scalar()
+        paths = conn.execute(select(Product.image_path).where(Product.image_path.is_not(None)).distinct()).scalars()
+        assert all((tmp_path / "uploads").joinpath(*path.split("/")[-3:]).exists() for path in paths)
+    assert 400 < with_image < 600
+    assert refcounts == with_image
+    with engine.connect() as conn:
+        sizes = conn.execute(select(StoredImage.name, StoredImage.size)).all()
+    assert all(size == os.path.getsize(prepare_path(name, str(tmp_path / "uploads"))) for name, size in sizes)
+
+
+def test_generate_leaves_pool_connections_at_default_pragmas(tmp_path):
+    engine = make_engine(tmp_path / "a.db")
+    seed.generate(engine, products=10)
+
+    # Every connection the pool holds, not just the next one out
+    conns = [engine.connect() for _ in range(3)]
+    try:
+        for conn in conns:
+            assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 2  # FULL
+            assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "delete"
+    finally:
+        for conn in conns:
+            conn.close()
+
+
+def test_generate_users_skips_existing(tmp_path):
+    engine = make_engine(tmp_path / "a.db")
+    assert seed.generate(engine, users=3)["users"] == 3
+    assert seed.generate(engine, users=5)["users"] == 2
+    with engine.connect() as conn:
+        assert conn.execute(select(func.count()).select_from(User)).scalar() == 5
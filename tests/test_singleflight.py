@@ -0,0 +1,90 @@
+import asyncio
+import threading
+import time
+import pytest
+from app import singleflight
+
+
+def test_key_ignores_parameter_order():
+    assert singleflight.key("/products/", skip=0, limit=10) == singleflight.key("/products/", limit=10, skip=0)
+    assert singleflight.key("/products/", skip=0) != singleflight.key("/products/", skip=10)
+
+
+def test_do_shares_one_call_between_threads():
+    group = singleflight.Group("test_threads")
+    release = threading.Event()
+    calls = []
+
+    def load():
+        calls.append(1)
+        release.wait(5)
+        return {"id": 1}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(group.do("k", load))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while group.coalesced < 4:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{"id": 1}] * 5
+    assert group.calls == 1 and group.coalesced == 4
+    # Nothing is kept once the call is done
+    assert group.do("k", lambda: "fresh") == "fresh"
+
+
+def test_do_raises_for_every_waiter():
+    group = singleflight.Group("test_errors")
+    release = threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise ValueError("boom")
+
+    errors = []
+
+    def call():
+        try:
+            group.do("k", fail)
+        except ValueError as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    while group.coalesced < 2:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 3
+
+
+@pytest.mark.parametrize("is_async", [True, False])
+def test_do_async_coalesces(is_async):
+    group = singleflight.Group("test_async")
+    calls = []
+
+    async def load_async(value):
+        calls.append(value)
+        await asyncio.sleep(0.05)
+        return value * 2
+
+    def load_sync(value):
+        calls.append(value)
+        time.sleep(0.05)
+        return value * 2
+
+    async def main():
+        load = load_async if is_async else load_sync
+        same = [group.do_async("a", load, 1) for _ in range(4)]
+        other = group.do_async("b", load, 5)
+        return await asyncio.gather(*same, other)
+
+    assert asyncio.run(main()) == [2, 2, 2, 2, 10]
+    assert sorted(calls) == [1, 5]
+    assert group.calls == 2 and group.coalesced == 3
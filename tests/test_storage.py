@@ -0,0 +1,161 @@
+import os
+import pytest
+from app.storage import relative_path, file_path, prepare_path, resolve, url, remove, migrate_flat_files, iter_files
+
+
+def test_relative_path_is_sharded():
+    """Test the two-level prefix layout"""
+    assert relative_path("abcdef.jpg") == os.path.join("ab", "cd", "abcdef.jpg")
+    # Short names are padded so they still get two levels
+    assert relative_path("a.png") == os.path.join("a_", "__", "a.png")
+
+
+def test_url_does_not_depend_on_layout():
+    """Test that URLs stay flat"""
+    assert url("abcdef.jpg") == "/uploads/abcdef.jpg"
+
+
+def test_resolve_finds_sharded_and_flat_files(tmp_path):
+    """Test that both layouts are found during a migration"""
+    with open(prepare_path("abcdef.jpg", str(tmp_path)), "wb") as f:
+        f.write(b"x")
+    (tmp_path / "123456.jpg").write_bytes(b"y")
+
+    assert resolve("abcdef.jpg", str(tmp_path)) == file_path("abcdef.jpg", str(tmp_path))
+    assert resolve("123456.jpg", str(tmp_path)) == str(tmp_path / "123456.jpg")
+    assert resolve("missing.jpg", str(tmp_path)) is None
+
+
+def test_remove(tmp_path):
+    """Test removing a file from either layout"""
+    (tmp_path / "123456.jpg").write_bytes(b"y")
+
+    assert remove("123456.jpg", str(tmp_path)) is True
+    assert remove("123456.jpg", str(tmp_path)) is False
+
+
+def test_iter_files_walks_both_layouts(tmp_path):
+    """Test listing sharded and flat files, without temp files"""
+    with open(prepare_path("abcdef.jpg", str(tmp_path)), "wb") as f:
+        f.write(b"abc")
+    (tmp_path / "flat.png").write_bytes(b"x")
+    (tmp_path / ".upload-1.part").write_bytes(b"x")
+
+    files = {name: size for name, size, _ in iter_files(str(tmp_path))}
+
+    assert files == {"abcdef.jpg": 3, "flat.png": 1}
+
+
+def test_migrate_flat_files_is_resumable(tmp_path):
+    """Test moving flat files into shards in several runs"""
+    names = [f"{i:04d}abcd.jpg" for i in range(5)]
+    for name in names:
+        (tmp_path / name).write_bytes(name.encode())
+    (tmp_path / ".upload-tmp.part").write_bytes(b"partial")
+
+    assert migrate_flat_files(str(tmp_path), limit=2) == 2
+    assert migrate_flat_files(str(tmp_path)) == 3
+    assert migrate_flat_files(str(tmp_path)) == 0
+
+    for name in names:
+        path = resolve(name, str(tmp_path))
+        assert path == file_path(name, str(tmp_path))
+        with open(path, "rb") as f:
+            assert f.read() == name.encode()
+    # Temp files of uploads in progress are left alone
+    assert (tmp_path / ".upload-tmp.part").exists()
+
+
+@pytest.fixture
+def s3_storage(tmp_path):
+    """S3Storage against a moto stand-in bucket"""
+    moto = pytest.importorskip("moto")
+    boto3 = pytest.importorskip("boto3")
+    from app.storage import S3Storage
+
+    with moto.mock_aws():
+        client = boto3.client(
+            "s3", region_name="us-east-1", aws_access_key_id="test", aws_secret_access_key="test"
+        )
+        client.create_bucket(Bucket="product-images")
+        yield S3Storage(bucket="product-images", prefix="images", client=client)
+
+
+def test_s3_storage_store_and_delete(s3_storage, tmp_path):
+    """Test storing, reading and deleting an object"""
+    src = tmp_path / "upload.part"
+    src.write_bytes(b"\x89PNG\r\n\x1a\ncontent")
+
+    location = s3_storage.store(str(src), "abcdef.png")
+
+    assert location == "s3://product-images/images/ab/cd/abcdef.png"
+    assert not src.exists()
+    assert s3_storage.exists("abcdef.png")
+    assert s3_storage.read_head("abcdef.png", 8) == b"\x89PNG\r\n\x1a\n"
+    head = s3_storage.client.head_object(Bucket="product-images", Key="images/ab/cd/abcdef.png")
+    assert head["ContentType"] == "image/png"
+    assert "immutable" in head["CacheControl"]
+
+    with s3_storage.local_copy("abcdef.png") as path:
+        with open(path, "rb") as f:
+            assert f.read() == b"\x89PNG\r\n\x1a\ncontent"
+
+    assert s3_storage.delete("abcdef.png") is True
+    assert s3_storage.exists("abcdef.png") is False
+    assert s3_storage.delete("abcdef.png") is False
+    with pytest.raises(FileNotFoundError):
+        with s3_storage.local_copy("abcdef.png"):
+            pass
+
+
+def test_s3_storage_iter_files(s3_storage, tmp_path):
+    """Test listing stored images under the prefix, skipping other objects in the bucket"""
+    image, derivative = "a" * 64 + ".png", "b" * 64 + "_thumb.webp"
+    for name in [image, derivative]:
+        src = tmp_path / name
+        src.write_bytes(b"data")
+        s3_storage.store(str(src), name)
+    for key in ["images/notes.txt", "images/ab/cd/" + "a" * 64 + ".png", "backups/" + "c" * 64 + ".png"]:
+        s3_storage.client.put_object(Bucket="product-images", Key=key, Body=b"other")
+
+    files = {name: size for name, size, _ in s3_storage.iter_files()}
+
+    assert files == {image: 4, derivative: 4}
+
+
+def test_s3_storage_presigned_urls(s3_storage):
+    """Test presigned upload and read URLs"""
+    requests = pytest.importorskip("requests")
+
+    upload = s3_storage.presigned_upload("abcdef.png", "image/png", size=13)
+    assert upload["method"] == "PUT"
+    response = requests.put(upload["url"], data=b"\x89PNG\r\n\x1a\nbytes", headers=upload["headers"])
+    assert response.status_code == 200
+    assert s3_storage.exists("abcdef.png")
+
+    read_url = s3_storage.read_url("abcdef.png")
+    assert "images/ab/cd/abcdef.png" in read_url
+    assert requests.get(read_url).content == b"\x89PNG\r\n\x1a\nbytes"
+
+
+def test_copy_upload_to_s3(s3_storage, tmp_path, memory_engine):
+    """Test that uploads are hashed locally and stored in the bucket"""
+    import io
+    from app.uploads import copy_upload
+
+    location = copy_upload(
+        io.BytesIO(b"\xff\xd8\xff\xe0" + b"\x00" * 64), str(tmp_path), memory_engine, backend=s3_storage
+    )
+
+    name = os.path.basename(location)
+    assert location.startswith("s3://product-images/images/")
+    assert s3_storage.exists(name)
+
+
+def test_local_storage_has_no_presigned_upload(tmp_path):
+    """Test that the local backend serves files itself"""
+    from app.storage import LocalStorage
+
+    backend = LocalStorage(str(tmp_path))
+    assert backend.presigned_upload("abcdef.png", "image/png") is None
+    assert backend.read_url("abcdef.png") is None
@@ -0,0 +1,139 @@
+import io
+import os
+import asyncio
+import pytest
+from fastapi import HTTPException
+from app.uploads import detect_image_ext, copy_upload, stream_upload, check_content_length
+from app.storage import relative_path
+
+
+PNG_BYTES = b"\x89PNG\r\n\x1a\n" + b"\x00" * 100
+JPG_BYTES = b"\xff\xd8\xff\xe0" + b"\x00" * 100
+
+
+def test_detect_image_ext():
+    """Test detecting the image type from magic bytes"""
+    assert detect_image_ext(PNG_BYTES) == ".png"
+    assert detect_image_ext(JPG_BYTES) == ".jpg"
+    assert detect_image_ext(b"GIF89a") is None
+
+
+def test_copy_upload(tmp_path, memory_engine):
+    """Test copying an upload in chunks keeps the content"""
+    file_path = copy_upload(io.BytesIO(JPG_BYTES), str(tmp_path), memory_engine, chunk_size=7)
+
+    assert file_path.endswith(".jpg")
+    with open(file_path, "rb") as f:
+        assert f.read() == JPG_BYTES
+    # Stored in the sharded layout, no temp files left behind
+    assert os.path.relpath(file_path, tmp_path) == relative_path(os.path.basename(file_path))
+    assert [name for name in os.listdir(tmp_path) if name.startswith(".")] == []
+
+
+def test_copy_upload_ignores_extension_and_checks_content(tmp_path, memory_engine):
+    """Test that a non-image is rejected whatever its name says"""
+    with pytest.raises(HTTPException) as exc_info:
+        copy_upload(io.BytesIO(b"<html>not an image</html>"), str(tmp_path), memory_engine)
+
+    assert exc_info.value.status_code == 400
+    assert os.listdir(tmp_path) == []
+
+
+def test_copy_upload_too_large(tmp_path, memory_engine):
+    """Test that the size limit is enforced while copying"""
+    with pytest.raises(HTTPException) as exc_info:
+        copy_upload(io.BytesIO(PNG_BYTES), str(tmp_path), memory_engine, max_size=50, chunk_size=16)
+
+    assert exc_info.value.status_code == 413
+    assert os.listdir(tmp_path) == []
+
+
+def test_stream_upload(tmp_path, memory_engine):
+    """Test writing an async stream of chunks"""
+    async def chunks():
+        for i in range(0, len(PNG_BYTES), 10):
+            yield PNG_BYTES[i:i + 10]
+
+    file_path = asyncio.run(stream_upload(chunks(), str(tmp_path), memory_engine))
+
+    assert file_path.endswith(".png")
+    with open(file_path, "rb") as f:
+        assert f.read() == PNG_BYTES
+
+
+def test_stream_upload_too_large(tmp_path, memory_engine):
+    """Test that a stream over the limit is aborted and cleaned up"""
+    async def chunks():
+        yield PNG_BYTES
+        yield PNG_BYTES
+
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(stream_upload(chunks(), str(tmp_path), memory_engine, max_size=len(PNG_BYTES)))
+
+    assert exc_info.value.status_code == 413
+    assert os.listdir(tmp_path) == []
+
+
+def test_check_content_length():
+    """Test rejecting a declared size over the limit"""
+    check_content_length(None, max_size=10)
+    check_content_length("10", max_size=10)
+    with pytest.raises(HTTPException) as exc_info:
+        check_content_length("11", max_size=10)
+    assert exc_info.value.status_code == 413
+
+
+def test_copy_upload_names_by_content_and_deduplicates(tmp_path, memory_engine):
+    """Test that identical uploads are stored once under their content hash"""
+    import hashlib
+
+    first = copy_upload(io.BytesIO(PNG_BYTES), str(tmp_path), memory_engine)
+    second = copy_upload(io.BytesIO(PNG_BYTES), str(tmp_path), memory_engine)
+
+    assert first == second
+    assert os.path.basename(first) == hashlib.sha256(PNG_BYTES).hexdigest() + ".png"
+    # Stored once, and no temp files left anywhere in the sharded tree
+    stored = [os.path.join(root, name) for root, _, names in os.walk(tmp_path) for name in names]
+    assert stored == [first]
+
+
+def test_copy_upload_claims_reused_name(tmp_path, memory_engine):
+    """Test that reusing a stored file restarts its grace period before storage is looked at"""
+    import hashlib
+    from datetime import datetime, timedelta
+    from sqlalchemy.orm import Session
+    from app.models import PendingOrphan, StoredImage
+
+    engine = memory_engine
+    name = hashlib.sha256(PNG_BYTES).hexdigest() + ".png"
+    first = copy_upload(io.BytesIO(PNG_BYTES), str(tmp_path), engine)
+    old = datetime.now().timestamp() - 7200
+    os.utime(first, (old, old))
+    with Session(engine) as db:
+        db.get(PendingOrphan, name).queued_at = datetime.utcnow() - timedelta(hours=2)
+        db.commit()
+
+    copy_upload(io.BytesIO(PNG_BYTES), str(tmp_path), engine)
+
+    with Session(engine) as db:
+        assert db.get(StoredImage, name).refcount == 0
+        assert db.get(PendingOrphan, name).queued_at > datetime.utcnow() - timedelta(minutes=1)
+    assert os.path.getmtime(first) > old + 3600
+
+
+def test_check_stored_image_too_large(tmp_path, memory_engine):
+    """Test that an object uploaded straight to storage is refused when over the size limit"""
+    import hashlib
+    from app.storage import LocalStorage, prepare_path
+    from app.uploads import check_stored_image
+
+    engine = memory_engine
+    name = hashlib.sha256(PNG_BYTES).hexdigest() + ".png"
+    with open(prepare_path(name, str(tmp_path)), "wb") as f:
+        f.write(PNG_BYTES)
+    backend = LocalStorage(str(tmp_path))
+
+    assert check_stored_image(name, backend, engine).endswith(name)
+    with pytest.raises(HTTPException) as exc:
+        check_stored_image(name, backend, engine, max_size=len(PNG_BYTES) - 1)
+    assert exc.value.status_code == 413